@@ -0,0 +1,102 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-06-01 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.database import GUID
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+message_type = sa.Enum('TEXT', 'IMAGE', 'VIDEO', 'AUDIO', 'FILE', 'LOCATION', 'SYSTEM', name='messagetype')
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('id', GUID(), primary_key=True),
+        sa.Column('username', sa.String(50), nullable=False, unique=True),
+        sa.Column('email', sa.String(100), nullable=False, unique=True),
+        sa.Column('hashed_password', sa.String(255), nullable=False),
+        sa.Column('is_active', sa.Boolean()),
+        sa.Column('online_status', sa.Boolean()),
+        sa.Column('last_seen', sa.DateTime(timezone=True)),
+        sa.Column('profile_image', sa.String(500)),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+    # Ссылка chats.last_message_id -> messages добавляется после создания messages
+    op.create_table(
+        'chats',
+        sa.Column('id', GUID(), primary_key=True),
+        sa.Column('user1_id', GUID(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('user2_id', GUID(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True)),
+        sa.Column('is_active', sa.Boolean()),
+        sa.Column('last_message_id', GUID(), nullable=True),
+        sa.Column('unread_count_user1', sa.Integer()),
+        sa.Column('unread_count_user2', sa.Integer()),
+        sa.UniqueConstraint('user1_id', 'user2_id', name='unique_chat_users'),
+    )
+
+    op.create_table(
+        'messages',
+        sa.Column('id', GUID(), primary_key=True),
+        sa.Column('chat_id', GUID(), sa.ForeignKey('chats.id'), nullable=False),
+        sa.Column('sender_id', GUID(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('receiver_id', GUID(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('message_type', message_type),
+        sa.Column('content', sa.Text()),
+        sa.Column('media_url', sa.String(500)),
+        sa.Column('file_name', sa.String(255)),
+        sa.Column('file_size', sa.Integer()),
+        sa.Column('file_type', sa.String(50)),
+        sa.Column('latitude', sa.Float()),
+        sa.Column('longitude', sa.Float()),
+        sa.Column('reply_to_id', GUID(), sa.ForeignKey('messages.id'), nullable=True),
+        sa.Column('forwarded_from_id', GUID(), sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('is_read', sa.Boolean()),
+        sa.Column('read_at', sa.DateTime(timezone=True)),
+        sa.Column('extra_data', sa.JSON()),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True)),
+    )
+
+    with op.batch_alter_table('chats') as batch_op:
+        batch_op.create_foreign_key('fk_chats_last_message_id', 'messages', ['last_message_id'], ['id'])
+
+    op.create_table(
+        'message_read_status',
+        sa.Column('id', GUID(), primary_key=True),
+        sa.Column('message_id', GUID(), sa.ForeignKey('messages.id'), nullable=False),
+        sa.Column('user_id', GUID(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('read_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+    op.create_table(
+        'typing_status',
+        sa.Column('id', GUID(), primary_key=True),
+        sa.Column('chat_id', GUID(), sa.ForeignKey('chats.id'), nullable=False),
+        sa.Column('user_id', GUID(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('is_typing', sa.Boolean()),
+        sa.Column('started_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True)),
+    )
+
+
+def downgrade():
+    op.drop_table('typing_status')
+    op.drop_table('message_read_status')
+    with op.batch_alter_table('chats') as batch_op:
+        batch_op.drop_constraint('fk_chats_last_message_id', type_='foreignkey')
+    op.drop_table('messages')
+    op.drop_table('chats')
+    op.drop_table('users')
+    message_type.drop(op.get_bind(), checkfirst=True)
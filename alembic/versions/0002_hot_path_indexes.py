@@ -0,0 +1,35 @@
+"""hot path indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-06-02 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # История чата и keyset-пагинация: WHERE chat_id = ? ORDER BY created_at, id
+    op.create_index('ix_messages_chat_created_id', 'messages', ['chat_id', 'created_at', 'id'])
+    # Непрочитанные сообщения получателя: частичный индекс только по is_read = false
+    op.create_index('ix_messages_receiver_unread', 'messages', ['receiver_id', 'chat_id'],
+                    sqlite_where=sa.text('is_read = 0'), postgresql_where=sa.text('is_read = false'))
+    # Список чатов: WHERE user1_id = ? OR user2_id = ? ORDER BY updated_at
+    op.create_index('ix_chats_user1_updated', 'chats', ['user1_id', 'updated_at'])
+    op.create_index('ix_chats_user2_updated', 'chats', ['user2_id', 'updated_at'])
+    op.create_index('ix_typing_status_chat_user', 'typing_status', ['chat_id', 'user_id'])
+    op.create_index('ix_typing_status_updated_at', 'typing_status', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index('ix_typing_status_updated_at', table_name='typing_status')
+    op.drop_index('ix_typing_status_chat_user', table_name='typing_status')
+    op.drop_index('ix_chats_user2_updated', table_name='chats')
+    op.drop_index('ix_chats_user1_updated', table_name='chats')
+    op.drop_index('ix_messages_receiver_unread', table_name='messages')
+    op.drop_index('ix_messages_chat_created_id', table_name='messages')
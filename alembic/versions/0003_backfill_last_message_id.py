@@ -0,0 +1,26 @@
+"""backfill chats.last_message_id
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-06-03 00:00:00
+"""
+from alembic import op
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Раньше last_message_id присваивался до flush сообщения и оставался NULL
+    op.execute(
+        "UPDATE chats SET last_message_id = ("
+        "SELECT messages.id FROM messages WHERE messages.chat_id = chats.id "
+        "ORDER BY messages.created_at DESC, messages.id DESC LIMIT 1"
+        ") WHERE last_message_id IS NULL"
+    )
+
+
+def downgrade():
+    pass
@@ -0,0 +1,68 @@
+"""per-chat read watermarks instead of per-message read rows
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-06-04 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.database import GUID
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'chat_read_state',
+        sa.Column('chat_id', GUID(), sa.ForeignKey('chats.id'), primary_key=True),
+        sa.Column('user_id', GUID(), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('last_read_message_id', GUID(), sa.ForeignKey('messages.id'), nullable=False),
+        sa.Column('last_read_created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+    # Отметка прочтения = последнее прочитанное сообщение получателя в каждом чате
+    op.execute(
+        "INSERT INTO chat_read_state (chat_id, user_id, last_read_message_id, last_read_created_at, updated_at) "
+        "SELECT m.chat_id, m.receiver_id, m.id, m.created_at, COALESCE(m.read_at, CURRENT_TIMESTAMP) "
+        "FROM messages m WHERE m.is_read = true AND NOT EXISTS ("
+        "SELECT 1 FROM messages n WHERE n.chat_id = m.chat_id AND n.receiver_id = m.receiver_id "
+        "AND n.is_read = true AND (n.created_at > m.created_at OR (n.created_at = m.created_at AND n.id > m.id)))"
+    )
+
+    op.drop_table('message_read_status')
+    op.drop_index('ix_messages_receiver_unread', table_name='messages')
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_column('read_at')
+        batch_op.drop_column('is_read')
+    op.create_index('ix_messages_chat_receiver_created_id', 'messages',
+                    ['chat_id', 'receiver_id', 'created_at', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_messages_chat_receiver_created_id', table_name='messages')
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.add_column(sa.Column('is_read', sa.Boolean()))
+        batch_op.add_column(sa.Column('read_at', sa.DateTime(timezone=True)))
+
+    op.execute(
+        "UPDATE messages SET is_read = EXISTS ("
+        "SELECT 1 FROM chat_read_state s WHERE s.chat_id = messages.chat_id AND s.user_id = messages.receiver_id "
+        "AND (messages.created_at < s.last_read_created_at OR (messages.created_at = s.last_read_created_at "
+        "AND messages.id <= s.last_read_message_id)))"
+    )
+    op.create_index('ix_messages_receiver_unread', 'messages', ['receiver_id', 'chat_id'],
+                    sqlite_where=sa.text('is_read = 0'), postgresql_where=sa.text('is_read = false'))
+
+    op.create_table(
+        'message_read_status',
+        sa.Column('id', GUID(), primary_key=True),
+        sa.Column('message_id', GUID(), sa.ForeignKey('messages.id'), nullable=False),
+        sa.Column('user_id', GUID(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('read_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.drop_table('chat_read_state')
@@ -0,0 +1,28 @@
+"""normalize SQLite message timestamps to microsecond precision
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-06-05 00:00:00
+"""
+from alembic import op
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CURRENT_TIMESTAMP в SQLite пишет 'YYYY-MM-DD HH:MM:SS', а SQLAlchemy передает параметры
+    # как 'YYYY-MM-DD HH:MM:SS.ffffff'. Строковое сравнение таких значений ломает keyset-курсоры.
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    op.execute("UPDATE messages SET created_at = created_at || '.000000' WHERE length(created_at) = 19")
+    op.execute(
+        "UPDATE chat_read_state SET last_read_created_at = last_read_created_at || '.000000' "
+        "WHERE length(last_read_created_at) = 19"
+    )
+
+
+def downgrade():
+    pass
@@ -0,0 +1,35 @@
+"""drop typing_status: typing indicators live in memory
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-06-06 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.database import GUID
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index('ix_typing_status_updated_at', table_name='typing_status')
+    op.drop_index('ix_typing_status_chat_user', table_name='typing_status')
+    op.drop_table('typing_status')
+
+
+def downgrade():
+    op.create_table(
+        'typing_status',
+        sa.Column('id', GUID(), primary_key=True),
+        sa.Column('chat_id', GUID(), sa.ForeignKey('chats.id'), nullable=False),
+        sa.Column('user_id', GUID(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('is_typing', sa.Boolean()),
+        sa.Column('started_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True)),
+    )
+    op.create_index('ix_typing_status_chat_user', 'typing_status', ['chat_id', 'user_id'])
+    op.create_index('ix_typing_status_updated_at', 'typing_status', ['updated_at'])
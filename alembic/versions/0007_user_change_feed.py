@@ -0,0 +1,37 @@
+"""per-user change feed for incremental sync
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2024-06-07 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.database import GUID
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('change_seq', sa.Integer(), nullable=False, server_default='0'))
+
+    # Первичный ключ (user_id, seq) - выборка "все после since" идет диапазоном индекса
+    op.create_table(
+        'user_changes',
+        sa.Column('user_id', GUID(), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('seq', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('kind', sa.String(32), nullable=False),
+        sa.Column('chat_id', GUID()),
+        sa.Column('payload', sa.JSON()),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+
+def downgrade():
+    op.drop_table('user_changes')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('change_seq')
@@ -0,0 +1,51 @@
+"""per-user chat inbox projection
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2024-06-08 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.database import GUID
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'chat_inbox',
+        sa.Column('user_id', GUID(), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('chat_id', GUID(), sa.ForeignKey('chats.id'), primary_key=True),
+        sa.Column('other_user_id', GUID(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('last_message_id', GUID(), sa.ForeignKey('messages.id')),
+        sa.Column('last_message_preview', sa.String(200)),
+        sa.Column('last_message_at', sa.DateTime(timezone=True)),
+        sa.Column('unread_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index('ix_chat_inbox_user_updated', 'chat_inbox', ['user_id', 'updated_at'])
+
+    # По строке на каждого участника активного чата; архивные чаты в список не попадают.
+    # Чат с самим собой дает одну строку
+    for user_column, other_column, unread_column, extra in (
+            ('user1_id', 'user2_id', 'unread_count_user1', ''),
+            ('user2_id', 'user1_id', 'unread_count_user2', ' AND c.user1_id <> c.user2_id')):
+        op.execute(
+            "INSERT INTO chat_inbox (user_id, chat_id, other_user_id, last_message_id, last_message_preview, "
+            "last_message_at, unread_count, created_at, updated_at) "
+            f"SELECT c.{user_column}, c.id, c.{other_column}, c.last_message_id, "
+            "COALESCE(NULLIF(substr(m.content, 1, 200), ''), m.file_name, lower(CAST(m.message_type AS VARCHAR))), "
+            f"m.created_at, COALESCE(c.{unread_column}, 0), c.created_at, COALESCE(c.updated_at, c.created_at) "
+            "FROM chats c LEFT JOIN messages m ON m.id = c.last_message_id "
+            f"WHERE c.is_active = true{extra}"
+        )
+
+
+def downgrade():
+    op.drop_index('ix_chat_inbox_user_updated', table_name='chat_inbox')
+    op.drop_table('chat_inbox')
@@ -0,0 +1,48 @@
+"""unread counters are NOT NULL and recomputed from read watermarks
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2024-06-09 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+UNREAD_SINCE_WATERMARK = (
+    "(SELECT count(*) FROM messages m WHERE m.chat_id = {chat} AND m.receiver_id = {user} AND NOT EXISTS ("
+    "SELECT 1 FROM chat_read_state s WHERE s.chat_id = {chat} AND s.user_id = {user} "
+    "AND (m.created_at < s.last_read_created_at "
+    "OR (m.created_at = s.last_read_created_at AND m.id <= s.last_read_message_id))))"
+)
+
+
+def upgrade():
+    # NULL + 1 = NULL: счетчики, созданные в обход значения по умолчанию, не росли бы вовсе.
+    # Заодно исправляются увеличения, потерянные при чтении-изменении-записи в Python
+    op.execute(
+        "UPDATE chats SET "
+        f"unread_count_user1 = {UNREAD_SINCE_WATERMARK.format(chat='chats.id', user='chats.user1_id')}, "
+        f"unread_count_user2 = {UNREAD_SINCE_WATERMARK.format(chat='chats.id', user='chats.user2_id')}"
+    )
+    op.execute(
+        "UPDATE chat_inbox SET unread_count = "
+        f"{UNREAD_SINCE_WATERMARK.format(chat='chat_inbox.chat_id', user='chat_inbox.user_id')}"
+    )
+
+    with op.batch_alter_table('chats') as batch_op:
+        batch_op.alter_column('unread_count_user1', existing_type=sa.Integer(), nullable=False,
+                              server_default='0')
+        batch_op.alter_column('unread_count_user2', existing_type=sa.Integer(), nullable=False,
+                              server_default='0')
+
+
+def downgrade():
+    with op.batch_alter_table('chats') as batch_op:
+        batch_op.alter_column('unread_count_user2', existing_type=sa.Integer(), nullable=True,
+                              server_default=None)
+        batch_op.alter_column('unread_count_user1', existing_type=sa.Integer(), nullable=True,
+                              server_default=None)
@@ -0,0 +1,135 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+import time
+
+from app.config import settings
+
+
+class TTLCache:
+    """Ограниченный LRU-кэш с временем жизни записей"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (expires_at по monotonic, value); порядок = порядок использования
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def pop(self, key: Hashable):
+        return self._data.pop(key, (None, None))[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class AuthCache:
+    """Кэш проверенных JWT и строк пользователей для get_current_user.
+
+    Пользователь хранится отсоединенным от сессии объектом (expire_on_commit=False),
+    поэтому маршруты читают его атрибуты без запроса к БД.
+    Кэш свой у каждого воркера: инвалидация рассылается остальным через канал брокера.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        # token -> user_id (str)
+        self.tokens = TTLCache(max_size, ttl)
+        # user_id (str) -> models.User
+        self.users = TTLCache(max_size, ttl)
+        # user_id -> токены пользователя в кэше, для явной инвалидации
+        self._user_tokens: Dict[str, Set[str]] = {}
+        self.broker = None
+
+    async def start(self, broker):
+        self.broker = broker
+        await broker.subscribe(settings.AUTH_CACHE_CHANNEL, self._on_remote)
+
+    async def stop(self):
+        if self.broker is not None:
+            await self.broker.unsubscribe(settings.AUTH_CACHE_CHANNEL, self._on_remote)
+            self.broker = None
+
+    def get_token(self, token: str) -> Optional[str]:
+        return self.tokens.get(token)
+
+    def set_token(self, token: str, user_id: str, expires_at: Optional[float] = None):
+        """Запомнить проверенный токен не дольше срока его действия (exp, unix time)"""
+        ttl = expires_at - time.time() if expires_at is not None else None
+        self.tokens.set(token, user_id, ttl)
+        # Заодно забываем токены пользователя, вытесненные из кэша
+        live = {cached for cached in self._user_tokens.get(user_id, ()) if cached in self.tokens}
+        live.add(token)
+        self._user_tokens[user_id] = live
+
+    def get_user(self, user_id: str):
+        return self.users.get(user_id)
+
+    def set_user(self, user):
+        self.users.set(str(user.id), user)
+
+    def invalidate_user(self, user_id):
+        """Сбросить пользователя и все его токены (деактивация, смена пароля)"""
+        user_id = str(user_id)
+        self.users.pop(user_id)
+        for token in self._user_tokens.pop(user_id, ()):
+            self.tokens.pop(token)
+
+    async def publish_invalidation(self, user_id):
+        """Сбросить пользователя здесь и в кэшах остальных воркеров"""
+        self.invalidate_user(user_id)
+        if self.broker is not None:
+            await self.broker.publish(settings.AUTH_CACHE_CHANNEL, str(user_id))
+
+    async def _on_remote(self, channel: str, message: str):
+        self.invalidate_user(message)
+
+    def clear(self):
+        self.tokens.clear()
+        self.users.clear()
+        self._user_tokens.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"tokens": self.tokens.stats(), "users": self.users.stats()}
+
+
+auth_cache = AuthCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
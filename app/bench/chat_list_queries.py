@@ -0,0 +1,89 @@
+"""Бенчмарк списка чатов: число SQL-запросов и задержка в зависимости от числа чатов.
+
+Запуск: python -m app.bench.chat_list_queries [--chats 10 100 500] [--repeat R]
+Сравнивает прежнюю схему (чаты, затем собеседник и последнее сообщение отдельными запросами
+на каждый чат) с CRUDChat.get_chat_list. Запросы считаются слушателем before_cursor_execute.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from sqlalchemy import event, or_, select
+
+from app import models
+from app.bench.common import create_users, open_sessions, percentile, temporary_database
+from app.crud import CRUDChat
+from app.message_service import MessageService
+
+
+async def per_chat_queries(db, user_id):
+    """Список чатов, как его строили маршруты до chat_inbox: 1 + 2N запросов"""
+    result = await db.execute(select(models.Chat).where(
+        or_(models.Chat.user1_id == user_id, models.Chat.user2_id == user_id),
+        models.Chat.is_active == True).order_by(models.Chat.updated_at.desc()))
+    rows = []
+    for chat in result.scalars().all():
+        other_user_id = chat.user2_id if chat.user1_id == user_id else chat.user1_id
+        other = (await db.execute(select(models.User).where(models.User.id == other_user_id))).scalars().first()
+        last_message = (await db.execute(select(models.Message).where(models.Message.chat_id == chat.id)
+                                         .order_by(models.Message.created_at.desc()).limit(1))).scalars().first()
+        rows.append((chat, other, last_message))
+    return rows
+
+
+async def single_query(db, user_id):
+    return await CRUDChat(db).get_chat_list(user_id)
+
+
+async def measure(database_url: str, chats: int, repeat: int):
+    async with open_sessions(database_url) as sessions:
+        async with sessions() as db:
+            user_id, *others = await create_users(db, chats + 1)
+            service = MessageService(db)
+            for other_id in others:
+                await service.create_message(other_id, user_id, content="hello")
+            await db.commit()
+
+        engine = sessions.kw["bind"].sync_engine
+        statements = 0
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            nonlocal statements
+            statements += 1
+
+        results = {}
+        for name, build in (("per-chat queries", per_chat_queries), ("get_chat_list", single_query)):
+            latencies = []
+            event.listen(engine, "before_cursor_execute", count)
+            try:
+                for _ in range(repeat):
+                    statements = 0
+                    async with sessions() as db:
+                        started = time.perf_counter()
+                        rows = await build(db, user_id)
+                        latencies.append(time.perf_counter() - started)
+                    assert len(rows) == chats
+            finally:
+                event.remove(engine, "before_cursor_execute", count)
+            results[name] = (statements, percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000)
+        return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Chat list: query count and latency by number of chats")
+    parser.add_argument("--chats", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'chats':>6}  {'variant':<18}{'queries':>8}{'p50 ms':>10}{'p95 ms':>10}")
+    for chats in args.chats:
+        with temporary_database() as database_url:
+            results = asyncio.run(measure(database_url, chats, args.repeat))
+        for name, (statements, p50, p95) in results.items():
+            print(f"{chats:>6}  {name:<18}{statements:>8}{p50:>10.2f}{p95:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""Общее для бенчмарков: временная база со схемой из миграций, движки и тестовые пользователи"""
+from contextlib import asynccontextmanager, contextmanager
+from typing import Iterator, List
+import os
+import tempfile
+import uuid
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app import models
+from app.database import configure_sqlite_engine, get_engine_options
+from app.db.migrations import run_migrations
+
+
+@contextmanager
+def temporary_database(name: str = "bench.db") -> Iterator[str]:
+    """URL временной SQLite базы с примененными миграциями (вызывать вне event loop)"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_url = f"sqlite+aiosqlite:///{os.path.join(tmp_dir, name)}"
+        run_migrations(database_url)
+        yield database_url
+
+
+@asynccontextmanager
+async def open_sessions(database_url: str, tuned: bool = True):
+    """Фабрика сессий как в приложении; tuned=False - движок по умолчанию, без профиля sqlite"""
+    if tuned:
+        engine = create_async_engine(database_url, **get_engine_options("sqlite"))
+        configure_sqlite_engine(engine)
+    else:
+        engine = create_async_engine(database_url)
+    try:
+        yield async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    finally:
+        await engine.dispose()
+
+
+async def create_users(db: AsyncSession, count: int) -> List[uuid.UUID]:
+    """Вставить count пользователей одним INSERT"""
+    user_ids = [uuid.uuid4() for _ in range(count)]
+    await db.execute(insert(models.User), [
+        {"id": user_id, "username": f"user{index}", "email": f"user{index}@example.com", "hashed_password": "x"}
+        for index, user_id in enumerate(user_ids)
+    ])
+    await db.commit()
+    return user_ids
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Перцентиль q (0..100) по выборке, ближайший ранг"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] if ordered else 0.0
@@ -0,0 +1,77 @@
+"""Микробенчмарк рассылки: сериализация на каждый сокет против одной кодировки события.
+
+Запуск: python -m app.bench.fanout_encoding [--sockets 1 3 10] [--events N]
+Событие о новом сообщении уходит двум участникам, у каждого по S сокетов. До общей кодировки
+словарь события собирался и проходил json.dumps(default=str) отдельно для каждого сокета;
+теперь Event кодируется один раз (orjson, если установлен), и строка переиспользуется.
+"""
+from datetime import datetime
+from types import SimpleNamespace
+import argparse
+import json
+import sys
+import timeit
+import uuid
+
+from app import events
+from app.events import message_event
+
+PARTICIPANTS = 2
+
+
+def make_message():
+    return SimpleNamespace(
+        id=uuid.uuid4(), chat_id=uuid.uuid4(), sender_id=uuid.uuid4(), receiver_id=uuid.uuid4(),
+        content="Привет! Как дела? " * 4, message_type="text", media_url=None, file_name=None,
+        reply_to_id=None, forwarded_from_id=None, created_at=datetime.utcnow(), is_read=False)
+
+
+def per_socket(message, sockets: int):
+    frames = []
+    for _ in range(PARTICIPANTS * sockets):
+        payload = {
+            "type": "message", "message_id": message.id, "chat_id": message.chat_id,
+            "sender_id": message.sender_id, "receiver_id": message.receiver_id, "content": message.content,
+            "message_type": message.message_type, "media_url": message.media_url,
+            "file_name": message.file_name, "reply_to_id": message.reply_to_id,
+            "forwarded_from_id": message.forwarded_from_id, "created_at": message.created_at,
+            "is_read": message.is_read,
+        }
+        frames.append(json.dumps(payload, default=str))
+    return frames
+
+
+def encoded_once(message, sockets: int):
+    event = message_event(message)
+    return [event.encode() for _ in range(PARTICIPANTS * sockets)]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fan-out serialization cost per event")
+    parser.add_argument("--sockets", type=int, nargs="+", default=[1, 3, 10])
+    parser.add_argument("--events", type=int, default=20000)
+    args = parser.parse_args()
+
+    message = make_message()
+    orjson = events.orjson
+    variants = [("json per socket", per_socket, orjson), ("encode once, json", encoded_once, None)]
+    if orjson is not None:
+        variants.append(("encode once, orjson", encoded_once, orjson))
+
+    print(f"{'sockets/user':>12}  {'variant':<22}{'us/event':>10}{'speedup':>9}")
+    for sockets in args.sockets:
+        baseline = None
+        for name, build, encoder in variants:
+            events.orjson = encoder
+            try:
+                elapsed = min(timeit.repeat(lambda: build(message, sockets), number=args.events, repeat=3))
+            finally:
+                events.orjson = orjson
+            per_event = elapsed / args.events * 1e6
+            baseline = baseline or per_event
+            print(f"{sockets:>12}  {name:<22}{per_event:>10.2f}{baseline / per_event:>8.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""Нагрузочный бенчмарк записи сообщений: commit на каждое сообщение против групповой фиксации.
+
+Запуск: python -m app.bench.group_commit [--senders C] [--messages M]
+C отправителей пишут по M сообщений своим собеседникам и ждут подтверждения каждого
+перед следующим, как клиент WebSocket. Per-message - путь handle_message без WS_GROUP_COMMIT
+(commit и рассылка на каждое сообщение); group commit - MessageBatcher, подтверждение
+приходит событием message_ack после commit пачки.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from app.bench.common import create_users, open_sessions, percentile, temporary_database
+from app.config import settings
+from app.message_batcher import MessageBatcher
+from app.message_service import MessageService, publish_message
+from app.websocket_manager import manager as ws_manager
+
+
+async def per_message(sessions, sender_id, receiver_id, index: int):
+    async with sessions() as db:
+        message, seqs = await MessageService(db).create_message(sender_id, receiver_id, content=f"message {index}")
+        await db.commit()
+    await publish_message(message, seqs)
+
+
+async def run_load(database_url: str, group_commit: bool, senders: int, messages: int) -> dict:
+    async with open_sessions(database_url) as sessions:
+        async with sessions() as db:
+            user_ids = await create_users(db, senders * 2)
+        pairs = list(zip(user_ids[:senders], user_ids[senders:]))
+
+        batcher = MessageBatcher(settings.WS_BATCH_MAX_SIZE, settings.WS_BATCH_MAX_DELAY_MS / 1000, sessions)
+        pending = {}
+
+        async def on_event(channel: str, message_json: str):
+            data = json.loads(message_json)
+            if data["type"] == "message_ack":
+                pending.pop(data["client_id"]).set_result(data["status"])
+
+        for sender_id, _ in pairs:
+            await ws_manager.broker.subscribe(ws_manager.channel_for(sender_id), on_event)
+        await batcher.start()
+
+        latencies = []
+
+        async def sender(sender_id, receiver_id):
+            for index in range(messages):
+                started = time.perf_counter()
+                if group_commit:
+                    client_id = f"{sender_id}:{index}"
+                    ack = pending[client_id] = asyncio.get_running_loop().create_future()
+                    batcher.submit(sender_id, {"type": "message", "receiver_id": str(receiver_id),
+                                               "content": f"message {index}", "client_id": client_id})
+                    assert await ack == "ok"
+                else:
+                    await per_message(sessions, sender_id, receiver_id, index)
+                latencies.append(time.perf_counter() - started)
+
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(sender(sender_id, receiver_id) for sender_id, receiver_id in pairs))
+            elapsed = time.perf_counter() - started
+        finally:
+            await batcher.stop()
+            for sender_id, _ in pairs:
+                await ws_manager.broker.unsubscribe(ws_manager.channel_for(sender_id), on_event)
+
+    return {
+        "rate": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "batch": batcher.messages / batcher.batches if batcher.batches else 1.0,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Messages/sec: per-message commit vs group commit")
+    parser.add_argument("--senders", type=int, nargs="+", default=[1, 50])
+    parser.add_argument("--messages", type=int, default=20, help="messages per sender")
+    args = parser.parse_args()
+
+    print(f"batch: max {settings.WS_BATCH_MAX_SIZE} messages / {settings.WS_BATCH_MAX_DELAY_MS} ms")
+    print(f"{'mode':<14}{'senders':>8}{'msg/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'avg batch':>11}")
+    for senders in args.senders:
+        for name, group_commit in (("per-message", False), ("group commit", True)):
+            with temporary_database() as database_url:
+                result = asyncio.run(run_load(database_url, group_commit, senders, args.messages))
+            print(f"{name:<14}{senders:>8}{result['rate']:>10.0f}{result['p50']:>10.2f}"
+                  f"{result['p99']:>10.2f}{result['batch']:>11.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
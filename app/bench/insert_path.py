@@ -0,0 +1,76 @@
+"""Бенчмарк пути вставки сообщения: движок по умолчанию против профиля sqlite.
+
+Запуск: python -m app.bench.insert_path [--messages N] [--concurrency C]
+Для каждого варианта создается временная база; сообщения пишутся через MessageService,
+каждое в своей сессии с commit - как POST /chat/messages. По умолчанию aiosqlite открывает
+соединение на каждую сессию (NullPool) в режиме журнала DELETE и synchronous=FULL;
+профиль sqlite - WAL, synchronous=NORMAL, пул соединений и очередь писателей с BEGIN IMMEDIATE.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from app.bench.common import create_users, open_sessions, percentile, temporary_database
+from app.message_service import MessageService
+
+USERS = 100
+CHATS = 50
+
+
+async def run_inserts(database_url: str, tuned: bool, messages: int, concurrency: int) -> dict:
+    async with open_sessions(database_url, tuned) as sessions:
+        async with sessions() as db:
+            user_ids = await create_users(db, USERS)
+
+        rng = random.Random(0)
+        chats = [tuple(rng.sample(user_ids, 2)) for _ in range(CHATS)]
+        pairs = [rng.choice(chats)[::rng.choice((1, -1))] for _ in range(messages)]
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, errors = [], 0
+
+        async def send(sender_id, receiver_id):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with sessions() as db:
+                        await MessageService(db).create_message(sender_id, receiver_id, content="benchmark")
+                        await db.commit()
+                except Exception:
+                    # "database is locked" при конкурирующих соединениях
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(sender_id, receiver_id) for sender_id, receiver_id in pairs))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "rate": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "errors": errors,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Message insert throughput: default engine vs sqlite profile")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 32])
+    args = parser.parse_args()
+
+    print(f"{'engine':<16}{'concurrency':>12}{'msg/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for concurrency in args.concurrency:
+        for name, tuned in (("default", False), ("sqlite profile", True)):
+            with temporary_database() as database_url:
+                result = asyncio.run(run_inserts(database_url, tuned, args.messages, concurrency))
+            print(f"{name:<16}{concurrency:>12}{result['rate']:>10.0f}{result['p50']:>10.2f}"
+                  f"{result['p99']:>10.2f}{result['errors']:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Бенчмарк пропускной способности входа: проверка пароля под конкурентной нагрузкой.
+
+Запуск: PASSWORD_HASH_ROUNDS=14 python -m app.bench.login_throughput [--logins N] [--concurrency C]
+Стоимость и размер пула берутся из настроек (PASSWORD_HASH_SCHEME, PASSWORD_HASH_ROUNDS,
+PASSWORD_HASH_WORKERS). Сравниваются verify_password в пуле потоков и та же проверка прямо
+в event loop; задержка event loop измеряется фоновой задачей с периодом LAG_INTERVAL.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from app.bench.common import percentile
+from app.config import settings
+from app.passwords import _verify_and_update, hash_password, verify_password
+
+PASSWORD = "correct horse battery staple"
+LAG_INTERVAL = 0.01
+
+
+async def verify_inline(password: str, hashed_password: str):
+    # Как обработчик до выноса хеширования из event loop
+    return _verify_and_update(password, hashed_password)
+
+
+async def run_logins(verify, hashed_password: str, logins: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, lags = [], []
+    running = True
+
+    async def watch_loop():
+        while running:
+            started = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            lags.append(time.perf_counter() - started - LAG_INTERVAL)
+
+    async def login():
+        async with semaphore:
+            started = time.perf_counter()
+            ok, _ = await verify(PASSWORD, hashed_password)
+            assert ok
+            latencies.append(time.perf_counter() - started)
+
+    watcher = asyncio.create_task(watch_loop())
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    running = False
+    await watcher
+
+    return {
+        "rate": logins / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "lag": max(lags, default=0.0) * 1000,
+    }
+
+
+async def benchmark(logins: int, concurrency_levels):
+    hashed_password = await hash_password(PASSWORD)
+    print(f"{settings.PASSWORD_HASH_SCHEME}, rounds={settings.PASSWORD_HASH_ROUNDS}, "
+          f"workers={settings.PASSWORD_HASH_WORKERS}")
+    print(f"{'variant':<14}{'concurrency':>12}{'logins/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max lag ms':>12}")
+    for concurrency in concurrency_levels:
+        for name, verify in (("event loop", verify_inline), ("thread pool", verify_password)):
+            result = await run_logins(verify, hashed_password, logins, concurrency)
+            print(f"{name:<14}{concurrency:>12}{result['rate']:>10.1f}{result['p50']:>10.1f}"
+                  f"{result['p99']:>10.1f}{result['lag']:>12.1f}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Login throughput at the configured password hash cost")
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16])
+    args = parser.parse_args()
+
+    asyncio.run(benchmark(args.logins, args.concurrency))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
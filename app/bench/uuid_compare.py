@@ -0,0 +1,65 @@
+"""Микробенчмарк накладных расходов на событие: сравнение идентификаторов строками и UUID.
+
+Запуск: python -m app.bench.uuid_compare [--events N]
+Одно событие - то, что обработчик делает с идентификаторами на каждое сообщение, прочтение
+или typing: выбор стороны чата, поиск соединений обоих участников в ConnectionManager
+и проверка, что отправитель - участник чата. До - str() с обеих сторон и словари по строкам,
+после - канонические uuid.UUID (as_uuid) и словари по UUID.
+"""
+from types import SimpleNamespace
+import argparse
+import sys
+import timeit
+import uuid
+
+from app.database import as_uuid
+
+USERS = 1000
+
+
+def make_state():
+    user_ids = [uuid.uuid4() for _ in range(USERS)]
+    chat = SimpleNamespace(id=uuid.uuid4(), user1_id=user_ids[0], user2_id=user_ids[1])
+    connections_by_str = {str(user_id): {"socket"} for user_id in user_ids}
+    connections_by_uuid = {user_id: {"socket"} for user_id in user_ids}
+    return chat, user_ids[1], user_ids[0], connections_by_str, connections_by_uuid
+
+
+def event_with_strings(chat, sender_id, receiver_id, connections):
+    is_member = str(sender_id) in (str(chat.user1_id), str(chat.user2_id))
+    unread_field = "unread_count_user1" if str(chat.user1_id) == str(receiver_id) else "unread_count_user2"
+    targets = [connections.get(str(user_id)) for user_id in (sender_id, receiver_id)]
+    return is_member, unread_field, targets
+
+
+def event_with_uuids(chat, sender_id, receiver_id, connections):
+    sender_id, receiver_id = as_uuid(sender_id), as_uuid(receiver_id)
+    is_member = sender_id in (chat.user1_id, chat.user2_id)
+    unread_field = "unread_count_user1" if chat.user1_id == receiver_id else "unread_count_user2"
+    targets = [connections.get(user_id) for user_id in (sender_id, receiver_id)]
+    return is_member, unread_field, targets
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Per-event identifier overhead: str() vs uuid.UUID")
+    parser.add_argument("--events", type=int, default=200000)
+    args = parser.parse_args()
+
+    chat, sender_id, receiver_id, by_str, by_uuid = make_state()
+    assert (event_with_strings(chat, sender_id, receiver_id, by_str)
+            == event_with_uuids(chat, sender_id, receiver_id, by_uuid))
+
+    variants = (("str() comparisons", lambda: event_with_strings(chat, sender_id, receiver_id, by_str)),
+                ("uuid.UUID", lambda: event_with_uuids(chat, sender_id, receiver_id, by_uuid)))
+    print(f"{'variant':<20}{'ns/event':>10}{'speedup':>9}")
+    baseline = None
+    for name, run in variants:
+        elapsed = min(timeit.repeat(run, number=args.events, repeat=5))
+        per_event = elapsed / args.events * 1e9
+        baseline = baseline or per_event
+        print(f"{name:<20}{per_event:>10.0f}{baseline / per_event:>8.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+from typing import Awaitable, Callable, Dict, Optional, Set
+import asyncio
+
+import redis.asyncio as aioredis
+
+from app.config import settings
+
+# handler(channel, message) вызывается для каждого сообщения из канала
+MessageHandler = Callable[[str, str], Awaitable[None]]
+
+
+class Broker:
+    """Базовый интерфейс pub/sub бэкенда для ConnectionManager"""
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, message: str) -> int:
+        """Опубликовать сообщение, вернуть число подписчиков, получивших его"""
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        raise NotImplementedError
+
+    async def unsubscribe(self, channel: str, handler: MessageHandler):
+        raise NotImplementedError
+
+
+class InMemoryBroker(Broker):
+    """Брокер внутри одного процесса (разработка и тесты)"""
+
+    def __init__(self):
+        self.handlers: Dict[str, Set[MessageHandler]] = {}
+
+    async def publish(self, channel: str, message: str) -> int:
+        handlers = list(self.handlers.get(channel, ()))
+        for handler in handlers:
+            try:
+                await handler(channel, message)
+            except Exception as e:
+                print(f"Error delivering message on {channel}: {e}")
+        return len(handlers)
+
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        self.handlers.setdefault(channel, set()).add(handler)
+
+    async def unsubscribe(self, channel: str, handler: MessageHandler):
+        handlers = self.handlers.get(channel)
+        if handlers is not None:
+            handlers.discard(handler)
+            if not handlers:
+                del self.handlers[channel]
+
+
+class RedisBroker(Broker):
+    """Брокер на Redis pub/sub для нескольких воркеров и узлов"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.redis: Optional[aioredis.Redis] = None
+        self.pubsub = None
+        self.handlers: Dict[str, Set[MessageHandler]] = {}
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.redis = aioredis.from_url(self.url, decode_responses=True)
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def stop(self):
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        if self.pubsub:
+            await self.pubsub.close()
+        if self.redis:
+            await self.redis.close()
+
+    async def publish(self, channel: str, message: str) -> int:
+        return await self.redis.publish(channel, message)
+
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        handlers = self.handlers.setdefault(channel, set())
+        if not handlers:
+            await self.pubsub.subscribe(channel)
+        handlers.add(handler)
+
+    async def unsubscribe(self, channel: str, handler: MessageHandler):
+        handlers = self.handlers.get(channel)
+        if handlers is None:
+            return
+        handlers.discard(handler)
+        if not handlers:
+            del self.handlers[channel]
+            await self.pubsub.unsubscribe(channel)
+
+    async def _read_loop(self):
+        while True:
+            if not self.pubsub.subscribed:
+                # Без подписок у pubsub еще нет соединения
+                await asyncio.sleep(0.1)
+                continue
+            try:
+                message = await self.pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Redis broker error: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            if not message or message.get("type") != "message":
+                continue
+
+            channel = message["channel"]
+            for handler in list(self.handlers.get(channel, ())):
+                try:
+                    await handler(channel, message["data"])
+                except Exception as e:
+                    print(f"Error delivering message on {channel}: {e}")
+
+
+def create_broker() -> Broker:
+    """Создать брокер согласно настройкам"""
+    if settings.BROKER_BACKEND == "redis":
+        return RedisBroker(settings.REDIS_URL)
+    return InMemoryBroker()
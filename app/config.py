@@ -7,6 +7,27 @@ load_dotenv()
 class Settings:
     # Database
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./chat.db")
+    # Профиль настроек движка: "sqlite" или "postgresql"; по умолчанию - по диалекту DATABASE_URL
+    DATABASE_PROFILE = os.getenv("DATABASE_PROFILE", "")
+    # Логирование SQL - только для отладки
+    DATABASE_ECHO = os.getenv("DATABASE_ECHO", "false").lower() in ("1", "true", "yes")
+
+    # Профиль sqlite: WAL позволяет читать во время записи, synchronous=NORMAL в WAL
+    # не теряет целостность и делает fsync только на checkpoint
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "64000")),  # отрицательное - в KiB
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+        "temp_store": "MEMORY",
+    }
+
+    # Размер пула соединений на процесс (профили postgresql и sqlite)
+    DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "10"))
+    DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "20"))
+    DATABASE_POOL_TIMEOUT = int(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+    DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
 
     # JWT
     SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
@@ -14,8 +35,28 @@ class Settings:
     ACCESS_TOKEN_EXPIRE_MINUTES = 30
     WEBSOCKET_TOKEN_EXPIRE_DAYS = 7
 
+    # Хеширование паролей (passlib): scrypt и pbkdf2_sha256 работают без внешних пакетов,
+    # bcrypt/argon2 требуют bcrypt/argon2-cffi. rounds - стоимость (для scrypt - log2 N)
+    PASSWORD_HASH_SCHEME = os.getenv("PASSWORD_HASH_SCHEME", "scrypt")
+    PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "14"))
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+
+    # Кэш проверенных токенов и пользователей для get_current_user
+    AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+    AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "60"))  # секунд
+    # Канал брокера, по которому воркеры сбрасывают пользователя из своих кэшей
+    AUTH_CACHE_CHANNEL = "chat:auth:invalidate"
+
     # File uploads
     MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+    UPLOAD_CHUNK_SIZE = 256 * 1024  # загрузка читается и хешируется чанками
+    # Запас на поля формы и границы multipart сверх MAX_FILE_SIZE при проверке Content-Length
+    UPLOAD_FORM_OVERHEAD = 64 * 1024
+    MEDIA_MAX_RANGES = 16  # больше отрезков в Range - отдается весь файл
+
+    # Превью медиа: миниатюры (Pillow), обложки и длительность видео/аудио (ffmpeg/ffprobe)
+    PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "2"))
+    PREVIEW_MAX_SIZE = 320  # px по большей стороне
     ALLOWED_EXTENSIONS = {
         'image': ['.jpg', '.jpeg', '.png', '.gif'],
         'video': ['.mp4', '.avi', '.mov'],
@@ -26,9 +67,45 @@ class Settings:
     # WebSocket
     WEBSOCKET_PING_INTERVAL = 20
     WEBSOCKET_PING_TIMEOUT = 40
+    # Исходящая очередь каждого сокета: при переполнении сначала вытесняются
+    # события, которые можно потерять, затем действует политика
+    # "disconnect" (закрыть медленного клиента) или "drop_oldest"
+    WEBSOCKET_SEND_QUEUE_SIZE = int(os.getenv("WEBSOCKET_SEND_QUEUE_SIZE", "256"))
+    WEBSOCKET_OVERFLOW_POLICY = os.getenv("WEBSOCKET_OVERFLOW_POLICY", "disconnect")
+    WEBSOCKET_DROPPABLE_EVENTS = {"typing", "user_status"}
+    # Индикатор набора хранится в памяти: истекает через TYPING_TTL, повторные typing
+    # чаще TYPING_THROTTLE секунд не рассылаются
+    TYPING_TTL = 6
+    TYPING_THROTTLE = 2
+    TYPING_CHANNEL = "chat:typing"
+    # Групповая фиксация сообщений из WebSocket: одна транзакция на пачку
+    WS_GROUP_COMMIT = os.getenv("WS_GROUP_COMMIT", "false").lower() in ("1", "true", "yes")
+    WS_BATCH_MAX_SIZE = int(os.getenv("WS_BATCH_MAX_SIZE", "100"))
+    WS_BATCH_MAX_DELAY_MS = int(os.getenv("WS_BATCH_MAX_DELAY_MS", "5"))
+    # Инкрементальная синхронизация: изменений в одном ответе /chat/sync и кадре sync
+    SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "500"))
+    # Хранение ленты изменений: последние CHANGE_FEED_MAX_ROWS записей на пользователя, старые
+    # удаляются раз в CHANGE_FEED_PRUNE_EVERY записей. Клиент, отставший сильнее, получает reset
+    CHANGE_FEED_MAX_ROWS = int(os.getenv("CHANGE_FEED_MAX_ROWS", "1000"))
+    CHANGE_FEED_PRUNE_EVERY = int(os.getenv("CHANGE_FEED_PRUNE_EVERY", "100"))
+    # Буфер последних событий для возобновления WebSocket: событий на пользователя,
+    # пользователей в памяти и сколько секунд хранится буфер неактивного пользователя
+    REPLAY_BUFFER_SIZE = int(os.getenv("REPLAY_BUFFER_SIZE", "100"))
+    REPLAY_BUFFER_USERS = int(os.getenv("REPLAY_BUFFER_USERS", "10000"))
+    REPLAY_BUFFER_TTL = int(os.getenv("REPLAY_BUFFER_TTL", "300"))
 
     # Redis (для горизонтального масштабирования)
     REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 
+    # Брокер сообщений между воркерами: "memory" (один процесс) или "redis"
+    BROKER_BACKEND = os.getenv("BROKER_BACKEND", "memory")
+    BROKER_CHANNEL_PREFIX = "chat:user:"
+
+    # Присутствие: heartbeat продлевается ping'ом клиента и истекает через TTL
+    PRESENCE_BACKEND = os.getenv("PRESENCE_BACKEND", BROKER_BACKEND)
+    PRESENCE_TTL = WEBSOCKET_PING_TIMEOUT
+    PRESENCE_FLUSH_INTERVAL = 5  # секунд между пакетной записью online_status/last_seen
+    PRESENCE_SWEEP_INTERVAL = 60  # секунд между сверкой БД с реестром присутствия
+
 
 settings = Settings()
\ No newline at end of file
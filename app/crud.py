@@ -1,38 +1,46 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc
-from typing import List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, desc, select, case, update, delete, func
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from uuid import UUID
 from datetime import datetime
 from app import models
+from app.config import settings
+from app.events import message_event
 
 
 class CRUDUser:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
     async def get_user_by_id(self, user_id: UUID) -> Optional[models.User]:
-        return self.db.query(models.User).filter(models.User.id == user_id,
-                                                 models.User.is_active == True).first()
+        result = await self.db.execute(select(models.User).where(models.User.id == user_id,
+                                                                 models.User.is_active == True))
+        return result.scalars().first()
 
     async def get_user_by_email(self, email: str) -> Optional[models.User]:
-        return self.db.query(models.User).filter(models.User.email == email,
-                                                 models.User.is_active == True).first()
+        result = await self.db.execute(select(models.User).where(models.User.email == email,
+                                                                 models.User.is_active == True))
+        return result.scalars().first()
 
 
 class CRUDChat:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
     async def get_chat_by_users(self, user1_id: UUID, user2_id: UUID) -> Optional[models.Chat]:
-        chat = self.db.query(models.Chat).filter(or_(
+        result = await self.db.execute(select(models.Chat).where(or_(
             and_(models.Chat.user1_id == user1_id, models.Chat.user2_id == user2_id),
             and_(models.Chat.user1_id == user2_id, models.Chat.user2_id == user1_id)),
-            models.Chat.is_active == True).first()
-        return chat
+            models.Chat.is_active == True))
+        return result.scalars().first()
 
     async def get_chat_by_id(self, chat_id: UUID) -> Optional[models.Chat]:
-        return self.db.query(models.Chat).filter(models.Chat.id == chat_id,
-                                                 models.Chat.is_active == True).first()
+        result = await self.db.execute(select(models.Chat).where(models.Chat.id == chat_id,
+                                                                 models.Chat.is_active == True))
+        return result.scalars().first()
 
     async def create_chat(self, user1_id: UUID, user2_id: UUID) -> models.Chat:
         if user1_id > user2_id:
@@ -47,83 +55,357 @@ class CRUDChat:
             user2_id=user2_id
         )
         self.db.add(db_chat)
-        self.db.commit()
-        self.db.refresh(db_chat)
+        await self.db.commit()
+        await self.db.refresh(db_chat)
         return db_chat
 
     async def get_user_chats(self, user_id: UUID) -> List[models.Chat]:
-        return self.db.query(models.Chat).filter(or_(
+        result = await self.db.execute(select(models.Chat).where(or_(
             models.Chat.user1_id == user_id, models.Chat.user2_id == user_id), models.Chat.is_active == True).order_by(
-            desc(models.Chat.updated_at)).all()
+            desc(models.Chat.updated_at)))
+        return list(result.scalars().all())
+
+    async def get_chat_list(self, user_id: UUID, start_date: Optional[datetime] = None,
+                            end_date: Optional[datetime] = None
+                            ) -> List[Tuple[models.ChatInbox, models.User, Optional[models.Message]]]:
+        """Строки списка чатов пользователя вместе с собеседником и последним сообщением одним запросом.
+
+        Список читается из chat_inbox диапазоном индекса (user_id, updated_at); собеседник и последнее
+        сообщение подтягиваются по первичным ключам, состояние прочтения - по отметке получателя.
+        Если задан диапазон дат, возвращаются только чаты с последним сообщением внутри него.
+        """
+        inbox = models.ChatInbox
+        other_user = aliased(models.User)
+        last_message = aliased(models.Message)
+        read_state = aliased(models.ChatReadState)
+
+        query = select(inbox, other_user, last_message, read_state).join(
+            other_user, other_user.id == inbox.other_user_id).where(inbox.user_id == user_id)
+
+        if start_date is None:
+            query = query.outerjoin(last_message, last_message.id == inbox.last_message_id).order_by(
+                desc(inbox.updated_at))
+        else:
+            query = query.join(last_message, last_message.id == inbox.last_message_id).where(
+                inbox.last_message_at.between(start_date, end_date)).order_by(desc(inbox.last_message_at))
+
+        query = query.outerjoin(read_state, and_(read_state.chat_id == inbox.chat_id,
+                                                 read_state.user_id == last_message.receiver_id))
+
+        result = await self.db.execute(query)
+        rows = []
+        for entry, other, message, state in result.all():
+            if message is not None and state is not None:
+                self._apply_read_state(message, state)
+            rows.append((entry, other, message))
+        return rows
+
+    @staticmethod
+    def inbox_preview(message: models.Message) -> str:
+        """Короткий текст последнего сообщения для списка чатов"""
+        preview = message.content or message.file_name or getattr(
+            message.message_type, "value", message.message_type)
+        return (preview or "")[:200]
+
+    async def update_inbox(self, message: models.Message, chat: models.Chat):
+        """Обновить строки списка чатов обоих участников в текущей транзакции (одним upsert).
+
+        Счетчик непрочитанных получателя увеличивается в SQL; архивный чат в список не возвращается.
+        """
+        if chat.is_active is False:
+            return
+
+        now = datetime.utcnow()
+        row = dict(chat_id=chat.id, last_message_id=message.id, last_message_preview=self.inbox_preview(message),
+                   last_message_at=message.created_at, created_at=now, updated_at=now)
+        rows = [dict(row, user_id=message.receiver_id, other_user_id=message.sender_id, unread_count=1)]
+        if message.sender_id != message.receiver_id:
+            rows.append(dict(row, user_id=message.sender_id, other_user_id=message.receiver_id, unread_count=0))
+
+        upsert = self._upsert(models.ChatInbox).values(rows)
+        excluded = upsert.excluded
+        await self.db.execute(upsert.on_conflict_do_update(
+            index_elements=[models.ChatInbox.user_id, models.ChatInbox.chat_id],
+            set_={"last_message_id": excluded.last_message_id,
+                  "last_message_preview": excluded.last_message_preview,
+                  "last_message_at": excluded.last_message_at,
+                  "updated_at": excluded.updated_at,
+                  "unread_count": models.ChatInbox.unread_count + excluded.unread_count}))
+
+    async def add_to_inbox(self, chat: models.Chat):
+        """Пустой чат в списках обоих участников (создание чата без сообщений)"""
+        now = datetime.utcnow()
+        rows = [dict(user_id=chat.user1_id, chat_id=chat.id, other_user_id=chat.user2_id,
+                     created_at=now, updated_at=now)]
+        if chat.user1_id != chat.user2_id:
+            rows.append(dict(user_id=chat.user2_id, chat_id=chat.id, other_user_id=chat.user1_id,
+                             created_at=now, updated_at=now))
+        await self.db.execute(self._upsert(models.ChatInbox).values(rows).on_conflict_do_nothing())
+
+    async def remove_from_inbox(self, chat_id: UUID):
+        """Убрать чат из списков участников (удаление и архивация)"""
+        await self.db.execute(delete(models.ChatInbox).where(models.ChatInbox.chat_id == chat_id))
 
     async def get_last_message(self, chat_id: UUID) -> Optional[models.Message]:
-        return self.db.query(models.Message).filter(models.Message.chat_id == chat_id).order_by(
-            desc(models.Message.created_at)).first()
+        result = await self.db.execute(select(models.Message).where(models.Message.chat_id == chat_id).order_by(
+            desc(models.Message.created_at)).limit(1))
+        return result.scalars().first()
 
     async def get_messages_by_chat(self, chat_id: UUID, skip: int = 0, limit: int = 100) -> List[models.Message]:
-        return self.db.query(models.Message).filter(models.Message.chat_id == chat_id).order_by(
-            models.Message.created_at).offset(skip).limit(limit).all()
+        result = await self.db.execute(select(models.Message).where(models.Message.chat_id == chat_id).order_by(
+            models.Message.created_at).offset(skip).limit(limit))
+        messages = list(result.scalars().all())
+        await self.attach_read_state(chat_id, messages)
+        return messages
+
+    async def get_messages_page(self, chat_id: UUID, before: Optional[Tuple[datetime, UUID]] = None,
+                                after: Optional[Tuple[datetime, UUID]] = None,
+                                limit: int = 50) -> Tuple[List[models.Message], bool]:
+        """Страница сообщений по ключу (created_at, id) в хронологическом порядке.
+
+        Без курсоров возвращается последняя страница. Второй элемент - есть ли сообщения
+        дальше в направлении листания.
+        """
+        query = select(models.Message).where(models.Message.chat_id == chat_id)
+
+        if after is not None:
+            created_at, message_id = after
+            query = query.where(or_(
+                models.Message.created_at > created_at,
+                and_(models.Message.created_at == created_at, models.Message.id > message_id)
+            )).order_by(models.Message.created_at, models.Message.id)
+        else:
+            if before is not None:
+                created_at, message_id = before
+                query = query.where(or_(
+                    models.Message.created_at < created_at,
+                    and_(models.Message.created_at == created_at, models.Message.id < message_id)
+                ))
+            query = query.order_by(desc(models.Message.created_at), desc(models.Message.id))
+
+        result = await self.db.execute(query.limit(limit + 1))
+        messages = list(result.scalars().all())
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+
+        if after is None:
+            messages.reverse()
+        await self.attach_read_state(chat_id, messages)
+        return messages, has_more
 
     async def get_message_by_id(self, message_id: UUID) -> Optional[models.Message]:
-        return self.db.query(models.Message).filter(models.Message.id == message_id).first()
-
-    async def create_message(self, message_data: dict) -> models.Message:
-        db_message = models.Message(**message_data)
-        self.db.add(db_message)
-
-        chat = await self.get_chat_by_id(message_data["chat_id"])
-        if chat:
-            chat.updated_at = datetime.utcnow()
-
-        self.db.commit()
-        self.db.refresh(db_message)
-        return db_message
-
-    async def create_message_with_ws(self, message_data: dict) -> models.Message:
-        db_message = models.Message(**message_data)
-        self.db.add(db_message)
-
-        chat = await self.get_chat_by_id(message_data["chat_id"])
-        if chat:
-            chat.updated_at = datetime.utcnow()
-            chat.last_message_id = db_message.id
-            receiver_id = message_data["receiver_id"]
-            if str(chat.user1_id) == str(receiver_id):
-                chat.unread_count_user1 += 1
-            else:
-                chat.unread_count_user2 += 1
-
-        self.db.commit()
-        self.db.refresh(db_message)
-        return db_message
-
-    async def mark_message_as_read(self, message_id: UUID, user_id: UUID):
-        message = await self.get_message_by_id(message_id)
-        if message and str(message.receiver_id) == str(user_id) and not message.is_read:
+        result = await self.db.execute(select(models.Message).where(models.Message.id == message_id))
+        return result.scalars().first()
+
+    async def get_read_states(self, chat_id: UUID) -> Dict[UUID, models.ChatReadState]:
+        """Отметки прочтения участников чата: user_id -> ChatReadState"""
+        result = await self.db.execute(select(models.ChatReadState).where(models.ChatReadState.chat_id == chat_id))
+        return {state.user_id: state for state in result.scalars().all()}
+
+    @staticmethod
+    def _apply_read_state(message: models.Message, state: models.ChatReadState):
+        if state.covers(message):
             message.is_read = True
-            message.read_at = datetime.utcnow()
-
-            chat = await self.get_chat_by_id(message.chat_id)
-            if chat:
-                if str(chat.user1_id) == str(user_id):
-                    chat.unread_count_user1 = 0
-                else:
-                    chat.unread_count_user2 = 0
-
-            read_status = models.MessageReadStatus(
-                message_id=message_id,
-                user_id=user_id
-            )
-            self.db.add(read_status)
-            self.db.commit()
-            return True
-        return False
+            message.read_at = state.updated_at
+
+    async def attach_read_state(self, chat_id: UUID, messages: List[models.Message]):
+        """Вычислить is_read/read_at сообщений по отметкам прочтения их получателей"""
+        if not messages:
+            return
+        states = await self.get_read_states(chat_id)
+        for message in messages:
+            state = states.get(message.receiver_id)
+            if state is not None:
+                self._apply_read_state(message, state)
+
+    def _upsert(self, model):
+        """INSERT ... ON CONFLICT для текущего диалекта"""
+        if self.db.get_bind().dialect.name == "postgresql":
+            return postgresql_insert(model)
+        return sqlite_insert(model)
+
+    def _unread_filter(self, chat_id: UUID, user_id: UUID, after: Tuple[datetime, UUID]):
+        created_at, message_id = after
+        return and_(
+            models.Message.chat_id == chat_id,
+            models.Message.receiver_id == user_id,
+            or_(models.Message.created_at > created_at,
+                and_(models.Message.created_at == created_at, models.Message.id > message_id)))
+
+    async def mark_read_up_to(self, message: models.Message, user_id: UUID) -> Tuple[int, int]:
+        """Сдвинуть отметку прочтения пользователя в чате до message включительно.
+
+        Пишется одна строка chat_read_state; счетчик непрочитанных пересчитывается в SQL
+        как число сообщений после новой отметки. Возвращает число впервые прочитанных сообщений
+        и новый счетчик непрочитанных. Commit выполняет вызывающий.
+        """
+        chat_id = message.chat_id
+        watermark = (message.created_at, message.id)
+
+        result = await self.db.execute(select(models.ChatReadState).where(
+            models.ChatReadState.chat_id == chat_id, models.ChatReadState.user_id == user_id))
+        state = result.scalars().first()
+        if state is not None and state.covers(message):
+            return 0, 0
+
+        # Только число сообщений между старой и новой отметкой: id клиентам не нужны
+        query = select(func.count()).select_from(models.Message).where(
+            models.Message.chat_id == chat_id,
+            models.Message.receiver_id == user_id,
+            or_(models.Message.created_at < message.created_at,
+                and_(models.Message.created_at == message.created_at, models.Message.id <= message.id)))
+        if state is not None:
+            query = query.where(self._unread_filter(
+                chat_id, user_id, (state.last_read_created_at, state.last_read_message_id)))
+        read_count = (await self.db.execute(query)).scalar_one()
+        if not read_count:
+            return 0, 0
+
+        now = datetime.utcnow()
+        upsert = self._upsert(models.ChatReadState).values(
+            chat_id=chat_id, user_id=user_id, last_read_message_id=message.id,
+            last_read_created_at=message.created_at, updated_at=now)
+        excluded = upsert.excluded
+        # Отметка только растет: конкурентное более раннее прочтение ее не откатит
+        await self.db.execute(upsert.on_conflict_do_update(
+            index_elements=[models.ChatReadState.chat_id, models.ChatReadState.user_id],
+            set_={"last_read_message_id": excluded.last_read_message_id,
+                  "last_read_created_at": excluded.last_read_created_at,
+                  "updated_at": excluded.updated_at},
+            where=or_(models.ChatReadState.last_read_created_at < excluded.last_read_created_at,
+                      and_(models.ChatReadState.last_read_created_at == excluded.last_read_created_at,
+                           models.ChatReadState.last_read_message_id < excluded.last_read_message_id))))
+
+        remaining = select(func.count()).select_from(models.Message).where(
+            self._unread_filter(chat_id, user_id, watermark)).scalar_subquery()
+        result = await self.db.execute(update(models.Chat).where(models.Chat.id == chat_id).values(
+            unread_count_user1=case((models.Chat.user1_id == user_id, remaining),
+                                    else_=models.Chat.unread_count_user1),
+            unread_count_user2=case((models.Chat.user2_id == user_id, remaining),
+                                    else_=models.Chat.unread_count_user2),
+        ).returning(models.Chat.user1_id, models.Chat.unread_count_user1, models.Chat.unread_count_user2)
+            .execution_options(synchronize_session=False))
+        row = result.first()
+        if row is None:
+            return read_count, 0
+        user1_id, unread_user1, unread_user2 = row
+        unread_count = unread_user1 if user1_id == user_id else unread_user2
+
+        # Тот же пересчет в SQL, а не значение из Python: инкремент параллельной отправки не перетирается
+        await self.db.execute(update(models.ChatInbox).where(
+            models.ChatInbox.user_id == user_id, models.ChatInbox.chat_id == chat_id
+        ).values(unread_count=remaining).execution_options(synchronize_session=False))
+        return read_count, unread_count
+
+    @staticmethod
+    def _unread_since_watermark(chat_id, user_id):
+        """Коррелированный подзапрос: число сообщений пользователю в чате после его отметки прочтения"""
+        state = aliased(models.ChatReadState)
+        state_filter = and_(state.chat_id == chat_id, state.user_id == user_id)
+        last_read_created_at = select(state.last_read_created_at).where(state_filter).scalar_subquery()
+        last_read_message_id = select(state.last_read_message_id).where(state_filter).scalar_subquery()
+        return select(func.count()).select_from(models.Message).where(
+            models.Message.chat_id == chat_id,
+            models.Message.receiver_id == user_id,
+            or_(last_read_created_at.is_(None),
+                models.Message.created_at > last_read_created_at,
+                and_(models.Message.created_at == last_read_created_at,
+                     models.Message.id > last_read_message_id))).scalar_subquery()
+
+    async def recount_unread(self) -> Tuple[int, int]:
+        """Пересчитать все счетчики непрочитанных по отметкам прочтения (восстановление после сбоев).
+
+        Два UPDATE с коррелированными подзапросами; возвращает число обновленных чатов и строк списка.
+        """
+        chats = await self.db.execute(update(models.Chat).values(
+            unread_count_user1=self._unread_since_watermark(models.Chat.id, models.Chat.user1_id),
+            unread_count_user2=self._unread_since_watermark(models.Chat.id, models.Chat.user2_id),
+        ).execution_options(synchronize_session=False))
+        inbox = await self.db.execute(update(models.ChatInbox).values(
+            unread_count=self._unread_since_watermark(models.ChatInbox.chat_id, models.ChatInbox.user_id),
+        ).execution_options(synchronize_session=False))
+        return chats.rowcount, inbox.rowcount
 
     async def get_unread_count(self, chat_id: UUID, user_id: UUID) -> int:
-        chat = await self.get_chat_by_id(chat_id)
-        if chat:
-            if str(chat.user1_id) == str(user_id):
-                return chat.unread_count_user1
-            else:
-                return chat.unread_count_user2
-        return 0
\ No newline at end of file
+        """Число непрочитанных пользователем сообщений: диапазон индекса после его отметки"""
+        result = await self.db.execute(select(models.ChatReadState).where(
+            models.ChatReadState.chat_id == chat_id, models.ChatReadState.user_id == user_id))
+        state = result.scalars().first()
+
+        query = select(func.count()).select_from(models.Message)
+        if state is None:
+            query = query.where(models.Message.chat_id == chat_id, models.Message.receiver_id == user_id)
+        else:
+            query = query.where(self._unread_filter(
+                chat_id, user_id, (state.last_read_created_at, state.last_read_message_id)))
+        result = await self.db.execute(query)
+        return result.scalar_one()
+
+
+class CRUDChanges:
+    """Лента изменений пользователя для инкрементальной синхронизации (GET /chat/sync)"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def next_seq(self, user_id: UUID) -> int:
+        """Следующий номер в ленте: UPDATE ... RETURNING блокирует строку пользователя до commit"""
+        result = await self.db.execute(
+            update(models.User).where(models.User.id == user_id)
+            .values(change_seq=models.User.change_seq + 1)
+            .returning(models.User.change_seq)
+            .execution_options(synchronize_session=False))
+        return result.scalar_one()
+
+    async def record(self, user_id: UUID, kind: str, chat_id: Optional[UUID],
+                     payload: Dict[str, Any]) -> int:
+        """Добавить изменение в ленту пользователя в текущей транзакции"""
+        seq = await self.next_seq(user_id)
+        self.db.add(models.UserChange(user_id=user_id, seq=seq, kind=kind, chat_id=chat_id, payload=payload))
+        if seq % settings.CHANGE_FEED_PRUNE_EVERY == 0:
+            await self.prune(user_id, seq)
+        return seq
+
+    async def prune(self, user_id: UUID, seq: int):
+        """Оставить в ленте пользователя последние CHANGE_FEED_MAX_ROWS записей (диапазон первичного ключа)"""
+        await self.db.execute(
+            delete(models.UserChange)
+            .where(models.UserChange.user_id == user_id,
+                   models.UserChange.seq <= seq - settings.CHANGE_FEED_MAX_ROWS)
+            .execution_options(synchronize_session=False))
+
+    async def record_for(self, user_ids: Iterable[UUID], kind: str, chat_id: Optional[UUID],
+                         payload: Dict[str, Any]) -> Dict[UUID, int]:
+        """Одно изменение в ленты нескольких пользователей: user_id -> seq.
+
+        Строки users блокируются в порядке id, чтобы встречные транзакции не ждали друг друга по кругу.
+        """
+        return {user_id: await self.record(user_id, kind, chat_id, payload) for user_id in sorted(set(user_ids))}
+
+    async def record_message(self, message: models.Message, chat: models.Chat) -> Dict[UUID, int]:
+        """Новое сообщение в лентах отправителя и получателя вместе с их счетчиками непрочитанных"""
+        payload = message_event(message).to_json()
+        seqs = {}
+        for user_id in sorted({message.sender_id, message.receiver_id}):
+            unread_count = chat.unread_count_user1 if chat.user1_id == user_id else chat.unread_count_user2
+            seqs[user_id] = await self.record(user_id, "message", chat.id,
+                                              {"message": payload, "unread_count": unread_count})
+        return seqs
+
+    async def get_current_seq(self, user_id: UUID) -> int:
+        result = await self.db.execute(select(models.User.change_seq).where(models.User.id == user_id))
+        return result.scalar_one_or_none() or 0
+
+    async def get_changes(self, user_id: UUID, since: int, limit: int) -> Tuple[List[models.UserChange], bool]:
+        """Изменения с seq > since по возрастанию: диапазон первичного ключа (user_id, seq).
+
+        Номера в ленте идут подряд, поэтому первое изменение после since + 1 означает,
+        что пропущенные записи уже удалены prune.
+        """
+        result = await self.db.execute(
+            select(models.UserChange)
+            .where(models.UserChange.user_id == user_id, models.UserChange.seq > since)
+            .order_by(models.UserChange.seq)
+            .limit(limit + 1))
+        changes = list(result.scalars().all())
+        return changes[:limit], len(changes) > limit
@@ -1,23 +1,36 @@
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import TypeDecorator, CHAR
+from sqlalchemy import TypeDecorator, CHAR, event, exc, inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util import await_only
+import asyncio
+import os
+import time
 import uuid
 
+from app.config import settings
 
-# Кастомный тип GUID для SQLite
+
+# Кастомный тип GUID: нативный UUID в PostgreSQL, CHAR(32) hex в SQLite
 class GUID(TypeDecorator):
     """Platform-independent GUID type."""
     impl = CHAR
     cache_ok = True
 
     def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=True))
         return dialect.type_descriptor(CHAR(32))
 
     def process_bind_param(self, value, dialect):
         if value is None:
             return value
 
+        if dialect.name == "postgresql":
+            # asyncpg принимает uuid.UUID как есть
+            return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
         if isinstance(value, uuid.UUID):
             return value.hex
         elif isinstance(value, str):
@@ -33,7 +46,7 @@ class GUID(TypeDecorator):
             return str(value)
 
     def process_result_value(self, value, dialect):
-        if value is None:
+        if value is None or isinstance(value, uuid.UUID):
             return value
 
         try:
@@ -43,23 +56,184 @@ class GUID(TypeDecorator):
             return value
 
 
-# Используем SQLite для простоты
-SQLALCHEMY_DATABASE_URL = "sqlite:///./chat.db"
+def as_uuid(value) -> uuid.UUID:
+    """Канонический идентификатор в памяти - uuid.UUID: сравнение и хеширование без строк"""
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+def uuid7() -> uuid.UUID:
+    """UUIDv7 (RFC 9562): 48 бит unix-времени в мс, затем 12 бит долей миллисекунды и случайные биты.
+
+    Идентификаторы растут со временем, поэтому вставки попадают в конец индекса по id.
+    """
+    nanoseconds = time.time_ns()
+    milliseconds = nanoseconds // 1_000_000
+    fraction = (nanoseconds % 1_000_000) * 4096 // 1_000_000
+    value = (milliseconds & ((1 << 48) - 1)) << 80
+    value |= 0x7 << 76
+    value |= fraction << 64
+    value |= 0b10 << 62
+    value |= int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+    return uuid.UUID(int=value)
+
+
+# Асинхронные драйверы: aiosqlite для разработки, asyncpg для продакшена
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+def get_async_database_url(url: str) -> str:
+    """Подставить асинхронный драйвер в URL базы данных"""
+    scheme, sep, rest = url.partition("://")
+    if "+" in scheme:
+        return url
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    echo=True  # Оставляем True для отладки
-)
+def get_database_profile(url: str) -> str:
+    """Профиль настроек: явно заданный DATABASE_PROFILE или по диалекту из URL"""
+    if settings.DATABASE_PROFILE:
+        return settings.DATABASE_PROFILE
+    dialect = url.partition("://")[0].partition("+")[0]
+    return "postgresql" if dialect in ("postgresql", "postgres") else dialect
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def get_engine_options(profile: str) -> dict:
+    """Параметры create_async_engine для профиля"""
+    options = {"echo": settings.DATABASE_ECHO}
+    if profile == "postgresql":
+        options.update(
+            pool_size=settings.DATABASE_POOL_SIZE,
+            max_overflow=settings.DATABASE_MAX_OVERFLOW,
+            pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+            pool_recycle=settings.DATABASE_POOL_RECYCLE,
+            # Отброшенные сервером соединения обнаруживаются до выдачи из пула
+            pool_pre_ping=True,
+        )
+    elif profile == "sqlite":
+        # Несколько соединений: в WAL читатели не ждут друг друга и писателя.
+        # Писатели идут по одному через SQLiteWriterQueue
+        options.update(
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=settings.DATABASE_POOL_SIZE,
+            max_overflow=settings.DATABASE_MAX_OVERFLOW,
+            pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+        )
+    return options
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """PRAGMA действуют на соединение - выставляются при каждом подключении"""
+    cursor = dbapi_connection.cursor()
+    for name, value in settings.SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def disable_driver_begin(dbapi_connection, connection_record):
+    # sqlite3 сам открывает транзакцию перед первым INSERT/UPDATE, уже после чтений -
+    # транзакции начинает SQLiteWriterQueue.begin
+    dbapi_connection.isolation_level = None
+
+
+class SQLiteWriterQueue:
+    """Очередь писателей SQLite внутри процесса.
+
+    Транзакция, которая сначала читает, а потом пишет, не может повысить блокировку, если после
+    ее чтения успел зафиксироваться другой писатель: SQLite сразу отвечает "database is locked",
+    не дожидаясь busy_timeout. Поэтому сессии записи начинают транзакцию с BEGIN IMMEDIATE,
+    а перед этим по очереди берут asyncio.Lock: ожидание в busy_timeout не гарантирует очередности,
+    и при всплесках часть писателей его исчерпывает. Сессии чтения (sqlite_begin="DEFERRED")
+    очередь не занимают и в WAL идут параллельно с писателем.
+    """
+
+    INFO_KEY = "sqlite_writer"
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.lock = asyncio.Lock()
+
+    def begin(self, conn):
+        mode = conn.get_execution_options().get("sqlite_begin", "IMMEDIATE")
+        if mode == "IMMEDIATE":
+            try:
+                await_only(asyncio.wait_for(self.lock.acquire(), self.timeout))
+            except asyncio.TimeoutError:
+                raise exc.TimeoutError(f"SQLite writer queue timeout ({self.timeout}s)")
+            conn.info[self.INFO_KEY] = True
+        try:
+            conn.exec_driver_sql(f"BEGIN {mode}")
+        except Exception:
+            self.release(conn.info)
+            raise
+
+    def release(self, info: dict):
+        if info.pop(self.INFO_KEY, False):
+            self.lock.release()
+
+    def listen(self, engine: AsyncEngine):
+        sync_engine = engine.sync_engine
+        event.listen(sync_engine, "begin", self.begin)
+        # "commit" приходит перед COMMIT драйвера: следующий BEGIN IMMEDIATE подождет его в busy_timeout
+        event.listen(sync_engine, "commit", lambda conn: self.release(conn.info))
+        event.listen(sync_engine, "rollback", lambda conn: self.release(conn.info))
+        # Соединение вернулось в пул, минуя commit/rollback (закрытие сессии, ошибка)
+        event.listen(sync_engine.pool, "reset", self._on_reset)
+
+    def _on_reset(self, dbapi_connection, connection_record, reset_state):
+        self.release(connection_record.info)
+
+
+def configure_sqlite_engine(engine: AsyncEngine):
+    """Слушатели профиля sqlite: PRAGMA на каждое соединение и очередь писателей"""
+    event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+    event.listen(engine.sync_engine, "connect", disable_driver_begin)
+    SQLiteWriterQueue(settings.DATABASE_POOL_TIMEOUT).listen(engine)
+
+
+def make_read_sessionmaker(sessionmaker: async_sessionmaker) -> async_sessionmaker:
+    """Сессии только для чтения на том же движке и пуле: на SQLite не берут блокировку записи"""
+    bind = sessionmaker.kw["bind"].execution_options(sqlite_begin="DEFERRED")
+    return async_sessionmaker(class_=sessionmaker.class_, **{**sessionmaker.kw, "bind": bind})
+
+
+SQLALCHEMY_DATABASE_URL = get_async_database_url(settings.DATABASE_URL)
+DATABASE_PROFILE = get_database_profile(SQLALCHEMY_DATABASE_URL)
+
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL, **get_engine_options(DATABASE_PROFILE))
+
+if DATABASE_PROFILE == "sqlite":
+    configure_sqlite_engine(engine)
+
+# expire_on_commit=False: после commit атрибуты не перезагружаются неявно,
+# что в асинхронном режиме привело бы к скрытому запросу вне await
+AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+ReadSessionLocal = make_read_sessionmaker(AsyncSessionLocal)
 
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_db():
+    async with ReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
+
+
+def _describe_tables(sync_conn) -> dict:
+    inspector = inspect(sync_conn)
+    return {
+        table: [{"name": column["name"], "type": str(column["type"])} for column in inspector.get_columns(table)]
+        for table in inspector.get_table_names()
+    }
+
+
+async def describe_tables(conn) -> dict:
+    """Таблицы и их колонки через Inspector - работает на любом диалекте, не только SQLite"""
+    return await conn.run_sync(_describe_tables)
@@ -0,0 +1,89 @@
+"""Проверка планов горячих запросов: ни один не должен сканировать таблицу целиком.
+
+Запуск: python -m app.db.check_query_plans
+Создает временную SQLite базу, применяет миграции, выполняет горячие запросы CRUD-слоя
+и прогоняет каждый через EXPLAIN QUERY PLAN. Код возврата 1, если найден SCAN.
+"""
+from datetime import datetime, timedelta
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app import models
+from app.crud import CRUDChanges, CRUDChat
+from app.db.migrations import run_migrations
+
+
+def hot_queries(crud: CRUDChat):
+    user_id, other_id, chat_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    now = datetime.utcnow()
+    cursor = (now, uuid.uuid4())
+    return {
+        "chat list": crud.get_chat_list(user_id),
+        "chat list by date": crud.get_chat_list(user_id, now - timedelta(days=1), now),
+        "chat by users": crud.get_chat_by_users(user_id, other_id),
+        "latest messages": crud.get_messages_page(chat_id),
+        "messages before cursor": crud.get_messages_page(chat_id, before=cursor),
+        "messages after cursor": crud.get_messages_page(chat_id, after=cursor),
+        "mark read up to": crud.mark_read_up_to(
+            models.Message(id=cursor[1], chat_id=chat_id, created_at=now), user_id),
+        "unread count": crud.get_unread_count(chat_id, user_id),
+        "change feed": CRUDChanges(crud.db).get_changes(user_id, 0, 100),
+        "change feed prune": CRUDChanges(crud.db).prune(user_id, 5000),
+    }
+
+
+def find_scans(plan_rows):
+    """Шаги плана с полным сканированием таблицы"""
+    return [detail for detail in plan_rows if detail.startswith("SCAN ") and detail != "SCAN CONSTANT ROW"]
+
+
+async def check_plans(database_url: str) -> bool:
+    engine = create_async_engine(database_url)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    ok = True
+
+    try:
+        async with session_factory() as db:
+            for name, query in hot_queries(CRUDChat(db)).items():
+                statements = []
+
+                def capture(conn, cursor, statement, parameters, context, executemany):
+                    statements.append((statement, parameters))
+
+                event.listen(engine.sync_engine, "before_cursor_execute", capture)
+                try:
+                    await query
+                finally:
+                    event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+                for statement, parameters in statements:
+                    conn = await db.connection()
+                    plan = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+                    scans = find_scans([row[3] for row in plan])
+                    status = "FAIL" if scans else "ok"
+                    print(f"[{status}] {name}")
+                    for detail in scans:
+                        print(f"       {detail}")
+                    ok = ok and not scans
+    finally:
+        await engine.dispose()
+
+    return ok
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_url = f"sqlite+aiosqlite:///{os.path.join(tmp_dir, 'plans.db')}"
+        run_migrations(database_url)
+        ok = asyncio.run(check_plans(database_url))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,7 @@
-from app.database import engine, Base
-from app.models import User, Chat, Message, MessageReadStatus, TypingStatus
+from app.database import describe_tables, engine
+from app.db.migrations import run_migrations
+from app.models import User, Chat, Message, ChatReadState
+import asyncio
 import sys
 import os
 
@@ -7,38 +9,34 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 
-def init_database():
+async def init_database():
     """Инициализация базы данных"""
-    print("Creating database tables...")
+    print("Applying database migrations...")
 
     try:
-        # Создаем все таблицы
-        Base.metadata.create_all(bind=engine)
-        print("Database tables created successfully!")
+        # Создаем и обновляем таблицы миграциями Alembic
+        await asyncio.to_thread(run_migrations)
+        print("Database schema is up to date!")
 
         # Проверяем созданные таблицы
-        from sqlalchemy import inspect
-        from sqlalchemy import text
+        async with engine.connect() as conn:
+            tables = await describe_tables(conn)
 
-        with engine.connect() as conn:
-            # Получаем список таблиц
-            result = conn.execute(text("SELECT name FROM sqlite_master WHERE type='table'"))
-            tables = [row[0] for row in result]
+        print(f"\nCreated tables: {list(tables)}")
 
-            print(f"\nCreated tables: {tables}")
-
-            # Показываем структуру каждой таблицы
-            for table in tables:
-                print(f"\nStructure of table '{table}':")
-                result = conn.execute(text(f"PRAGMA table_info({table})"))
-                for row in result:
-                    print(f"  Column: {row[1]} ({row[2]})")
+        # Показываем структуру каждой таблицы
+        for table, columns in tables.items():
+            print(f"\nStructure of table '{table}':")
+            for column in columns:
+                print(f"  Column: {column['name']} ({column['type']})")
 
     except Exception as e:
-        print(f"Error creating tables: {e}")
+        print(f"Error applying migrations: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        await engine.dispose()
 
 
 if __name__ == "__main__":
-    init_database()
\ No newline at end of file
+    asyncio.run(init_database())
\ No newline at end of file
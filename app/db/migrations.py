@@ -0,0 +1,48 @@
+from pathlib import Path
+from typing import Optional
+import asyncio
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database import SQLALCHEMY_DATABASE_URL
+
+ALEMBIC_INI = Path(__file__).resolve().parents[2] / "alembic.ini"
+
+# Ревизия, соответствующая схеме, которую раньше создавал create_all
+LEGACY_REVISION = "0001"
+
+
+def get_alembic_config(database_url: Optional[str] = None) -> Config:
+    config = Config(str(ALEMBIC_INI))
+    config.set_main_option("script_location", str(ALEMBIC_INI.parent / "alembic"))
+    if database_url:
+        config.attributes["database_url"] = database_url
+    return config
+
+
+async def _get_table_names(database_url: str):
+    engine = create_async_engine(database_url)
+    try:
+        async with engine.connect() as conn:
+            return await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_table_names())
+    finally:
+        await engine.dispose()
+
+
+def run_migrations(database_url: Optional[str] = None):
+    """Обновить схему до последней ревизии.
+
+    Вызывается вне event loop (env.py сам запускает asyncio), из lifespan - через asyncio.to_thread.
+    """
+    database_url = database_url or SQLALCHEMY_DATABASE_URL
+    config = get_alembic_config(database_url)
+
+    tables = asyncio.run(_get_table_names(database_url))
+    if "users" in tables and "alembic_version" not in tables:
+        # База создана через create_all до появления миграций
+        command.stamp(config, LEGACY_REVISION)
+
+    command.upgrade(config, "head")
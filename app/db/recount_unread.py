@@ -0,0 +1,43 @@
+"""Пересчет счетчиков непрочитанных по отметкам прочтения.
+
+Запуск: python -m app.db.recount_unread [DATABASE_URL]
+Счетчики в chats и chat_inbox меняются только атомарными выражениями SQL, поэтому расходиться
+не должны; команда нужна для восстановления после ручных правок данных.
+"""
+import argparse
+import asyncio
+import sys
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.config import settings
+from app.crud import CRUDChat
+from app.database import get_async_database_url
+
+
+async def recount(database_url: str):
+    engine = create_async_engine(database_url)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    try:
+        async with session_factory() as db:
+            chats, inbox = await CRUDChat(db).recount_unread()
+            await db.commit()
+    finally:
+        await engine.dispose()
+
+    print(f"chats: {chats} rows recounted")
+    print(f"chat_inbox: {inbox} rows recounted")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Recompute unread counters from read watermarks")
+    parser.add_argument("database_url", nargs="?", default=settings.DATABASE_URL,
+                        help="Database URL, defaults to DATABASE_URL")
+    args = parser.parse_args()
+
+    asyncio.run(recount(get_async_database_url(args.database_url)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
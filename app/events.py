@@ -0,0 +1,122 @@
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Dict, Optional
+from uuid import UUID
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson - необязательная зависимость
+    orjson = None
+
+
+def _default(value: Any):
+    """Типы, которые стандартный json не сериализует сам"""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return str(value)
+
+
+def dumps(payload: Dict[str, Any]) -> str:
+    """Компактный JSON: orjson, если установлен, иначе стандартный json"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default).decode()
+    return json.dumps(payload, default=_default, separators=(",", ":"), ensure_ascii=False)
+
+
+class Event:
+    """Событие для клиентов WebSocket.
+
+    Кодируется один раз при первой отправке; одна и та же строка уходит
+    отправителю, получателю и во все их сокеты.
+    """
+
+    __slots__ = ("type", "payload", "_encoded")
+
+    def __init__(self, type: str, **payload):
+        self.type = type.value if isinstance(type, Enum) else type
+        self.payload = payload
+        self._encoded: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        # "type" всегда первым - по нему очереди сокетов определяют тип события без разбора JSON
+        return {"type": self.type, **self.payload}
+
+    def encode(self) -> str:
+        if self._encoded is None:
+            self._encoded = dumps(self.to_dict())
+        return self._encoded
+
+    def to_json(self) -> Dict[str, Any]:
+        """Словарь только из JSON-типов (для JSON-колонок), из кэшированной кодировки"""
+        return json.loads(self.encode())
+
+
+def message_event(message, **extra) -> Event:
+    """Событие о новом сообщении"""
+    return Event(
+        "message",
+        message_id=message.id,
+        chat_id=message.chat_id,
+        sender_id=message.sender_id,
+        receiver_id=message.receiver_id,
+        content=message.content,
+        message_type=message.message_type,
+        media_url=message.media_url,
+        file_name=message.file_name,
+        reply_to_id=message.reply_to_id,
+        forwarded_from_id=message.forwarded_from_id,
+        created_at=message.created_at,
+        is_read=message.is_read,
+        **extra
+    )
+
+
+def typing_event(chat_id: UUID, user_id: UUID, is_typing: bool) -> Event:
+    """Событие индикатора набора"""
+    return Event("typing", chat_id=chat_id, user_id=user_id, is_typing=is_typing,
+                 timestamp=datetime.now())
+
+
+def read_event(message, reader_id: UUID, read_count: int, **extra) -> Event:
+    """Агрегированное событие о прочтении сообщений до message включительно.
+
+    Несет только отметку: клиент помечает прочитанными все сообщения не позже нее.
+    """
+    return Event(
+        "message_read",
+        up_to_message_id=message.id,
+        last_read_created_at=message.created_at,
+        read_count=read_count,
+        chat_id=message.chat_id,
+        reader_id=reader_id,
+        timestamp=datetime.now(),
+        **extra
+    )
+
+
+def preview_event(message, preview: Dict[str, Any], **extra) -> Event:
+    """Превью медиасообщения готово (миниатюра, обложка, длительность)"""
+    return Event("message_preview", message_id=message.id, chat_id=message.chat_id, preview=preview, **extra)
+
+
+def ack_event(client_id: Optional[str], message=None, error: Optional[str] = None) -> Event:
+    """Подтверждение отправителю: сообщение записано в БД (или ошибка)"""
+    if message is None:
+        return Event("message_ack", client_id=client_id, status="error", error=error)
+    return Event("message_ack", client_id=client_id, status="ok", message_id=message.id,
+                 chat_id=message.chat_id, created_at=message.created_at)
+
+
+def seqs_for(seqs: Dict[UUID, int]) -> Dict[str, int]:
+    """Номера в лентах изменений получателей события: каждый клиент берет свой"""
+    return {str(user_id): seq for user_id, seq in seqs.items()}
+
+
+def chat_update_event(chat_id: UUID, action: str, seqs: Dict[UUID, int]) -> Event:
+    """Чат удален или перенесен в архив"""
+    return Event("chat_update", chat_id=chat_id, action=action, seqs=seqs_for(seqs))
@@ -1,34 +1,37 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 from pathlib import Path
 from datetime import datetime
 
-from app.database import engine, Base
-from app.models import User, Chat, Message, MessageReadStatus, TypingStatus
+from app.auth_cache import auth_cache
+from app.database import describe_tables, engine
+from app.db.migrations import run_migrations
+from app.media import media_response
+from app.message_batcher import message_batcher
+from app.previews import preview_pipeline
+from app.models import User, Chat, Message, ChatReadState
 from app.routes import chat, auth
+from app.uploads import UploadSizeLimitMiddleware
+from app.websocket_manager import manager as ws_manager
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Создаем таблицы базы данных
-    print("Creating database tables...")
+    # Применяем миграции базы данных
+    print("Applying database migrations...")
     try:
-        Base.metadata.create_all(bind=engine)
-        print("Database tables created successfully!")
+        await asyncio.to_thread(run_migrations)
+        print("Database schema is up to date!")
 
         # Проверяем созданные таблицы
-        from sqlalchemy import inspect
-        from sqlalchemy import text
-
-        with engine.connect() as conn:
-            result = conn.execute(text("SELECT name FROM sqlite_master WHERE type='table'"))
-            tables = [row[0] for row in result]
+        async with engine.connect() as conn:
+            tables = list(await describe_tables(conn))
             print(f"Tables in database: {tables}")
 
     except Exception as e:
-        print(f"Error creating tables: {e}")
+        print(f"Error applying migrations: {e}")
         import traceback
         traceback.print_exc()
 
@@ -37,10 +40,20 @@ async def lifespan(app: FastAPI):
     upload_dir.mkdir(exist_ok=True)
     print("Upload directory created")
 
+    await ws_manager.start()
+    await auth_cache.start(ws_manager.broker)
+    await preview_pipeline.start()
+    await message_batcher.start()
+
     print("Server started successfully!")
     yield
 
     print("Server shutting down...")
+    await message_batcher.stop()
+    await preview_pipeline.stop()
+    await auth_cache.stop()
+    await ws_manager.stop()
+    await engine.dispose()
 
 
 app = FastAPI(
@@ -58,15 +71,19 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-# Монтируем статические файлы
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app.add_middleware(UploadSizeLimitMiddleware)
 
 # Подключаем роутеры
 app.include_router(chat.router)
 app.include_router(auth.router)
 
 
+@app.api_route("/uploads/{filename}", methods=["GET", "HEAD"])
+async def uploaded_file(filename: str, request: Request):
+    """Загруженные файлы: media_url сообщений указывает сюда"""
+    return await media_response(request, filename)
+
+
 @app.get("/")
 async def root():
     return {
@@ -89,26 +106,28 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "database": "SQLite"
+        "database": engine.dialect.name
     }
 
 
 @app.get("/debug/tables")
 async def debug_tables():
     """Эндпоинт для отладки - показывает таблицы в базе"""
-    from sqlalchemy import text
-
-    with engine.connect() as conn:
-        result = conn.execute(text("SELECT name FROM sqlite_master WHERE type='table'"))
-        tables = [row[0] for row in result]
-
-        table_details = {}
-        for table in tables:
-            result = conn.execute(text(f"PRAGMA table_info({table})"))
-            columns = [{"name": row[1], "type": row[2]} for row in result]
-            table_details[table] = columns
+    async with engine.connect() as conn:
+        table_details = await describe_tables(conn)
 
     return {
-        "tables": tables,
+        "tables": list(table_details),
         "details": table_details
-    }
\ No newline at end of file
+    }
+
+@app.get("/debug/ws-metrics")
+async def debug_ws_metrics():
+    """Эндпоинт для отладки - глубина исходящих очередей WebSocket и потери"""
+    return ws_manager.get_metrics()
+
+
+@app.get("/debug/auth-cache")
+async def debug_auth_cache():
+    """Эндпоинт для отладки - размер кэша авторизации и доля попаданий"""
+    return auth_cache.stats()
@@ -0,0 +1,225 @@
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import mimetypes
+import os
+import re
+import uuid
+
+import aiofiles
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from app.config import settings
+from app.uploads import UPLOAD_DIR
+
+# Загруженные файлы не перезаписываются - клиент может кэшировать их бессрочно
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+SHA256_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+# ETag файлов, сохраненных до адресации по содержимому: (путь, mtime_ns, размер) -> sha256
+_legacy_etags: Dict[Tuple[str, int, int], str] = {}
+
+
+def resolve_media_path(filename: str) -> Path:
+    """Путь к файлу в UPLOAD_DIR; имена с каталогами не принимаются"""
+    if not filename or filename != os.path.basename(filename) or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    file_path = UPLOAD_DIR / filename
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+    return file_path
+
+
+def _hash_file(file_path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(settings.UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def get_etag(file_path: Path, stat: os.stat_result) -> str:
+    """Сильный ETag из хеша содержимого: берется из имени блоба или считается один раз"""
+    if SHA256_NAME.match(file_path.stem):
+        return f'"{file_path.stem}"'
+
+    key = (str(file_path), stat.st_mtime_ns, stat.st_size)
+    if key not in _legacy_etags:
+        _legacy_etags[key] = await asyncio.to_thread(_hash_file, file_path)
+    return f'"{_legacy_etags[key]}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Слабое сравнение для If-None-Match: префикс W/ у тега не учитывается"""
+    if header.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+    # В HTTP-датах нет долей секунды
+    return int(mtime) <= since
+
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Условный GET: If-None-Match имеет приоритет над If-Modified-Since"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        return _not_modified_since(if_modified_since, mtime)
+    return False
+
+
+def parse_range(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """Разобрать Range: bytes=... в список отрезков [start, end] включительно.
+
+    None - заголовок некорректен и игнорируется (отдается весь файл);
+    пустой список - ни один отрезок не попадает в файл (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        start_str, sep, end_str = part.strip().partition("-")
+        if not sep:
+            return None
+        start_str, end_str = start_str.strip(), end_str.strip()
+        if not (start_str.isdigit() or start_str == "") or not (end_str.isdigit() or end_str == ""):
+            return None
+
+        if start_str == "":
+            # bytes=-N - последние N байт
+            if end_str == "":
+                return None
+            length = int(end_str)
+            if length == 0 or size == 0:
+                continue
+            ranges.append((max(size - length, 0), size - 1))
+            continue
+
+        start = int(start_str)
+        end = int(end_str) if end_str else None
+        if end is not None and end < start:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+
+    if len(ranges) > settings.MEDIA_MAX_RANGES:
+        return None
+    return _merge_ranges(ranges)
+
+
+def _merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Объединить пересекающиеся и смежные отрезки"""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _if_range_allows(request: Request, etag: str, mtime: float) -> bool:
+    """If-Range: частичный ответ только если файл не изменился, иначе весь файл"""
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return _not_modified_since(if_range, mtime)
+
+
+async def _read_ranges(file_path: Path, ranges: List[Tuple[int, int]],
+                       parts: Optional[List[bytes]] = None, closing: bytes = b"") -> AsyncIterator[bytes]:
+    async with aiofiles.open(file_path, "rb") as f:
+        for index, (start, end) in enumerate(ranges):
+            if parts:
+                yield parts[index]
+            await f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await f.read(min(settings.UPLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    if closing:
+        yield closing
+
+
+async def media_response(request: Request, filename: str) -> Response:
+    """Отдать загруженный файл с ETag, условными запросами и Range"""
+    file_path = resolve_media_path(filename)
+    stat = file_path.stat()
+    size = stat.st_size
+    etag = await get_etag(file_path, stat)
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+
+    if is_not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    ranges = None
+    if range_header and _if_range_allows(request, etag, stat.st_mtime):
+        ranges = parse_range(range_header, size)
+
+    if ranges is not None and not ranges:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+
+    if ranges is None:
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(size)
+            return Response(status_code=200, headers=headers, media_type=media_type)
+        return FileResponse(file_path, headers=headers, media_type=media_type, stat_result=stat)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        if request.method == "HEAD":
+            return Response(status_code=206, headers=headers, media_type=media_type)
+        return StreamingResponse(_read_ranges(file_path, ranges), status_code=206,
+                                 headers=headers, media_type=media_type)
+
+    # Несколько отрезков - multipart/byteranges
+    boundary = uuid.uuid4().hex
+    parts = [
+        (f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+         f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode()
+        for start, end in ranges
+    ]
+    # Разделитель перед каждой следующей частью начинается с CRLF после данных предыдущей
+    parts = [parts[0]] + [b"\r\n" + part for part in parts[1:]]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+    headers["Content-Length"] = str(
+        sum(len(part) for part in parts) + sum(end - start + 1 for start, end in ranges) + len(closing))
+    multipart_type = f"multipart/byteranges; boundary={boundary}"
+    if request.method == "HEAD":
+        return Response(status_code=206, headers=headers, media_type=multipart_type)
+    return StreamingResponse(_read_ranges(file_path, ranges, parts, closing), status_code=206,
+                             headers=headers, media_type=multipart_type)
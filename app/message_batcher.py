@@ -0,0 +1,128 @@
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.events import ack_event
+from app.message_service import MessageService, publish_message
+from app.websocket_manager import manager as ws_manager
+
+# (sender_id, кадр WebSocket с type=message)
+BatchItem = Tuple[UUID, Dict[str, Any]]
+
+
+class MessageBatcher:
+    """Групповая фиксация сообщений из WebSocket.
+
+    Сообщения всех соединений копятся в очереди и записываются одной транзакцией
+    раз в max_delay секунд или по max_size штук; после commit отправитель получает
+    message_ack, а участники чата - само сообщение.
+    """
+
+    def __init__(self, max_size: int, max_delay: float, session_factory=AsyncSessionLocal):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.session_factory = session_factory
+        self.queue: "asyncio.Queue[Optional[BatchItem]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.messages = 0
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописать накопленные сообщения и остановиться"""
+        if self._task is not None:
+            self.queue.put_nowait(None)
+            await self._task
+            self._task = None
+
+    def submit(self, sender_id: UUID, data: Dict[str, Any]):
+        self.queue.put_nowait((sender_id, data))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                print(f"Error flushing message batch: {e}")
+
+    async def _flush(self, batch: List[BatchItem]):
+        try:
+            async with self.session_factory() as db:
+                stored = await self._store_batch(db, batch)
+                await db.commit()
+        except Exception as e:
+            # Один некорректный кадр не должен терять остальные - пишем по одному
+            print(f"Batch of {len(batch)} messages failed ({e}), retrying one by one")
+            stored = []
+            for item in batch:
+                try:
+                    async with self.session_factory() as db:
+                        stored += await self._store_batch(db, [item])
+                        await db.commit()
+                except Exception as item_error:
+                    await ws_manager.send_personal_message(
+                        ack_event(item[1].get("client_id"), error=str(item_error)), item[0])
+
+        self.batches += 1
+        self.messages += len(stored)
+
+        for sender_id, data, message, seqs in stored:
+            await ws_manager.send_personal_message(ack_event(data.get("client_id"), message), sender_id)
+            await publish_message(message, seqs)
+
+    async def _store_batch(self, db: AsyncSession, batch: List[BatchItem]):
+        """Записать сообщения пачки в сессию (без commit)"""
+        service = MessageService(db)
+        chats: Dict[Tuple[UUID, UUID], models.Chat] = {}
+        stored = []
+
+        for sender_id, data in batch:
+            receiver_id = UUID(data.get("receiver_id"))
+            pair = tuple(sorted([sender_id, receiver_id]))
+            if pair not in chats:
+                chats[pair] = await service.get_or_create_chat(sender_id, receiver_id)
+
+            message, seqs = await service.create_message(
+                sender_id, receiver_id, chat=chats[pair],
+                message_type=data.get("message_type", "text"),
+                content=data.get("content", ""),
+                reply_to_id=data.get("reply_to_id"),
+                forwarded_from_id=data.get("forwarded_from_id"),
+                extra_data=data.get("extra_data", {})
+            )
+            stored.append((sender_id, data, message, seqs))
+
+        return stored
+
+
+message_batcher = MessageBatcher(settings.WS_BATCH_MAX_SIZE, settings.WS_BATCH_MAX_DELAY_MS / 1000)
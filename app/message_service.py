@@ -0,0 +1,88 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import and_, case, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import models
+from app.crud import CRUDChanges, CRUDChat
+from app.database import as_uuid
+from app.events import message_event, seqs_for
+from app.websocket_manager import manager as ws_manager
+
+
+class MessageService:
+    """Запись нового сообщения - единственный путь для WebSocket, HTTP и групповой фиксации.
+
+    В одной транзакции: найти или создать чат, вставить сообщение, обновить чат одним UPDATE
+    с инкрементом счетчика в SQL, обновить списки чатов и ленты изменений участников.
+    Commit выполняет вызывающий: маршрут - на каждое сообщение, MessageBatcher - на пачку.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.chats = CRUDChat(db)
+        self.changes = CRUDChanges(db)
+
+    async def get_or_create_chat(self, user_a: UUID, user_b: UUID) -> models.Chat:
+        """Чат двух пользователей; конкурентное создание того же чата не дает ошибки уникальности"""
+        user1_id, user2_id = sorted([as_uuid(user_a), as_uuid(user_b)])
+        # Новые чаты хранятся с упорядоченной парой; обратный порядок - для чатов, созданных раньше
+        query = select(models.Chat).where(or_(
+            and_(models.Chat.user1_id == user1_id, models.Chat.user2_id == user2_id),
+            and_(models.Chat.user1_id == user2_id, models.Chat.user2_id == user1_id)))
+
+        result = await self.db.execute(query)
+        chat = result.scalars().first()
+        if chat is not None:
+            return chat
+
+        await self.db.execute(self.chats._upsert(models.Chat).values(
+            user1_id=user1_id, user2_id=user2_id, is_active=True,
+            unread_count_user1=0, unread_count_user2=0,
+        ).on_conflict_do_nothing(index_elements=[models.Chat.user1_id, models.Chat.user2_id]))
+        result = await self.db.execute(query)
+        return result.scalars().one()
+
+    async def create_message(self, sender_id: UUID, receiver_id: UUID, chat: Optional[models.Chat] = None,
+                             **fields) -> Tuple[models.Message, Dict[UUID, int]]:
+        """Записать сообщение в текущую транзакцию; возвращает его и номера в лентах участников"""
+        sender_id, receiver_id = as_uuid(sender_id), as_uuid(receiver_id)
+        if chat is None:
+            chat = await self.get_or_create_chat(sender_id, receiver_id)
+
+        message = models.Message(chat_id=chat.id, sender_id=sender_id, receiver_id=receiver_id, **fields)
+        self.db.add(message)
+        # id и created_at сообщения нужны до обновления чата
+        await self.db.flush()
+
+        # Инкремент в SQL без чтения-изменения-записи в Python: параллельные отправители
+        # и другие воркеры не теряют увеличения
+        now = datetime.utcnow()
+        result = await self.db.execute(update(models.Chat).where(models.Chat.id == chat.id).values(
+            updated_at=now,
+            last_message_id=message.id,
+            unread_count_user1=case((models.Chat.user1_id == receiver_id, models.Chat.unread_count_user1 + 1),
+                                    else_=models.Chat.unread_count_user1),
+            unread_count_user2=case((models.Chat.user1_id == receiver_id, models.Chat.unread_count_user2),
+                                    else_=models.Chat.unread_count_user2 + 1),
+        ).returning(models.Chat.unread_count_user1, models.Chat.unread_count_user2)
+            .execution_options(synchronize_session=False))
+        unread_user1, unread_user2 = result.one()
+
+        # Объект chat получает значения из RETURNING без повторного чтения и без пометки как измененный
+        for key, value in (("updated_at", now), ("last_message_id", message.id),
+                           ("unread_count_user1", unread_user1), ("unread_count_user2", unread_user2)):
+            set_committed_value(chat, key, value)
+
+        await self.chats.update_inbox(message, chat)
+        seqs = await self.changes.record_message(message, chat)
+        return message, seqs
+
+
+async def publish_message(message: models.Message, seqs: Dict[UUID, int], user_ids: Optional[List[UUID]] = None):
+    """Отправить записанное сообщение участникам чата (после commit)"""
+    await ws_manager.send_to_users(message_event(message, seqs=seqs_for(seqs)),
+                                   user_ids or [message.sender_id, message.receiver_id])
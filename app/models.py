@@ -1,9 +1,10 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Enum, Float, JSON, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Enum, Float, JSON, UniqueConstraint, \
+    Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import uuid
 from datetime import datetime
-from app.database import Base, GUID
+from app.database import Base, GUID, uuid7
 import enum
 
 
@@ -29,6 +30,8 @@ class User(Base):
     last_seen = Column(DateTime(timezone=True))
     profile_image = Column(String(500))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Последний номер в ленте изменений пользователя (UserChange.seq)
+    change_seq = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Relationships с явным указанием foreign_keys
     sent_messages = relationship(
@@ -53,11 +56,6 @@ class User(Base):
         foreign_keys="Chat.user2_id",
         back_populates="user2"
     )
-    read_statuses = relationship(
-        "MessageReadStatus",
-        back_populates="user",
-        cascade="all, delete-orphan"
-    )
 
 
 class Chat(Base):
@@ -70,8 +68,9 @@ class Chat(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     is_active = Column(Boolean, default=True)
     last_message_id = Column(GUID(), ForeignKey("messages.id"), nullable=True)
-    unread_count_user1 = Column(Integer, default=0)
-    unread_count_user2 = Column(Integer, default=0)
+    # Меняются только выражениями SQL (x = x + 1, пересчет по отметке прочтения), не из Python
+    unread_count_user1 = Column(Integer, nullable=False, default=0, server_default="0")
+    unread_count_user2 = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Relationships
     user1 = relationship(
@@ -97,13 +96,16 @@ class Chat(Base):
 
     __table_args__ = (
         UniqueConstraint('user1_id', 'user2_id', name='unique_chat_users'),
+        Index('ix_chats_user1_updated', 'user1_id', 'updated_at'),
+        Index('ix_chats_user2_updated', 'user2_id', 'updated_at'),
     )
 
 
 class Message(Base):
     __tablename__ = "messages"
 
-    id = Column(GUID(), primary_key=True, default=uuid.uuid4)
+    # UUIDv7 упорядочен по времени - новые сообщения не разбрасываются по индексу первичного ключа
+    id = Column(GUID(), primary_key=True, default=uuid7)
     chat_id = Column(GUID(), ForeignKey("chats.id"), nullable=False)
     sender_id = Column(GUID(), ForeignKey("users.id"), nullable=False)
     receiver_id = Column(GUID(), ForeignKey("users.id"), nullable=False)
@@ -117,12 +119,17 @@ class Message(Base):
     longitude = Column(Float)
     reply_to_id = Column(GUID(), ForeignKey("messages.id"), nullable=True)
     forwarded_from_id = Column(GUID(), ForeignKey("users.id"), nullable=True)
-    is_read = Column(Boolean, default=False)
-    read_at = Column(DateTime(timezone=True))
     extra_data = Column(JSON)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Время задается в приложении с микросекундами: ключ (created_at, id) для пагинации и
+    # отметок прочтения должен сравниваться одинаково в БД и в Python
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
+    # Состояние прочтения не хранится в строке сообщения: оно вычисляется из ChatReadState
+    # (см. CRUDChat.attach_read_state)
+    is_read = False
+    read_at = None
+
     # Relationships
     chat = relationship(
         "Chat",
@@ -149,42 +156,58 @@ class Message(Base):
         "User",
         foreign_keys=[forwarded_from_id]
     )
-    read_statuses = relationship(
-        "MessageReadStatus",
-        back_populates="message",
-        cascade="all, delete-orphan"
+    __table_args__ = (
+        # Keyset-пагинация истории чата по (created_at, id)
+        Index('ix_messages_chat_created_id', 'chat_id', 'created_at', 'id'),
+        # Непрочитанные получателем: диапазон после его отметки прочтения
+        Index('ix_messages_chat_receiver_created_id', 'chat_id', 'receiver_id', 'created_at', 'id'),
     )
 
 
-class MessageReadStatus(Base):
-    __tablename__ = "message_read_status"
+class ChatReadState(Base):
+    """Отметка прочтения пользователя в чате: прочитано все до (last_read_created_at, last_read_message_id)"""
+    __tablename__ = "chat_read_state"
 
-    id = Column(GUID(), primary_key=True, default=uuid.uuid4)
-    message_id = Column(GUID(), ForeignKey("messages.id"), nullable=False)
-    user_id = Column(GUID(), ForeignKey("users.id"), nullable=False)
-    read_at = Column(DateTime(timezone=True), server_default=func.now())
+    chat_id = Column(GUID(), ForeignKey("chats.id"), primary_key=True)
+    user_id = Column(GUID(), ForeignKey("users.id"), primary_key=True)
+    last_read_message_id = Column(GUID(), ForeignKey("messages.id"), nullable=False)
+    last_read_created_at = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
-    message = relationship(
-        "Message",
-        foreign_keys=[message_id],
-        back_populates="read_statuses"
-    )
-    user = relationship(
-        "User",
-        foreign_keys=[user_id],
-        back_populates="read_statuses"
-    )
+    def covers(self, message: "Message") -> bool:
+        """Попадает ли сообщение под отметку прочтения"""
+        return (message.created_at, message.id) <= (self.last_read_created_at, self.last_read_message_id)
 
 
-class TypingStatus(Base):
-    __tablename__ = "typing_status"
+class ChatInbox(Base):
+    """Список чатов пользователя: одна строка на (пользователь, чат), обновляется при записи сообщений"""
+    __tablename__ = "chat_inbox"
 
-    id = Column(GUID(), primary_key=True, default=uuid.uuid4)
-    chat_id = Column(GUID(), ForeignKey("chats.id"), nullable=False)
-    user_id = Column(GUID(), ForeignKey("users.id"), nullable=False)
-    is_typing = Column(Boolean, default=False)
-    started_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    user_id = Column(GUID(), ForeignKey("users.id"), primary_key=True)
+    chat_id = Column(GUID(), ForeignKey("chats.id"), primary_key=True)
+    other_user_id = Column(GUID(), ForeignKey("users.id"), nullable=False)
+    last_message_id = Column(GUID(), ForeignKey("messages.id"))
+    last_message_preview = Column(String(200))
+    last_message_at = Column(DateTime(timezone=True))
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+
+    __table_args__ = (
+        # Список чатов: WHERE user_id = ? ORDER BY updated_at DESC - один диапазон индекса
+        Index('ix_chat_inbox_user_updated', 'user_id', 'updated_at'),
+    )
+
+
+class UserChange(Base):
+    """Лента изменений пользователя: seq монотонно растет в пределах пользователя"""
+    __tablename__ = "user_changes"
 
-    chat = relationship("Chat", foreign_keys=[chat_id])
-    user = relationship("User", foreign_keys=[user_id])
\ No newline at end of file
+    user_id = Column(GUID(), ForeignKey("users.id"), primary_key=True)
+    seq = Column(Integer, primary_key=True, autoincrement=False)
+    # message, message_read, message_preview, chat_deleted, chat_archived
+    kind = Column(String(32), nullable=False)
+    # Без внешнего ключа: запись об удалении чата переживает сам чат
+    chat_id = Column(GUID())
+    payload = Column(JSON)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
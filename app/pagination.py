@@ -0,0 +1,21 @@
+from typing import Optional, Tuple
+from datetime import datetime
+from uuid import UUID
+import base64
+import json
+
+
+def encode_cursor(created_at: datetime, message_id: UUID) -> str:
+    """Непрозрачный курсор на позицию сообщения (created_at, id)"""
+    raw = json.dumps([created_at.isoformat(), UUID(str(message_id)).hex], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, UUID]]:
+    """Разобрать курсор, None для некорректного значения"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, message_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), UUID(hex=message_id)
+    except (ValueError, TypeError):
+        return None
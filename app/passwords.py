@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import asyncio
+import hashlib
+import hmac
+import string
+
+from passlib.context import CryptContext
+
+from app.config import settings
+
+# Соль старой схемы: sha256(password + LEGACY_SALT) в hex
+LEGACY_SALT = "chat_system_salt_2024"
+
+# Схемы, которыми могли быть созданы сохраненные хеши: после смены PASSWORD_HASH_SCHEME
+# старые хеши по-прежнему проверяются
+KNOWN_SCHEMES = ("scrypt", "bcrypt", "argon2", "pbkdf2_sha256")
+
+pwd_context = CryptContext(
+    schemes=[settings.PASSWORD_HASH_SCHEME] + [s for s in KNOWN_SCHEMES if s != settings.PASSWORD_HASH_SCHEME],
+    # Хеши других схем и с другой стоимостью считаются устаревшими и пересчитываются при входе
+    deprecated="auto",
+    **{f"{settings.PASSWORD_HASH_SCHEME}__rounds": settings.PASSWORD_HASH_ROUNDS}
+)
+
+# Хеширование намеренно дорогое - выполняется в ограниченном пуле потоков, а не в event loop
+_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+def is_legacy_hash(hashed_password: str) -> bool:
+    """Хеш старой схемы - 64 hex-символа без идентификатора алгоритма"""
+    return len(hashed_password) == 64 and all(c in string.hexdigits for c in hashed_password)
+
+
+def _legacy_hash(password: str) -> str:
+    return hashlib.sha256(f"{password}{LEGACY_SALT}".encode()).hexdigest()
+
+
+def _verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    if is_legacy_hash(hashed_password):
+        if not hmac.compare_digest(_legacy_hash(password), hashed_password.lower()):
+            return False, None
+        return True, pwd_context.hash(password)
+
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+async def hash_password(password: str) -> str:
+    """Хеш пароля по текущей схеме"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, pwd_context.hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Проверка пароля: (верен ли, новый хеш если сохраненный нужно пересчитать)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _verify_and_update, plain_password, hashed_password)
@@ -0,0 +1,185 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import time
+import uuid
+
+import redis.asyncio as aioredis
+from sqlalchemy import select, update
+
+from app.config import settings
+from app.database import AsyncSessionLocal, as_uuid
+from app import models
+
+
+class PresenceStore:
+    """Реестр присутствия: пользователь онлайн, пока хотя бы один узел продлевает его heartbeat"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        # Идентификатор процесса: у пользователя могут быть сокеты на нескольких узлах
+        self.node_id = uuid.uuid4().hex
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def heartbeat(self, user_id):
+        raise NotImplementedError
+
+    async def remove(self, user_id):
+        raise NotImplementedError
+
+    async def get_online(self, user_ids: Iterable) -> Dict[uuid.UUID, bool]:
+        raise NotImplementedError
+
+    async def is_online(self, user_id) -> bool:
+        user_id = as_uuid(user_id)
+        return (await self.get_online([user_id]))[user_id]
+
+
+class InMemoryPresenceStore(PresenceStore):
+    """Присутствие внутри одного процесса"""
+
+    def __init__(self, ttl: int):
+        super().__init__(ttl)
+        # user_id -> момент истечения heartbeat
+        self.expires_at: Dict[uuid.UUID, float] = {}
+
+    async def heartbeat(self, user_id):
+        self.expires_at[as_uuid(user_id)] = time.monotonic() + self.ttl
+
+    async def remove(self, user_id):
+        self.expires_at.pop(as_uuid(user_id), None)
+
+    async def get_online(self, user_ids: Iterable) -> Dict[uuid.UUID, bool]:
+        now = time.monotonic()
+        result = {}
+        for uid in user_ids:
+            uid = as_uuid(uid)
+            result[uid] = self.expires_at.get(uid, 0) > now
+        return result
+
+
+class RedisPresenceStore(PresenceStore):
+    """Присутствие в Redis: ZSET на пользователя, member - узел, score - момент истечения"""
+
+    def __init__(self, url: str, ttl: int):
+        super().__init__(ttl)
+        self.url = url
+        self.redis: Optional[aioredis.Redis] = None
+
+    def key_for(self, user_id) -> str:
+        return f"presence:{user_id}"
+
+    async def start(self):
+        self.redis = aioredis.from_url(self.url, decode_responses=True)
+
+    async def stop(self):
+        if self.redis:
+            await self.redis.close()
+
+    async def heartbeat(self, user_id):
+        key = self.key_for(user_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {self.node_id: time.time() + self.ttl})
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def remove(self, user_id):
+        await self.redis.zrem(self.key_for(user_id), self.node_id)
+
+    async def get_online(self, user_ids: Iterable) -> Dict[uuid.UUID, bool]:
+        user_ids = [as_uuid(uid) for uid in user_ids]
+        if not user_ids:
+            return {}
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for uid in user_ids:
+                pipe.zcount(self.key_for(uid), now, "+inf")
+            counts = await pipe.execute()
+        return {uid: count > 0 for uid, count in zip(user_ids, counts)}
+
+
+class PresenceWriter:
+    """Отложенная запись online_status/last_seen в БД пакетами"""
+
+    def __init__(self, store: PresenceStore, flush_interval: float, sweep_interval: float):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        # user_id -> (online, last_seen)
+        self.pending: Dict[uuid.UUID, Tuple[bool, Optional[datetime]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._last_sweep = 0.0
+
+    def mark_online(self, user_id):
+        self.pending[as_uuid(user_id)] = (True, None)
+
+    def mark_offline(self, user_id, last_seen: datetime):
+        self.pending[as_uuid(user_id)] = (False, last_seen)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_sweep >= self.sweep_interval:
+                    self._last_sweep = time.monotonic()
+                    await self.sweep()
+            except Exception as e:
+                print(f"Error flushing presence: {e}")
+
+    async def flush(self):
+        """Записать накопленные изменения статусов одним пакетом"""
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+
+        rows = [
+            {"id": user_id, "online_status": online, "last_seen": last_seen}
+            for user_id, (online, last_seen) in pending.items()
+        ]
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(models.User), rows)
+            await db.commit()
+
+    async def sweep(self):
+        """Снять online_status с пользователей, чей heartbeat истек (например, после падения узла)"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(models.User.id).where(models.User.online_status == True))
+            user_ids: List = list(result.scalars().all())
+            if not user_ids:
+                return
+
+            online = await self.store.get_online(user_ids)
+            now = datetime.utcnow()
+            stale = [
+                {"id": uid, "online_status": False, "last_seen": now}
+                for uid in user_ids
+                if not online[uid] and uid not in self.pending
+            ]
+            if stale:
+                await db.execute(update(models.User), stale)
+                await db.commit()
+
+
+def create_presence_store() -> PresenceStore:
+    """Создать реестр присутствия согласно настройкам"""
+    if settings.PRESENCE_BACKEND == "redis":
+        return RedisPresenceStore(settings.REDIS_URL, settings.PRESENCE_TTL)
+    return InMemoryPresenceStore(settings.PRESENCE_TTL)
@@ -0,0 +1,172 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+from uuid import UUID
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import shutil
+import subprocess
+import wave
+
+from sqlalchemy import select
+
+from app import models
+from app.config import settings
+from app.crud import CRUDChanges
+from app.database import AsyncSessionLocal
+from app.events import preview_event, seqs_for
+from app.uploads import UPLOAD_DIR
+from app.websocket_manager import manager as ws_manager
+
+# Функции ниже выполняются в отдельных процессах: только модульный уровень и простые аргументы
+
+
+def _thumbnail_path(src: Path, suffix: str) -> Path:
+    # Исходники адресуются по содержимому - превью одного блоба строится один раз
+    return src.with_name(f"{src.stem}_{suffix}.jpg")
+
+
+def make_image_thumbnail(src: str, max_size: int) -> Optional[Dict[str, Any]]:
+    """Уменьшенная копия изображения (нужен Pillow)"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    src_path = Path(src)
+    dst_path = _thumbnail_path(src_path, "thumb")
+    with Image.open(src_path) as image:
+        width, height = image.size
+        if not dst_path.exists():
+            image.thumbnail((max_size, max_size))
+            image.convert("RGB").save(dst_path, "JPEG", quality=80, optimize=True)
+
+    return {"thumbnail_url": f"/uploads/{dst_path.name}", "width": width, "height": height}
+
+
+def probe_duration(src: str) -> Optional[float]:
+    """Длительность медиафайла: wave для .wav, иначе ffprobe, если установлен"""
+    if src.lower().endswith(".wav"):
+        with wave.open(src, "rb") as audio:
+            return round(audio.getnframes() / float(audio.getframerate()), 3)
+
+    ffprobe = shutil.which("ffprobe")
+    if not ffprobe:
+        return None
+    result = subprocess.run(
+        [ffprobe, "-v", "error", "-show_entries", "format=duration", "-of", "json", src],
+        capture_output=True, timeout=30,
+    )
+    if result.returncode != 0:
+        return None
+    duration = json.loads(result.stdout or "{}").get("format", {}).get("duration")
+    return round(float(duration), 3) if duration else None
+
+
+def make_video_poster(src: str, max_size: int) -> Optional[Dict[str, Any]]:
+    """Кадр-обложка видео и длительность (нужен ffmpeg)"""
+    ffmpeg = shutil.which("ffmpeg")
+    preview: Dict[str, Any] = {}
+
+    duration = probe_duration(src)
+    if duration is not None:
+        preview["duration"] = duration
+
+    if ffmpeg:
+        dst_path = _thumbnail_path(Path(src), "poster")
+        if not dst_path.exists():
+            seek = "1" if (duration or 0) > 1 else "0"
+            subprocess.run(
+                [ffmpeg, "-v", "error", "-y", "-ss", seek, "-i", src, "-frames:v", "1",
+                 "-vf", f"scale='min({max_size},iw)':-2", str(dst_path)],
+                capture_output=True, timeout=60,
+            )
+        if dst_path.exists():
+            preview["thumbnail_url"] = f"/uploads/{dst_path.name}"
+
+    return preview or None
+
+
+def make_audio_preview(src: str, max_size: int) -> Optional[Dict[str, Any]]:
+    """Длительность аудио"""
+    duration = probe_duration(src)
+    return {"duration": duration} if duration is not None else None
+
+
+PREVIEW_BUILDERS = {
+    "image": make_image_thumbnail,
+    "video": make_video_poster,
+    "audio": make_audio_preview,
+}
+
+
+class PreviewPipeline:
+    """Фоновая генерация превью для медиасообщений.
+
+    Тяжелая работа идет в пуле процессов; результат записывается в Message.extra_data["preview"]
+    и отправляется участникам чата событием message_preview.
+    """
+
+    def __init__(self, workers: int, max_size: int):
+        self.workers = workers
+        self.max_size = max_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def start(self):
+        if self._executor is None:
+            # spawn, а не fork: fork копирует процесс uvicorn вместе с блокировками, которые
+            # в этот момент держат потоки aiosqlite и хеширования паролей, и дочерний процесс зависает
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            # Без Pillow make_image_thumbnail молча возвращает None - сообщаем один раз при запуске
+            if importlib.util.find_spec("PIL") is None:
+                print("Pillow is not installed: image thumbnails are disabled")
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, message_id: UUID, message_type: str, media_url: str):
+        """Поставить сообщение в очередь на превью; не ждет результата"""
+        builder = PREVIEW_BUILDERS.get(message_type)
+        if builder is None or self._executor is None:
+            return
+
+        task = asyncio.create_task(self._process(message_id, builder, media_url))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, message_id: UUID, builder, media_url: str):
+        src = UPLOAD_DIR / Path(media_url).name
+        loop = asyncio.get_running_loop()
+        try:
+            preview = await loop.run_in_executor(self._executor, builder, str(src), self.max_size)
+        except Exception as e:
+            print(f"Error building preview for {message_id}: {e}")
+            return
+        if not preview:
+            return
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(models.Message).where(models.Message.id == message_id))
+            message = result.scalars().first()
+            if not message:
+                return
+            # Новый словарь - изменение JSON-колонки на месте ORM не отслеживает
+            message.extra_data = {**(message.extra_data or {}), "preview": preview}
+            seqs = await CRUDChanges(db).record_for([message.sender_id, message.receiver_id], "message_preview",
+                                                    message.chat_id, preview_event(message, preview).to_json())
+            await db.commit()
+
+        await ws_manager.send_to_users(preview_event(message, preview, seqs=seqs_for(seqs)),
+                                       [message.sender_id, message.receiver_id])
+
+
+preview_pipeline = PreviewPipeline(settings.PREVIEW_WORKERS, settings.PREVIEW_MAX_SIZE)
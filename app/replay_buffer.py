@@ -0,0 +1,64 @@
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from app.auth_cache import TTLCache
+
+
+class ReplayBuffer:
+    """Последние исходящие события пользователей с номерами из ленты изменений.
+
+    Переподключившийся клиент получает пропущенные события из памяти без запросов к БД.
+    Если буфер уже вытеснил часть пропуска, клиент досинхронизируется через /chat/sync.
+    Буфер локален для процесса: при переподключении к другому узлу - тоже /chat/sync.
+    """
+
+    def __init__(self, size: int, max_users: int, ttl: float):
+        self.size = size
+        # user_id -> deque[(seq, json)] по возрастанию seq; неактивные пользователи вытесняются LRU и TTL
+        self._users = TTLCache(max_users, ttl)
+        self.replayed = 0
+        self.misses = 0
+
+    def append(self, user_id: UUID, seq: int, message_json: str):
+        events: Optional[Deque[Tuple[int, str]]] = self._users.get(user_id)
+        if events is None:
+            events = deque()
+        if not events or events[-1][0] < seq:
+            events.append((seq, message_json))
+        else:
+            # Транзакции фиксируются и публикуют события не строго по порядку seq
+            index = len(events)
+            while index > 0 and events[index - 1][0] > seq:
+                index -= 1
+            if index > 0 and events[index - 1][0] == seq:
+                return
+            events.insert(index, (seq, message_json))
+        while len(events) > self.size:
+            events.popleft()
+        # set продлевает TTL активного пользователя
+        self._users.set(user_id, events)
+
+    def replay(self, user_id: UUID, since: int, current_seq: int) -> Optional[List[str]]:
+        """События после since; None - в буфере есть пропуски, нужна синхронизация через /chat/sync"""
+        if since >= current_seq:
+            return []
+
+        events = self._users.get(user_id) or ()
+        missed = [(seq, message_json) for seq, message_json in events if seq > since]
+        # Номера должны идти подряд от since + 1 хотя бы до текущего seq пользователя
+        complete = (
+            bool(missed)
+            and missed[-1][0] >= current_seq
+            and all(seq == since + 1 + index for index, (seq, _) in enumerate(missed))
+        )
+        if not complete:
+            self.misses += 1
+            return None
+
+        self.replayed += len(missed)
+        return [message_json for _, message_json in missed]
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._users.stats(), "events_per_user": self.size,
+                "replayed": self.replayed, "replay_misses": self.misses}
@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-import hashlib
 
-from app.database import get_db
+from app.auth_cache import auth_cache
+from app.database import get_db, get_read_db
+from app.passwords import hash_password, verify_password
 from app import schemas, models
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -18,19 +20,6 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 1440
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 
-def hash_password(password: str) -> str:
-    """Простое хеширование пароля с использованием SHA256"""
-
-    salt = "chat_system_salt_2024"
-    return hashlib.sha256(f"{password}{salt}".encode()).hexdigest()
-
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверка пароля"""
-
-    return hash_password(plain_password) == hashed_password
-
-
 def create_access_token(data: dict, expires_delta: timedelta = None):
     """Создание JWT токена авторизации"""
 
@@ -54,7 +43,7 @@ def decode_token(token: str):
         return None
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_read_db)):
     """Получение информации о текущем пользователе по токену JWT"""
 
     credentials_exception = HTTPException(
@@ -62,37 +51,55 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
+    # Проверенный токен и пользователь берутся из кэша - без jwt.decode и запроса к БД
+    user_id = auth_cache.get_token(token)
+    if user_id is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            user_id: str = payload.get("sub")
+            if user_id is None:
+                raise credentials_exception
+        except JWTError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+        auth_cache.set_token(token, user_id, payload.get("exp"))
 
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = auth_cache.get_user(user_id)
     if user is None:
+        result = await db.execute(select(models.User).where(models.User.id == user_id))
+        user = result.scalars().first()
+        # Отдельная сессия чтения закрывается сразу: соединение не держится до конца запроса
+        # (например, пока send_media сохраняет загрузку)
+        await db.close()
+        if user is None:
+            raise credentials_exception
+        auth_cache.set_user(user)
+
+    if user.is_active is False:
         raise credentials_exception
     return user
 
 
 @router.post("/register", response_model=schemas.User)
-async def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     """Регистрация пользователя"""
 
-    existing_user = db.query(models.User).filter(
+    result = await db.execute(select(models.User).where(
         models.User.email == user_data.email
-    ).first()
+    ))
+    existing_user = result.scalars().first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    existing_user = db.query(models.User).filter(
+    result = await db.execute(select(models.User).where(
         models.User.username == user_data.username
-    ).first()
+    ))
+    existing_user = result.scalars().first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already taken")
 
-    hashed_password = hash_password(user_data.password)
+    # Транзакция завершается до хеширования: соединение и очередь писателей не ждут пул потоков
+    await db.commit()
+    hashed_password = await hash_password(user_data.password)
     db_user = models.User(
         username=user_data.username,
         email=user_data.email,
@@ -100,34 +107,76 @@ async def register(user_data: schemas.UserCreate, db: Session = Depends(get_db))
     )
 
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
 
     return db_user
 
 
 @router.post("/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """Авторизация по email/username"""
 
-    user = db.query(models.User).filter(
+    result = await db.execute(select(models.User).where(
         models.User.email == form_data.username
-    ).first()
+    ))
+    user = result.scalars().first()
 
     if not user:
-        user = db.query(models.User).filter(
+        result = await db.execute(select(models.User).where(
             models.User.username == form_data.username
-        ).first()
+        ))
+        user = result.scalars().first()
 
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    # Транзакция завершается до проверки пароля: соединение и очередь писателей не ждут пул потоков
+    await db.commit()
+    password_ok, new_hash = await verify_password(form_data.password, user.hashed_password) if user else (False, None)
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    if new_hash:
+        # Старый SHA-256 или хеш с прежней стоимостью - пересчитываем по текущей схеме
+        user.hashed_password = new_hash
+        await db.commit()
+
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": str(user.id)}, expires_delta=access_token_expires
     )
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    return {"access_token": access_token, "token_type": "bearer"}
+
+@router.post("/change-password")
+async def change_password(password_data: schemas.PasswordChange, current_user: models.User = Depends(get_current_user),
+                          db: AsyncSession = Depends(get_db)):
+    """Смена пароля текущего пользователя"""
+
+    result = await db.execute(select(models.User).where(models.User.id == current_user.id))
+    user = result.scalars().first()
+    # Транзакция завершается до хеширования: соединение и очередь писателей не ждут пул потоков
+    await db.commit()
+    password_ok, _ = await verify_password(password_data.current_password, user.hashed_password)
+    if not password_ok:
+        raise HTTPException(status_code=400, detail="Incorrect password")
+
+    user.hashed_password = await hash_password(password_data.new_password)
+    await db.commit()
+    await auth_cache.publish_invalidation(user.id)
+
+    return {"status": "success"}
+
+
+@router.post("/deactivate")
+async def deactivate_user(current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Деактивация учетной записи текущего пользователя"""
+
+    result = await db.execute(select(models.User).where(models.User.id == current_user.id))
+    user = result.scalars().first()
+    user.is_active = False
+    await db.commit()
+    await auth_cache.publish_invalidation(user.id)
+
+    return {"status": "success"}
@@ -1,24 +1,29 @@
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, UploadFile, File, Form, Query, \
     Request
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, FileResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List, Dict, Any
+from fastapi.responses import HTMLResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, update
+from typing import List, Dict, Any, Optional
 from uuid import UUID
 from datetime import datetime
-import shutil
-from pathlib import Path
-import uuid as uuid_lib
 
-from app.database import get_db
+from app.database import get_db, get_read_db, AsyncSessionLocal, ReadSessionLocal
 from app import schemas, models
+from app.crud import CRUDChanges, CRUDChat
+from app.events import chat_update_event, read_event, seqs_for
+from app.pagination import encode_cursor, decode_cursor
+from app.config import settings
+from app.media import media_response
+from app.message_batcher import message_batcher
+from app.message_service import MessageService, publish_message
+from app.previews import preview_pipeline
+from app.uploads import UPLOAD_DIR, save_upload
 from .auth import get_current_user, decode_token
 from app.websocket_manager import manager as ws_manager
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 templates = Jinja2Templates(directory="app/static/templates")
 
@@ -48,10 +53,9 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
             return
 
         user_id = UUID(user_id_str)
-        db_gen = get_db()
-        db = next(db_gen)
-
-        user = db.query(models.User).filter(models.User.id == user_id).first()
+        async with ReadSessionLocal() as db:
+            result = await db.execute(select(models.User).where(models.User.id == user_id))
+            user = result.scalars().first()
         if not user:
             await websocket.send_json({
                 "type": "error",
@@ -59,17 +63,31 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
             })
             await websocket.close(code=4001)
             return
+        # Как и get_current_user: токен деактивированного пользователя не открывает сокет
+        if user.is_active is False:
+            await websocket.send_json({
+                "type": "error",
+                "message": "Inactive user"
+            })
+            await websocket.close(code=4001)
+            return
 
-        await ws_manager.connect(user_id, websocket)
-        user.online_status = True
-        user.last_seen = None
-        db.commit()
+        # Возобновление: клиент передает последний полученный seq и получает только пропущенное
+        since = websocket.query_params.get("since")
+        since = int(since) if since and since.isdigit() else None
+
+        # online_status/last_seen записываются в БД пакетно через ws_manager.presence_writer
+        resumed = await ws_manager.connect(user_id, websocket, since, user.change_seq)
         await websocket.send_json({
             "type": "connection",
             "status": "connected",
             "user_id": user_id_str,
+            "seq": user.change_seq,
             "timestamp": datetime.now().isoformat()
         })
+        if not resumed:
+            # Пропуск уже вытеснен из буфера - клиент забирает его через /chat/sync
+            await websocket.send_json({"type": "resync", "since": since, "seq": user.change_seq})
 
         print(f"User {user_id_str} successfully connected via WebSocket")
 
@@ -79,22 +97,19 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
                 message_type = data.get("type")
 
                 if message_type == "ping":
+                    await ws_manager.heartbeat(user_id)
                     await websocket.send_json({
                         "type": "pong",
                         "timestamp": datetime.now().isoformat()
                     })
 
-                elif message_type == "message":
-                    await handle_message(data, user_id, db)
-
-                elif message_type == "typing":
-                    await handle_typing(data, user_id, db)
-
-                elif message_type == "read":
-                    await handle_read(data, user_id, db)
-
-                elif message_type == "chat_update":
-                    await handle_chat_update(data, user_id, db)
+                elif message_type in WS_HANDLERS:
+                    # Короткая сессия на каждый кадр: долгоживущая держала бы в identity map
+                    # устаревшие чаты и счетчики, измененные другими запросами.
+                    # typing только читает - не занимает блокировку записи SQLite
+                    session_factory = ReadSessionLocal if message_type in WS_READ_ONLY else AsyncSessionLocal
+                    async with session_factory() as db:
+                        await WS_HANDLERS[message_type](data, user_id, db)
 
         except WebSocketDisconnect:
             print(f"User {user_id_str} disconnected normally")
@@ -112,78 +127,31 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
         try:
             if 'user_id' in locals():
                 await ws_manager.disconnect(user_id, websocket)
-
-                try:
-                    db_gen = get_db()
-                    db = next(db_gen)
-                    user = db.query(models.User).filter(models.User.id == user_id).first()
-                    if user:
-                        user.online_status = False
-                        user.last_seen = datetime.utcnow()
-                        db.commit()
-                except:
-                    pass
         except:
             pass
         print("WebSocket connection closed")
 
 
-async def handle_message(data: Dict[str, Any], sender_id: UUID, db: Session):
+async def handle_message(data: Dict[str, Any], sender_id: UUID, db: AsyncSession):
     """Обработка нового сообщения"""
+    if settings.WS_GROUP_COMMIT:
+        # Запись пачкой; отправитель получит message_ack после commit
+        message_batcher.submit(sender_id, data)
+        return
+
     try:
         receiver_id = UUID(data.get("receiver_id"))
-        content = data.get("content", "")
-        message_type = data.get("message_type", "text")
-        chat = db.query(models.Chat).filter(
-            (models.Chat.user1_id == sender_id) & (models.Chat.user2_id == receiver_id) |
-            (models.Chat.user1_id == receiver_id) & (models.Chat.user2_id == sender_id)
-        ).first()
-
-        if not chat:
-            user1_id, user2_id = sorted([sender_id, receiver_id])
-            chat = models.Chat(user1_id=user1_id, user2_id=user2_id)
-            db.add(chat)
-            db.commit()
-            db.refresh(chat)
-
-        message = models.Message(
-            chat_id=chat.id,
-            sender_id=sender_id,
-            receiver_id=receiver_id,
-            message_type=message_type,
-            content=content,
+        message, seqs = await MessageService(db).create_message(
+            sender_id, receiver_id,
+            message_type=data.get("message_type", "text"),
+            content=data.get("content", ""),
             reply_to_id=data.get("reply_to_id"),
             forwarded_from_id=data.get("forwarded_from_id"),
             extra_data=data.get("extra_data", {})
         )
+        await db.commit()
 
-        db.add(message)
-
-        chat.updated_at = datetime.utcnow()
-        chat.last_message_id = message.id
-
-        if str(chat.user1_id) == str(receiver_id):
-            chat.unread_count_user1 += 1
-        else:
-            chat.unread_count_user2 += 1
-
-        db.commit()
-        db.refresh(message)
-
-        ws_message = {
-            "type": "message",
-            "message_id": str(message.id),
-            "chat_id": str(chat.id),
-            "sender_id": str(sender_id),
-            "receiver_id": str(receiver_id),
-            "content": message.content,
-            "message_type": message.message_type,
-            "created_at": message.created_at.isoformat(),
-            "is_read": message.is_read
-        }
-
-        await ws_manager.send_personal_message(ws_message, sender_id)
-        await ws_manager.send_personal_message(ws_message, receiver_id)
+        await publish_message(message, seqs)
 
         print(f"Message sent from {sender_id} to {receiver_id}")
 
@@ -191,287 +159,262 @@ async def handle_message(data: Dict[str, Any], sender_id: UUID, db: Session):
         print(f"Error handling message: {e}")
 
 
-async def handle_typing(data: Dict[str, Any], user_id: UUID, db: Session):
+async def handle_typing(data: Dict[str, Any], user_id: UUID, db: AsyncSession):
     """Обработка индикатора набора"""
     try:
         chat_id = UUID(data.get("chat_id"))
         is_typing = data.get("is_typing", False)
 
-        chat = db.query(models.Chat).filter(
-            models.Chat.id == chat_id, (models.Chat.user1_id == user_id) | (models.Chat.user2_id == user_id)).first()
+        result = await db.execute(select(models.Chat).where(
+            models.Chat.id == chat_id, (models.Chat.user1_id == user_id) | (models.Chat.user2_id == user_id)))
+        chat = result.scalars().first()
 
         if not chat:
             return
 
-        receiver_id = chat.user2_id if str(chat.user1_id) == str(user_id) else chat.user1_id
-        typing_message = {
-            "type": "typing",
-            "chat_id": str(chat_id),
-            "user_id": str(user_id),
-            "is_typing": is_typing,
-            "timestamp": datetime.now().isoformat()
-        }
-
-        await ws_manager.send_personal_message(typing_message, receiver_id)
-
-        print(f"Typing indicator from {user_id} in chat {chat_id}")
+        receiver_id = chat.user2_id if chat.user1_id == user_id else chat.user1_id
+        if await ws_manager.typing.set_typing(chat_id, user_id, receiver_id, is_typing):
+            print(f"Typing indicator from {user_id} in chat {chat_id}")
 
     except Exception as e:
         print(f"Error handling typing: {e}")
 
 
-async def handle_read(data: Dict[str, Any], user_id: UUID, db: Session):
-    """Обработка отметки о прочтении"""
+async def handle_read(data: Dict[str, Any], user_id: UUID, db: AsyncSession):
+    """Обработка отметки о прочтении: все сообщения чата до message_id включительно"""
     try:
         message_id = UUID(data.get("message_id"))
-        message = db.query(models.Message).filter(models.Message.id == message_id).first()
+        message = await CRUDChat(db).get_message_by_id(message_id)
         if not message:
             return
 
-        if str(message.receiver_id) != str(user_id):
+        if user_id not in (message.receiver_id, message.sender_id):
             return
 
-        if not message.is_read:
-            message.is_read = True
-            message.read_at = datetime.utcnow()
-            chat = db.query(models.Chat).filter(models.Chat.id == message.chat_id).first()
-            if chat:
-                if str(chat.user1_id) == str(user_id):
-                    chat.unread_count_user1 = 0
-                else:
-                    chat.unread_count_user2 = 0
-
-            read_status = models.MessageReadStatus(
-                message_id=message_id,
-                user_id=user_id
-            )
-            db.add(read_status)
-            db.commit()
-
-            read_message = {
-                "type": "message_read",
-                "message_id": str(message_id),
-                "chat_id": str(message.chat_id),
-                "reader_id": str(user_id),
-                "timestamp": datetime.now().isoformat()
-            }
-
-            await ws_manager.send_personal_message(read_message, message.sender_id)
-
-            print(f"Message {message_id} marked as read by {user_id}")
+        read_count = await mark_read_and_notify(db, message, user_id)
+        if read_count:
+            print(f"{read_count} messages up to {message_id} marked as read by {user_id}")
 
     except Exception as e:
         print(f"Error handling read: {e}")
 
 
-async def handle_chat_update(data: Dict[str, Any], user_id: UUID, db: Session):
+async def mark_read_and_notify(db: AsyncSession, message: models.Message, user_id: UUID) -> int:
+    """Сдвинуть отметку прочтения до message и отправить собеседнику одно агрегированное событие"""
+
+    read_count, unread_count = await CRUDChat(db).mark_read_up_to(message, user_id)
+    if not read_count:
+        await db.rollback()
+        return 0
+
+    other_user_id = message.sender_id if message.receiver_id == user_id else message.receiver_id
+    # Одна запись и в ленту читателя (его другие устройства), и в ленту собеседника
+    payload = {**read_event(message, user_id, read_count).to_json(), "reader_unread_count": unread_count}
+    seqs = await CRUDChanges(db).record_for([user_id, other_user_id], "message_read", message.chat_id, payload)
+    await db.commit()
+
+    # Читателю тоже: в буфере возобновления не должно быть пропусков номеров
+    await ws_manager.send_to_users(read_event(message, user_id, read_count, seqs=seqs_for(seqs)),
+                                   [other_user_id, user_id])
+    return read_count
+
+
+async def handle_chat_update(data: Dict[str, Any], user_id: UUID, db: AsyncSession):
     """Обработка обновления чата"""
     pass
 
 
+WS_HANDLERS = {
+    "message": handle_message,
+    "typing": handle_typing,
+    "read": handle_read,
+    "message_read": handle_read,
+    "chat_update": handle_chat_update,
+}
+WS_READ_ONLY = {"typing"}
+
+
+@router.get("/sync", response_model=schemas.SyncResponse)
+async def sync_changes(since: int = Query(0, ge=0), limit: int = Query(settings.SYNC_PAGE_SIZE, ge=1, le=1000),
+                       current_user: models.User = Depends(get_current_user),
+                       db: AsyncSession = Depends(get_read_db)):
+    """Изменения после since: новые сообщения, прочтения, превью, удаление и архивация чатов"""
+
+    changes = CRUDChanges(db)
+    seq = await changes.get_current_seq(current_user.id)
+    if since > seq:
+        # Клиент знает о seq, которого нет - нужна полная перезагрузка
+        return schemas.SyncResponse(seq=seq, reset=True)
+
+    items, has_more = await changes.get_changes(current_user.id, since, limit)
+    if since < seq and (not items or items[0].seq > since + 1):
+        # Изменения после since уже удалены из ленты - догнать ее нельзя
+        return schemas.SyncResponse(seq=seq, reset=True)
+    return schemas.SyncResponse(seq=items[-1].seq if items else seq, changes=items, has_more=has_more)
+
+
 @router.get("/messages/{user_id}", response_model=List[schemas.Message])
 async def get_messages_by_id(user_id: UUID, skip: int = 0, limit: int = 100,
-                             current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+                             current_user: models.User = Depends(get_current_user),
+                             db: AsyncSession = Depends(get_read_db)):
     """Получить все сообщения текущего пользователем"""
 
-    chat = db.query(models.Chat).filter(
+    result = await db.execute(select(models.Chat).where(
         (models.Chat.user1_id == current_user.id) & (models.Chat.user2_id == user_id) |
         (models.Chat.user1_id == user_id) & (models.Chat.user2_id == current_user.id)
-    ).first()
+    ))
+    chat = result.scalars().first()
 
     if not chat:
         return []
 
-    messages = db.query(models.Message).filter(
-        models.Message.chat_id == chat.id
-    ).order_by(models.Message.created_at).offset(skip).limit(limit).all()
+    return await CRUDChat(db).get_messages_by_chat(chat.id, skip=skip, limit=limit)
 
-    for message in messages:
-        if not message.is_read and str(message.receiver_id) == str(current_user.id):
-            message.is_read = True
-            message.read_at = datetime.utcnow()
-            read_status = models.MessageReadStatus(
-                message_id=message.id,
-                user_id=current_user.id
-            )
-            db.add(read_status)
 
-    db.commit()
+@router.get("/messages/{user_id}/history", response_model=schemas.MessagePage)
+async def get_message_history(user_id: UUID, before: Optional[str] = None, after: Optional[str] = None,
+                              limit: int = Query(50, ge=1, le=200),
+                              current_user: models.User = Depends(get_current_user),
+                              db: AsyncSession = Depends(get_read_db)):
+    """История сообщений с курсорной пагинацией (без курсора - последние сообщения)"""
 
-    return messages
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after' cursor")
 
+    before_key = decode_cursor(before) if before else None
+    after_key = decode_cursor(after) if after else None
+    if (before and before_key is None) or (after and after_key is None):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-@router.get("/chats", response_model=List[schemas.ChatInfo])
-async def get_all_chats(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Получить все чаты текущего пользователя с последним сообщением"""
+    crud = CRUDChat(db)
+    chat = await crud.get_chat_by_users(current_user.id, user_id)
+    if not chat:
+        return schemas.MessagePage(messages=[])
 
-    chats = db.query(models.Chat).filter(
-        (models.Chat.user1_id == current_user.id) | (models.Chat.user2_id == current_user.id),
-        models.Chat.is_active == True
-    ).order_by(models.Chat.updated_at.desc()).all()
-
-    result = []
-
-    for chat in chats:
-        other_user_id = chat.user2_id if str(chat.user1_id) == str(current_user.id) else chat.user1_id
-        other_user = db.query(models.User).filter(models.User.id == other_user_id).first()
-
-        if not other_user:
-            continue
-
-        last_message = db.query(models.Message).filter(
-            models.Message.chat_id == chat.id
-        ).order_by(models.Message.created_at.desc()).first()
-
-        if str(chat.user1_id) == str(current_user.id):
-            unread_count = chat.unread_count_user1
-        else:
-            unread_count = chat.unread_count_user2
-
-        is_online = ws_manager.is_user_online(other_user_id)
-        other_user_with_status = schemas.User(
-            id=other_user.id,
-            username=other_user.username,
-            email=other_user.email,
-            is_active=other_user.is_active,
-            online_status=other_user.online_status,
-            last_seen=other_user.last_seen,
-            profile_image=other_user.profile_image,
-            created_at=other_user.created_at
-        )
+    messages, has_more = await crud.get_messages_page(chat.id, before=before_key, after=after_key, limit=limit)
+    if not messages:
+        return schemas.MessagePage(messages=[])
 
-        other_user_with_status_dict = other_user_with_status.dict()
-        other_user_with_status_dict["is_online"] = is_online
+    oldest = encode_cursor(messages[0].created_at, messages[0].id)
+    newest = encode_cursor(messages[-1].created_at, messages[-1].id)
+    if after_key is not None:
+        return schemas.MessagePage(messages=messages, next_cursor=newest if has_more else None, prev_cursor=oldest)
+    return schemas.MessagePage(messages=messages, next_cursor=oldest if has_more else None, prev_cursor=newest)
 
-        result.append(schemas.ChatInfo(
-            id=chat.id,
-            user1_id=chat.user1_id,
-            user2_id=chat.user2_id,
-            other_user=other_user_with_status_dict,
-            last_message=last_message,
-            unread_count=unread_count,
-            created_at=chat.created_at,
-            updated_at=chat.updated_at
-        ))
-    return result
+
+@router.get("/chats", response_model=List[schemas.ChatInfo])
+async def get_all_chats(current_user: models.User = Depends(get_current_user),
+                        db: AsyncSession = Depends(get_read_db)):
+    """Получить все чаты текущего пользователя с последним сообщением"""
+
+    rows = await CRUDChat(db).get_chat_list(current_user.id)
+    return await build_chat_list(rows, current_user.id)
 
 
 @router.post("/chats/by-date", response_model=List[schemas.ChatInfo])
 async def get_chats_by_date(date_filter: schemas.DateFilter, current_user: models.User = Depends(get_current_user),
-                            db: Session = Depends(get_db)):
+                            db: AsyncSession = Depends(get_read_db)):
     """Получить чаты по диапазону дат последнего сообщения"""
 
-    subquery = db.query(
-        models.Message.chat_id,
-        func.max(models.Message.created_at).label('last_message_date')
-    ).group_by(models.Message.chat_id).subquery()
-
-    chats = db.query(models.Chat).join(
-        subquery, models.Chat.id == subquery.c.chat_id).filter(
-        (models.Chat.user1_id == current_user.id) | (models.Chat.user2_id == current_user.id),
-        models.Chat.is_active == True,
-        subquery.c.last_message_date.between(date_filter.start_date, date_filter.end_date)
-    ).order_by(subquery.c.last_message_date.desc()).all()
-
-    result = []
-
-    for chat in chats:
-        other_user_id = chat.user2_id if str(chat.user1_id) == str(current_user.id) else chat.user1_id
-        other_user = db.query(models.User).filter(models.User.id == other_user_id).first()
-
-        if not other_user:
-            continue
-
-        last_message = db.query(models.Message).filter(models.Message.chat_id == chat.id
-                                                       ).order_by(models.Message.created_at.desc()).first()
-
-        if str(chat.user1_id) == str(current_user.id):
-            unread_count = chat.unread_count_user1
-        else:
-            unread_count = chat.unread_count_user2
-
-        is_online = ws_manager.is_user_online(other_user_id)
-        other_user_with_status = schemas.User(
-            id=other_user.id,
-            username=other_user.username,
-            email=other_user.email,
-            is_active=other_user.is_active,
-            online_status=other_user.online_status,
-            last_seen=other_user.last_seen,
-            profile_image=other_user.profile_image,
-            created_at=other_user.created_at
-        )
+    rows = await CRUDChat(db).get_chat_list(current_user.id, date_filter.start_date, date_filter.end_date)
+    return await build_chat_list(rows, current_user.id)
+
+
+async def build_chat_list(rows, current_user_id: UUID) -> List[schemas.ChatInfo]:
+    """Собрать ChatInfo из строк (строка списка чатов, собеседник, последнее сообщение)"""
+
+    online_users = await ws_manager.get_online_users([other_user.id for _, other_user, _ in rows])
+
+    chat_infos = []
+    for entry, other_user, last_message in rows:
+        user1_id, user2_id = sorted([current_user_id, other_user.id])
 
-        other_user_with_status_dict = other_user_with_status.dict()
-        other_user_with_status_dict["is_online"] = is_online
+        other_user_with_status = schemas.UserWithStatus.model_validate(other_user)
+        other_user_with_status.is_online = online_users[other_user.id]
 
-        result.append(schemas.ChatInfo(
-            id=chat.id,
-            user1_id=chat.user1_id,
-            user2_id=chat.user2_id,
-            other_user=other_user_with_status_dict,
+        chat_infos.append(schemas.ChatInfo(
+            id=entry.chat_id,
+            user1_id=user1_id,
+            user2_id=user2_id,
+            other_user=other_user_with_status,
             last_message=last_message,
-            unread_count=unread_count,
-            created_at=chat.created_at,
-            updated_at=chat.updated_at
+            last_message_preview=entry.last_message_preview,
+            unread_count=entry.unread_count,
+            created_at=entry.created_at,
+            updated_at=entry.updated_at
         ))
-    return result
+    return chat_infos
 
 
 @router.delete("/{chat_id}")
 async def delete_chat_by_id(chat_id: UUID, current_user: models.User = Depends(get_current_user),
-                            db: Session = Depends(get_db)):
+                            db: AsyncSession = Depends(get_db)):
     """Удалить чат по ID"""
 
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id, models.Chat.is_active == True).first()
+    result = await db.execute(select(models.Chat).where(models.Chat.id == chat_id, models.Chat.is_active == True))
+    chat = result.scalars().first()
 
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
 
-    if str(current_user.id) not in [str(chat.user1_id), str(chat.user2_id)]:
+    if current_user.id not in (chat.user1_id, chat.user2_id):
         raise HTTPException(status_code=403, detail="Not authorized to delete this chat")
 
-    db.query(models.Message).filter(models.Message.chat_id == chat_id).delete()
-    db.delete(chat)
-    db.commit()
-
+    await CRUDChat(db).remove_from_inbox(chat_id)
+    # chats.last_message_id ссылается на удаляемые сообщения - обнуляется в той же транзакции
+    await db.execute(update(models.Chat).where(models.Chat.id == chat_id).values(last_message_id=None)
+                     .execution_options(synchronize_session=False))
+    # Отметки прочтения ссылаются и на чат, и на его сообщения
+    await db.execute(delete(models.ChatReadState).where(models.ChatReadState.chat_id == chat_id))
+    await db.execute(delete(models.Message).where(models.Message.chat_id == chat_id))
+    await db.execute(delete(models.Chat).where(models.Chat.id == chat_id))
+    seqs = await CRUDChanges(db).record_for([chat.user1_id, chat.user2_id], "chat_deleted", chat_id, {})
+    await db.commit()
+
+    await ws_manager.send_to_users(chat_update_event(chat_id, "deleted", seqs), [chat.user1_id, chat.user2_id])
     return {"message": "Chat deleted successfully"}
 
 
 @router.put("/archive/{chat_id}")
 async def archive_chat_by_id(chat_id: UUID, current_user: models.User = Depends(get_current_user),
-                             db: Session = Depends(get_db)):
+                             db: AsyncSession = Depends(get_db)):
     """Добавить чат по ID в архив"""
 
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id, models.Chat.is_active == True).first()
+    result = await db.execute(select(models.Chat).where(models.Chat.id == chat_id, models.Chat.is_active == True))
+    chat = result.scalars().first()
 
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
 
-    if str(current_user.id) not in [str(chat.user1_id), str(chat.user2_id)]:
+    if current_user.id not in (chat.user1_id, chat.user2_id):
         raise HTTPException(status_code=403, detail="Not authorized to delete this chat")
     chat.is_active = False
-    db.commit()
+    await CRUDChat(db).remove_from_inbox(chat_id)
+    seqs = await CRUDChanges(db).record_for([chat.user1_id, chat.user2_id], "chat_archived", chat_id, {})
+    await db.commit()
 
+    await ws_manager.send_to_users(chat_update_event(chat_id, "archived", seqs), [chat.user1_id, chat.user2_id])
     return {"message": "Chat deleted successfully"}
 
 
 @router.post("/new", response_model=schemas.ChatInfo)
 async def make_new_chat(chat_data: schemas.ChatCreate, current_user: models.User = Depends(get_current_user),
-                        db: Session = Depends(get_db)):
+                        db: AsyncSession = Depends(get_db)):
     """Создать новый чат с пользователем"""
 
-    other_user = db.query(models.User).filter(models.User.id == chat_data.user2_id,
-                                              models.User.is_active == True).first()
+    result = await db.execute(select(models.User).where(models.User.id == chat_data.user2_id,
+                                                        models.User.is_active == True))
+    other_user = result.scalars().first()
 
     if not other_user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    existing_chat = db.query(models.Chat).filter(
+    result = await db.execute(select(models.Chat).where(
         (models.Chat.user1_id == current_user.id) & (models.Chat.user2_id == chat_data.user2_id) |
         (models.Chat.user1_id == chat_data.user2_id) & (models.Chat.user2_id == current_user.id),
         models.Chat.is_active == True
-    ).first()
+    ))
+    existing_chat = result.scalars().first()
 
     if existing_chat:
         raise HTTPException(status_code=400, detail="Chat already exists")
@@ -482,10 +425,12 @@ async def make_new_chat(chat_data: schemas.ChatCreate, current_user: models.User
         user2_id=user2_id
     )
     db.add(chat)
-    db.commit()
-    db.refresh(chat)
+    await db.flush()
+    await CRUDChat(db).add_to_inbox(chat)
+    await db.commit()
+    await db.refresh(chat)
 
-    is_online = ws_manager.is_user_online(chat_data.user2_id)
+    is_online = await ws_manager.is_user_online(chat_data.user2_id)
     other_user_with_status = schemas.User(
         id=other_user.id,
         username=other_user.username,
@@ -512,61 +457,24 @@ async def make_new_chat(chat_data: schemas.ChatCreate, current_user: models.User
 
 @router.post("/message", response_model=schemas.Message)
 async def send_message(message_data: schemas.MessageCreate, current_user: models.User = Depends(get_current_user),
-                       db: Session = Depends(get_db)):
+                       db: AsyncSession = Depends(get_db)):
     """Отправить текстовое сообщение (HTTP)"""
 
-    chat = db.query(models.Chat).filter(
-        (models.Chat.user1_id == current_user.id) & (models.Chat.user2_id == message_data.receiver_id) |
-        (models.Chat.user1_id == message_data.receiver_id) & (models.Chat.user2_id == current_user.id)
-    ).first()
-
-    if not chat:
-        user1_id, user2_id = sorted([current_user.id, message_data.receiver_id])
-        chat = models.Chat(user1_id=user1_id, user2_id=user2_id)
-        db.add(chat)
-        db.commit()
-        db.refresh(chat)
-
-    message = models.Message(
-        chat_id=chat.id,
-        sender_id=current_user.id,
-        receiver_id=message_data.receiver_id,
+    message, seqs = await MessageService(db).create_message(
+        current_user.id, message_data.receiver_id,
         message_type=message_data.message_type,
         content=message_data.content,
         reply_to_id=message_data.reply_to_id
     )
+    await db.commit()
 
-    db.add(message)
-
-    chat.updated_at = datetime.utcnow()
-    chat.last_message_id = message.id
-    if str(chat.user1_id) == str(message_data.receiver_id):
-        chat.unread_count_user1 += 1
-    else:
-        chat.unread_count_user2 += 1
-
-    db.commit()
-    db.refresh(message)
-
-    ws_message = {
-        "type": "message",
-        "message_id": str(message.id),
-        "chat_id": str(chat.id),
-        "sender_id": str(current_user.id),
-        "receiver_id": str(message_data.receiver_id),
-        "content": message.content,
-        "message_type": message.message_type.value,
-        "created_at": message.created_at.isoformat(),
-        "is_read": message.is_read
-    }
-
-    await ws_manager.send_personal_message(ws_message, message_data.receiver_id)
+    await publish_message(message, seqs)
     return message
 
 
 @router.post("/media")
 async def send_media(receiver_id: UUID = Form(...), file: UploadFile = File(...),
-                     current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+                     current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """Отправить медиафайл"""
 
     content_type = file.content_type or ""
@@ -579,144 +487,66 @@ async def send_media(receiver_id: UUID = Form(...), file: UploadFile = File(...)
     else:
         message_type = "file"
 
-    chat = db.query(models.Chat).filter(
-        (models.Chat.user1_id == current_user.id) & (models.Chat.user2_id == receiver_id) |
-        (models.Chat.user1_id == receiver_id) & (models.Chat.user2_id == current_user.id)
-    ).first()
-
-    if not chat:
-        user1_id, user2_id = sorted([current_user.id, receiver_id])
-        chat = models.Chat(user1_id=user1_id, user2_id=user2_id)
-        db.add(chat)
-        db.commit()
-        db.refresh(chat)
-
-    file_extension = Path(file.filename).suffix
-    file_name = f"{uuid_lib.uuid4()}{file_extension}"
-    file_path = UPLOAD_DIR / file_name
-
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Одинаковые файлы хранятся один раз: media_url указывает на общий блоб
+    stored = await save_upload(file)
 
-    file_size = file_path.stat().st_size
-
-    message = models.Message(
-        chat_id=chat.id,
-        sender_id=current_user.id,
-        receiver_id=receiver_id,
+    message, seqs = await MessageService(db).create_message(
+        current_user.id, receiver_id,
         message_type=message_type,
-        media_url=f"/uploads/{file_name}",
+        media_url=stored.url,
         file_name=file.filename,
-        file_size=file_size,
+        file_size=stored.size,
         file_type=content_type
     )
+    await db.commit()
 
-    db.add(message)
-    chat.updated_at = datetime.utcnow()
-    chat.last_message_id = message.id
-
-    if str(chat.user1_id) == str(receiver_id):
-        chat.unread_count_user1 += 1
-    else:
-        chat.unread_count_user2 += 1
-
-    db.commit()
-    db.refresh(message)
-
-    ws_message = {
-        "type": "message",
-        "message_id": str(message.id),
-        "chat_id": str(chat.id),
-        "sender_id": str(current_user.id),
-        "receiver_id": str(receiver_id),
-        "message_type": message_type,
-        "media_url": f"/uploads/{file_name}",
-        "file_name": file.filename,
-        "created_at": message.created_at.isoformat(),
-        "is_read": message.is_read
-    }
-
-    await ws_manager.send_personal_message(ws_message, receiver_id)
+    await publish_message(message, seqs)
+    # Миниатюра/обложка придут отдельным событием message_preview
+    preview_pipeline.submit(message.id, message_type, stored.url)
     return message
 
 
 @router.post("/reply/{message_id}")
 async def reply_message(message_id: UUID, content: str = Form(...),
-                        current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+                        current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """Ответить на сообщение"""
 
-    original_message = db.query(models.Message).filter(models.Message.id == message_id).first()
+    result = await db.execute(select(models.Message).where(models.Message.id == message_id))
+    original_message = result.scalars().first()
     if not original_message:
         raise HTTPException(status_code=404, detail="Message not found")
 
-    chat = db.query(models.Chat).filter(models.Chat.id == original_message.chat_id).first()
-    if not chat or (str(current_user.id) not in [str(chat.user1_id), str(chat.user2_id)]):
+    result = await db.execute(select(models.Chat).where(models.Chat.id == original_message.chat_id))
+    chat = result.scalars().first()
+    if not chat or (current_user.id not in (chat.user1_id, chat.user2_id)):
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    message = models.Message(
-        chat_id=chat.id,
-        sender_id=current_user.id,
-        receiver_id=original_message.sender_id,
+    # Ответ получает собеседник, даже если отвечают на собственное сообщение
+    receiver_id = chat.user2_id if chat.user1_id == current_user.id else chat.user1_id
+    message, seqs = await MessageService(db).create_message(
+        current_user.id, receiver_id, chat=chat,
         message_type="text",
         content=content,
         reply_to_id=message_id
     )
+    await db.commit()
 
-    db.add(message)
-
-    chat.updated_at = datetime.utcnow()
-    chat.last_message_id = message.id
-
-    if str(chat.user1_id) == str(original_message.sender_id):
-        chat.unread_count_user1 += 1
-    else:
-        chat.unread_count_user2 += 1
-
-    db.commit()
-    db.refresh(message)
-
-    ws_message = {
-        "type": "message",
-        "message_id": str(message.id),
-        "chat_id": str(chat.id),
-        "sender_id": str(current_user.id),
-        "receiver_id": str(original_message.sender_id),
-        "content": content,
-        "message_type": "text",
-        "reply_to_id": str(message_id),
-        "created_at": message.created_at.isoformat(),
-        "is_read": message.is_read
-    }
-
-    await ws_manager.send_personal_message(ws_message, original_message.sender_id)
+    await publish_message(message, seqs)
     return message
 
 
 @router.post("/forward/{message_id}")
 async def reply_message_to_id(message_id: UUID, receiver_id: UUID = Form(...),
-                              current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+                              current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """Переслать сообщение другому пользователю"""
 
-    original_message = db.query(models.Message).filter(models.Message.id == message_id).first()
+    result = await db.execute(select(models.Message).where(models.Message.id == message_id))
+    original_message = result.scalars().first()
     if not original_message:
         raise HTTPException(status_code=404, detail="Message not found")
 
-    chat = db.query(models.Chat).filter(
-        (models.Chat.user1_id == current_user.id) & (models.Chat.user2_id == receiver_id) |
-        (models.Chat.user1_id == receiver_id) & (models.Chat.user2_id == current_user.id)
-    ).first()
-
-    if not chat:
-        user1_id, user2_id = sorted([current_user.id, receiver_id])
-        chat = models.Chat(user1_id=user1_id, user2_id=user2_id)
-        db.add(chat)
-        db.commit()
-        db.refresh(chat)
-
-    message = models.Message(
-        chat_id=chat.id,
-        sender_id=current_user.id,
-        receiver_id=receiver_id,
+    message, seqs = await MessageService(db).create_message(
+        current_user.id, receiver_id,
         message_type=original_message.message_type,
         content=original_message.content,
         media_url=original_message.media_url,
@@ -725,41 +555,15 @@ async def reply_message_to_id(message_id: UUID, receiver_id: UUID = Form(...),
         file_type=original_message.file_type,
         forwarded_from_id=original_message.sender_id
     )
+    await db.commit()
 
-    db.add(message)
-
-    chat.updated_at = datetime.utcnow()
-    chat.last_message_id = message.id
-    if str(chat.user1_id) == str(receiver_id):
-        chat.unread_count_user1 += 1
-    else:
-        chat.unread_count_user2 += 1
-
-    db.commit()
-    db.refresh(message)
-
-    ws_message = {
-        "type": "message",
-        "message_id": str(message.id),
-        "chat_id": str(chat.id),
-        "sender_id": str(current_user.id),
-        "receiver_id": str(receiver_id),
-        "content": original_message.content,
-        "message_type": original_message.message_type,
-        "media_url": original_message.media_url,
-        "file_name": original_message.file_name,
-        "forwarded_from_id": str(original_message.sender_id),
-        "created_at": message.created_at.isoformat(),
-        "is_read": message.is_read
-    }
-
-    await ws_manager.send_personal_message(ws_message, receiver_id)
+    await publish_message(message, seqs)
     return message
 
 
 @router.post("/file")
 async def send_file(receiver_id: UUID = Form(...), file: UploadFile = File(...),
-                    current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+                    current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """Отправить файл"""
 
     return await send_media(receiver_id, file, current_user, db)
@@ -767,128 +571,64 @@ async def send_file(receiver_id: UUID = Form(...), file: UploadFile = File(...),
 
 @router.post("/read/{message_id}")
 async def mark_message_as_read(message_id: UUID, current_user: models.User = Depends(get_current_user),
-                               db: Session = Depends(get_db)):
-    """Пометить сообщение как прочитанное"""
+                               db: AsyncSession = Depends(get_db)):
+    """Пометить прочитанными сообщения чата до message_id включительно"""
 
-    message = db.query(models.Message).filter(models.Message.id == message_id).first()
+    message = await CRUDChat(db).get_message_by_id(message_id)
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
 
-    if str(message.receiver_id) != str(current_user.id):
+    if current_user.id not in (message.receiver_id, message.sender_id):
         raise HTTPException(status_code=403, detail="Not authorized to mark this message as read")
 
-    if not message.is_read:
-        message.is_read = True
-        message.read_at = datetime.utcnow()
-        chat = db.query(models.Chat).filter(models.Chat.id == message.chat_id).first()
-        if chat:
-            if str(chat.user1_id) == str(current_user.id):
-                chat.unread_count_user1 = 0
-            else:
-                chat.unread_count_user2 = 0
-
-        read_status = models.MessageReadStatus(
-            message_id=message_id,
-            user_id=current_user.id
-        )
-        db.add(read_status)
-        db.commit()
-        read_message = {
-            "type": "message_read",
-            "message_id": str(message_id),
-            "chat_id": str(message.chat_id),
-            "reader_id": str(current_user.id),
-            "timestamp": datetime.now().isoformat()
-        }
-
-        await ws_manager.send_personal_message(read_message, message.sender_id)
-    return {"status": "success", "message": "Message marked as read"}
+    read_count = await mark_read_and_notify(db, message, current_user.id)
+    return {"status": "success", "message": "Messages marked as read", "read_count": read_count}
 
 
 @router.get("/typing/{chat_id}")
 async def get_typing_status(chat_id: UUID, current_user: models.User = Depends(get_current_user),
-                            db: Session = Depends(get_db)):
+                            db: AsyncSession = Depends(get_read_db)):
     """Получить статус набора в чате"""
 
-    chat = db.query(models.Chat).filter(
+    result = await db.execute(select(models.Chat).where(
         models.Chat.id == chat_id,
         (models.Chat.user1_id == current_user.id) | (models.Chat.user2_id == current_user.id)
-    ).first()
+    ))
+    chat = result.scalars().first()
 
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
-    from datetime import timedelta
-    cutoff_time = datetime.utcnow() - timedelta(seconds=10)
-
-    typing_statuses = db.query(models.TypingStatus).filter(
-        models.TypingStatus.chat_id == chat_id,
-        models.TypingStatus.is_typing == True,
-        models.TypingStatus.updated_at >= cutoff_time
-    ).all()
-
-    db.query(models.TypingStatus).filter(
-        models.TypingStatus.updated_at < cutoff_time
-    ).delete()
-    db.commit()
-    return [
-        {
-            "user_id": status.user_id,
-            "is_typing": status.is_typing,
-            "updated_at": status.updated_at
-        }
-        for status in typing_statuses
-    ]
+
+    return ws_manager.typing.get_typing(chat_id)
 
 
 @router.post("/typing/{chat_id}")
 async def set_typing_status(chat_id: UUID, is_typing: bool = True,
-                            current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+                            current_user: models.User = Depends(get_current_user),
+                            db: AsyncSession = Depends(get_read_db)):
     """Установить статус набора в чате"""
 
-    chat = db.query(models.Chat).filter(
+    result = await db.execute(select(models.Chat).where(
         models.Chat.id == chat_id,
         (models.Chat.user1_id == current_user.id) | (models.Chat.user2_id == current_user.id)
-    ).first()
+    ))
+    chat = result.scalars().first()
 
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
 
-    receiver_id = chat.user2_id if str(chat.user1_id) == str(current_user.id) else chat.user1_id
-    typing_status = db.query(models.TypingStatus).filter(
-        models.TypingStatus.chat_id == chat_id,
-        models.TypingStatus.user_id == current_user.id
-    ).first()
-
-    if typing_status:
-        typing_status.is_typing = is_typing
-        typing_status.updated_at = datetime.utcnow()
-    else:
-        typing_status = models.TypingStatus(
-            chat_id=chat_id,
-            user_id=current_user.id,
-            is_typing=is_typing
-        )
-        db.add(typing_status)
-
-    db.commit()
-    typing_message = {
-        "type": "typing",
-        "chat_id": str(chat_id),
-        "user_id": str(current_user.id),
-        "is_typing": is_typing,
-        "timestamp": datetime.now().isoformat()
-    }
-
-    await ws_manager.send_personal_message(typing_message, receiver_id)
+    receiver_id = chat.user2_id if chat.user1_id == current_user.id else chat.user1_id
+    await ws_manager.typing.set_typing(chat_id, current_user.id, receiver_id, is_typing)
     return {"status": "success", "is_typing": is_typing}
 
 
 @router.get("/online/{user_id}")
-async def check_user_online(user_id: UUID, db: Session = Depends(get_db)):
+async def check_user_online(user_id: UUID, db: AsyncSession = Depends(get_read_db)):
     """Проверить онлайн статус пользователя"""
 
-    is_online = ws_manager.is_user_online(user_id)
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    is_online = await ws_manager.is_user_online(user_id)
+    result = await db.execute(select(models.User).where(models.User.id == user_id))
+    user = result.scalars().first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -904,21 +644,14 @@ async def check_user_online(user_id: UUID, db: Session = Depends(get_db)):
 async def get_online_users(user_ids: List[UUID] = Query(...)):
     """Получить статус онлайн для списка пользователей"""
 
-    online_status = {}
-    for uid in user_ids:
-        online_status[str(uid)] = ws_manager.is_user_online(uid)
-
-    return online_status
+    return await ws_manager.get_online_users(user_ids)
 
 
-@router.get("/uploads/{filename}")
-async def get_uploaded_file(filename: str):
-    """Получить загруженный файл"""
+@router.api_route("/uploads/{filename}", methods=["GET", "HEAD"])
+async def get_uploaded_file(filename: str, request: Request):
+    """Получить загруженный файл (поддерживает Range и условные запросы)"""
 
-    file_path = UPLOAD_DIR / filename
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path)
+    return await media_response(request, filename)
 
 
 @router.get("/test-ws", response_class=HTMLResponse)
@@ -18,6 +18,9 @@ class MessageType(str, Enum):
 class WebSocketMessageType(str, Enum):
     MESSAGE = "message"
     MESSAGE_READ = "message_read"
+    MESSAGE_PREVIEW = "message_preview"
+    MESSAGE_ACK = "message_ack"
+    RESYNC = "resync"
     TYPING = "typing"
     USER_STATUS = "user_status"
     ERROR = "error"
@@ -93,6 +96,11 @@ class User(UserBase):
         from_attributes = True
 
 
+class PasswordChange(BaseModel):
+    current_password: str
+    new_password: str
+
+
 class UserWithStatus(User):
     is_online: bool = False
 
@@ -151,6 +159,12 @@ class Message(MessageBase):
         from_attributes = True
 
 
+class MessagePage(BaseModel):
+    messages: List[Message]
+    next_cursor: Optional[str] = None  # следующая страница в направлении листания
+    prev_cursor: Optional[str] = None  # страница в обратном направлении
+
+
 class MessageWithReply(Message):
     reply_to: Optional["Message"] = None
 
@@ -170,6 +184,7 @@ class ChatInfo(BaseModel):
     user2_id: UUID
     other_user: UserWithStatus
     last_message: Optional[Message] = None
+    last_message_preview: Optional[str] = None
     unread_count: int = 0
     created_at: datetime
     updated_at: Optional[datetime] = None
@@ -182,6 +197,26 @@ class ChatWithMessages(ChatInfo):
     messages: List[Message] = []
 
 
+# Incremental sync
+class Change(BaseModel):
+    seq: int
+    kind: str
+    chat_id: Optional[UUID] = None
+    payload: Optional[Dict[str, Any]] = None
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+class SyncResponse(BaseModel):
+    seq: int  # текущий номер ленты; следующий запрос - since=seq
+    changes: List[Change] = []
+    has_more: bool = False
+    # since из будущего (лента сброшена) или старше хранимой ленты - нужна полная перезагрузка
+    reset: bool = False
+
+
 # Filter schemas
 class DateFilter(BaseModel):
     start_date: datetime
@@ -0,0 +1,151 @@
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+import asyncio
+import heapq
+import json
+import time
+
+from app.config import settings
+from app.database import as_uuid
+from app.events import typing_event
+
+
+class TypingEntry:
+    __slots__ = ("receiver_id", "expires_at", "sent_at", "local")
+
+    def __init__(self, receiver_id: Optional[UUID], expires_at: float, sent_at: float, local: bool):
+        self.receiver_id = receiver_id
+        self.expires_at = expires_at
+        # Когда собеседнику последний раз ушло is_typing=true (для троттлинга)
+        self.sent_at = sent_at
+        # Набор начат на этом узле: только он отправляет событие об окончании по таймауту
+        self.local = local
+
+
+class TypingService:
+    """Индикаторы набора в памяти с истечением по TTL.
+
+    Истечение - через кучу (expires_at, chat_id, user_id): задача спит до ближайшего срока.
+    Повторные typing в пределах throttle не рассылаются, только продлевают TTL.
+    Состояние других узлов приходит через общий канал брокера.
+    """
+
+    def __init__(self, manager, ttl: float, throttle: float):
+        self.manager = manager
+        self.ttl = ttl
+        self.throttle = throttle
+        # chat_id -> {user_id: TypingEntry}
+        self.chats: Dict[UUID, Dict[UUID, TypingEntry]] = {}
+        self._heap: List[Tuple[float, UUID, UUID]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.throttled = 0
+
+    async def start(self):
+        await self.manager.broker.subscribe(settings.TYPING_CHANNEL, self._on_remote)
+        self._task = asyncio.create_task(self._expire_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.manager.broker.unsubscribe(settings.TYPING_CHANNEL, self._on_remote)
+
+    async def set_typing(self, chat_id: UUID, user_id: UUID, receiver_id: UUID, is_typing: bool) -> bool:
+        """Обновить статус набора; True - событие отправлено собеседнику"""
+        chat_id, user_id = as_uuid(chat_id), as_uuid(user_id)
+        now = time.monotonic()
+        entry = self.chats.get(chat_id, {}).get(user_id)
+
+        if is_typing:
+            if entry is not None and now - entry.sent_at < self.throttle:
+                # Частые нажатия клавиш: только продлеваем TTL
+                self._schedule(chat_id, user_id, entry, now + self.ttl)
+                self.throttled += 1
+                return False
+            entry = TypingEntry(receiver_id, now + self.ttl, now, local=True)
+            self.chats.setdefault(chat_id, {})[user_id] = entry
+            self._schedule(chat_id, user_id, entry, entry.expires_at)
+        else:
+            if entry is None:
+                # Пользователь и так не печатает - рассылать нечего
+                self.throttled += 1
+                return False
+            self._remove(chat_id, user_id)
+
+        await self._publish(chat_id, user_id, is_typing)
+        await self.manager.send_personal_message(typing_event(chat_id, user_id, is_typing), receiver_id)
+        self.sent += 1
+        return True
+
+    def get_typing(self, chat_id: UUID) -> List[dict]:
+        """Кто сейчас печатает в чате"""
+        now = time.monotonic()
+        return [
+            {"user_id": user_id, "is_typing": True, "expires_in": round(entry.expires_at - now, 1)}
+            for user_id, entry in self.chats.get(as_uuid(chat_id), {}).items()
+            if entry.expires_at > now
+        ]
+
+    def _schedule(self, chat_id: UUID, user_id: UUID, entry: TypingEntry, expires_at: float):
+        entry.expires_at = expires_at
+        heapq.heappush(self._heap, (expires_at, chat_id, user_id))
+        if self._heap[0][0] == expires_at:
+            self._wakeup.set()
+
+    def _remove(self, chat_id: UUID, user_id: UUID) -> Optional[TypingEntry]:
+        # Запись в куче остается и будет пропущена при извлечении
+        users = self.chats.get(chat_id)
+        if not users:
+            return None
+        entry = users.pop(user_id, None)
+        if not users:
+            del self.chats[chat_id]
+        return entry
+
+    async def _expire_loop(self):
+        while True:
+            timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, chat_id, user_id = heapq.heappop(self._heap)
+                entry = self.chats.get(chat_id, {}).get(user_id)
+                # Устаревшая запись кучи: TTL продлен или набор уже завершен
+                if entry is None or entry.expires_at != expires_at:
+                    continue
+                self._remove(chat_id, user_id)
+                if entry.local and entry.receiver_id is not None:
+                    try:
+                        await self.manager.send_personal_message(
+                            typing_event(chat_id, user_id, False), entry.receiver_id)
+                    except Exception as e:
+                        print(f"Error sending typing timeout: {e}")
+
+    async def _publish(self, chat_id: UUID, user_id: UUID, is_typing: bool):
+        payload = json.dumps({"node": self.manager.presence.node_id, "chat_id": chat_id.hex,
+                              "user_id": user_id.hex, "is_typing": is_typing})
+        await self.manager.broker.publish(settings.TYPING_CHANNEL, payload)
+
+    async def _on_remote(self, channel: str, message: str):
+        """Состояние набора с других узлов - для GET /typing"""
+        data = json.loads(message)
+        if data["node"] == self.manager.presence.node_id:
+            return
+        chat_id, user_id = UUID(hex=data["chat_id"]), UUID(hex=data["user_id"])
+        if data["is_typing"]:
+            entry = TypingEntry(None, 0, time.monotonic(), local=False)
+            self.chats.setdefault(chat_id, {})[user_id] = entry
+            self._schedule(chat_id, user_id, entry, time.monotonic() + self.ttl)
+        else:
+            self._remove(chat_id, user_id)
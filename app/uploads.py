@@ -0,0 +1,90 @@
+from dataclasses import dataclass
+from pathlib import Path
+import hashlib
+import uuid
+
+import aiofiles
+import aiofiles.os
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from app.config import settings
+
+UPLOAD_DIR = Path("uploads")
+
+ALLOWED_EXTENSIONS = {ext for extensions in settings.ALLOWED_EXTENSIONS.values() for ext in extensions}
+
+
+class UploadSizeLimitMiddleware:
+    """Отклоняет multipart-запрос с Content-Length больше лимита до чтения тела.
+
+    Форму целиком разбирает и складывает во временный файл Starlette еще до вызова маршрута,
+    поэтому проверка в save_upload не экономит ни трафик, ни диск. Запросы без Content-Length
+    (chunked) по-прежнему ограничивает только save_upload.
+    """
+
+    def __init__(self, app, max_body_size: int = settings.MAX_FILE_SIZE + settings.UPLOAD_FORM_OVERHEAD):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = dict(scope["headers"])
+            content_type = headers.get(b"content-type", b"")
+            content_length = headers.get(b"content-length", b"")
+            if (content_type.startswith(b"multipart/form-data") and content_length.isdigit()
+                    and int(content_length) > self.max_body_size):
+                response = JSONResponse({"detail": "File is too large"}, status_code=413)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+@dataclass
+class StoredFile:
+    name: str  # имя блоба: sha256 содержимого + расширение
+    size: int
+    sha256: str
+    deduplicated: bool  # такой файл уже был сохранен
+
+    @property
+    def url(self) -> str:
+        return f"/uploads/{self.name}"
+
+
+async def save_upload(file: UploadFile) -> StoredFile:
+    """Потоково сохранить загрузку в хранилище с адресацией по содержимому.
+
+    Файл пишется чанками во временный файл с подсчетом размера и sha256; лимит
+    MAX_FILE_SIZE проверяется по мере чтения. Одинаковые файлы хранятся один раз.
+    """
+    extension = Path(file.filename or "").suffix.lower()
+    if extension not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"File type '{extension}' is not allowed")
+
+    UPLOAD_DIR.mkdir(exist_ok=True)
+    tmp_path = UPLOAD_DIR / f".upload-{uuid.uuid4().hex}"
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        async with aiofiles.open(tmp_path, "wb") as buffer:
+            while chunk := await file.read(settings.UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > settings.MAX_FILE_SIZE:
+                    raise HTTPException(status_code=413, detail="File is too large")
+                digest.update(chunk)
+                await buffer.write(chunk)
+
+        sha256 = digest.hexdigest()
+        name = f"{sha256}{extension}"
+        final_path = UPLOAD_DIR / name
+        if await aiofiles.os.path.exists(final_path):
+            return StoredFile(name=name, size=size, sha256=sha256, deduplicated=True)
+
+        # Переименование атомарно: параллельная загрузка того же файла просто перезапишет блоб
+        await aiofiles.os.replace(tmp_path, final_path)
+        return StoredFile(name=name, size=size, sha256=sha256, deduplicated=False)
+    finally:
+        if await aiofiles.os.path.exists(tmp_path):
+            await aiofiles.os.remove(tmp_path)
@@ -1,72 +1,303 @@
-from typing import Dict, Set, List
-import json
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
 import asyncio
 from uuid import UUID
 from datetime import datetime
 
+from app.broker import Broker, create_broker
+from app.config import settings
+from app.database import as_uuid
+from app.events import Event
+from app.presence import PresenceStore, PresenceWriter, create_presence_store
+from app.replay_buffer import ReplayBuffer
+from app.typing_service import TypingService
+
+
+# Политики переполнения исходящей очереди
+OVERFLOW_DISCONNECT = "disconnect"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+
+# WebSocket close code 1013 "Try Again Later" - клиент не успевает читать
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+def get_event_type(message_json: str) -> str:
+    """Тип события без разбора JSON: Event.encode всегда ставит ключ "type" первым"""
+    prefix = '{"type":"'
+    if not message_json.startswith(prefix):
+        return ""
+    end = message_json.find('"', len(prefix))
+    return message_json[len(prefix):end] if end != -1 else ""
+
+
+class ClientConnection:
+    """Сокет с ограниченной исходящей очередью и собственной задачей-писателем"""
+
+    def __init__(self, manager: "ConnectionManager", user_id: UUID, websocket,
+                 max_size: int, overflow_policy: str):
+        self.manager = manager
+        self.user_id = user_id
+        self.websocket = websocket
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        # (тип события, JSON) в порядке отправки
+        self.queue: Deque[Tuple[str, str]] = deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.max_depth = 0
+        self.sent = 0
+        self.dropped = 0
+        self.writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, message_json: str) -> bool:
+        """Поставить сообщение в очередь не дожидаясь отправки; False - сообщение не принято"""
+        if self.closed:
+            return False
+
+        event_type = get_event_type(message_json)
+        if len(self.queue) >= self.max_size and not self._make_room(event_type):
+            return False
+
+        self.queue.append((event_type, message_json))
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.ready.set()
+        return True
+
+    def _make_room(self, event_type: str) -> bool:
+        """Освободить место в полной очереди согласно политике переполнения"""
+        droppable = settings.WEBSOCKET_DROPPABLE_EVENTS
+        # Сначала вытесняем самое старое событие, которое можно потерять (typing и т.п.)
+        for index, (queued_type, _) in enumerate(self.queue):
+            if queued_type in droppable:
+                del self.queue[index]
+                self.dropped += 1
+                return True
+
+        if event_type in droppable:
+            self.dropped += 1
+            return False
+
+        if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+            self.queue.popleft()
+            self.dropped += 1
+            return True
+
+        # Клиент не успевает читать - отключаем, чтобы не копить память
+        print(f"Slow consumer {self.user_id}: queue is full ({len(self.queue)}), disconnecting")
+        self.manager.slow_disconnects += 1
+        self.closed = True
+        asyncio.create_task(self.manager.drop_connection(self, SLOW_CONSUMER_CLOSE_CODE))
+        return False
+
+    async def _write_loop(self):
+        while not self.closed:
+            if not self.queue:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+
+            _, message_json = self.queue.popleft()
+            try:
+                await self.websocket.send_text(message_json)
+                self.sent += 1
+            except Exception as e:
+                print(f"Error sending message to {self.user_id}: {e}")
+                self.closed = True
+                await self.manager.disconnect(self.user_id, self.websocket)
+
+    def close(self):
+        """Остановить писателя; неотправленные сообщения отбрасываются"""
+        self.closed = True
+        self.dropped += len(self.queue)
+        self.queue.clear()
+        # Писатель сам вызывает disconnect при ошибке отправки - не отменяем его изнутри
+        if self.writer and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+
 
 class ConnectionManager:
-    def __init__(self):
-        # user_id -> set of websocket connections
-        self.active_connections: Dict[str, Set] = {}
+    def __init__(self, broker: Optional[Broker] = None, presence: Optional[PresenceStore] = None):
+        # user_id -> {websocket: ClientConnection} (только сокеты этого процесса).
+        # Ключи - uuid.UUID: сравниваются и хешируются без преобразования в строки
+        self.active_connections: Dict[UUID, Dict[Any, ClientConnection]] = {}
         # user_id -> last seen timestamp
-        self.user_status: Dict[str, datetime] = {}
+        self.user_status: Dict[UUID, datetime] = {}
+        # Имена каналов брокера строятся один раз на пользователя; обратное отображение - для _deliver
+        self._channels: Dict[UUID, str] = {}
+        self._channel_users: Dict[str, UUID] = {}
+        # Брокер доставляет сообщения на тот узел, где открыт сокет получателя
+        self.broker: Broker = broker or create_broker()
+        # Общий для кластера реестр присутствия и отложенная запись статусов в БД
+        self.presence: PresenceStore = presence or create_presence_store()
+        self.presence_writer = PresenceWriter(self.presence, settings.PRESENCE_FLUSH_INTERVAL,
+                                              settings.PRESENCE_SWEEP_INTERVAL)
+        # Индикаторы набора - в памяти, без таблицы в БД
+        self.typing = TypingService(self, settings.TYPING_TTL, settings.TYPING_THROTTLE)
+        # Недавние события с номерами ленты изменений - для возобновления сессии
+        self.replay = ReplayBuffer(settings.REPLAY_BUFFER_SIZE, settings.REPLAY_BUFFER_USERS,
+                                   settings.REPLAY_BUFFER_TTL)
+        # Метрики исходящих очередей
+        self.slow_disconnects = 0
+        self.closed_dropped = 0
+        self.closed_sent = 0
 
-    async def connect(self, user_id: UUID, websocket):
-        """Добавить новое соединение для пользователя"""
-        user_id_str = str(user_id)
-        if user_id_str not in self.active_connections:
-            self.active_connections[user_id_str] = set()
+    async def start(self):
+        await self.broker.start()
+        await self.presence.start()
+        await self.presence_writer.start()
+        await self.typing.start()
 
-        self.active_connections[user_id_str].add(websocket)
-        self.user_status[user_id_str] = datetime.now()
+    async def stop(self):
+        for connections in self.active_connections.values():
+            for connection in connections.values():
+                connection.close()
+        await self.typing.stop()
+        await self.presence_writer.stop()
+        await self.presence.stop()
+        await self.broker.stop()
 
-        print(f"User {user_id_str} connected. Total connections: {len(self.active_connections)}")
-        return True
+    def channel_for(self, user_id) -> str:
+        """Канал брокера для пользователя"""
+        user_id = as_uuid(user_id)
+        channel = self._channels.get(user_id)
+        if channel is None:
+            channel = f"{settings.BROKER_CHANNEL_PREFIX}{user_id}"
+        return channel
+
+    async def connect(self, user_id: UUID, websocket, since: Optional[int] = None, current_seq: int = 0) -> bool:
+        """Добавить новое соединение для пользователя.
+
+        С since соединение сначала получает события после since из буфера;
+        False - буфер их уже вытеснил и клиенту нужна синхронизация через /chat/sync.
+        """
+        user_id = as_uuid(user_id)
+        if user_id not in self.active_connections:
+            self.active_connections[user_id] = {}
+            channel = self.channel_for(user_id)
+            self._channels[user_id] = channel
+            self._channel_users[channel] = user_id
+            await self.broker.subscribe(channel, self._deliver)
+            self.presence_writer.mark_online(user_id)
+
+        connection = ClientConnection(self, user_id, websocket,
+                                      settings.WEBSOCKET_SEND_QUEUE_SIZE, settings.WEBSOCKET_OVERFLOW_POLICY)
+        resumed = True
+        if since is not None:
+            # Без await между выборкой из буфера и регистрацией соединения: каждое событие
+            # попадет в сокет либо из буфера, либо через брокер, и пропущенное уйдет первым
+            missed = self.replay.replay(user_id, since, current_seq)
+            resumed = missed is not None
+            for message_json in missed or ():
+                connection.enqueue(message_json)
+        connection.start()
+        self.active_connections[user_id][websocket] = connection
+        self.user_status[user_id] = datetime.now()
+        await self.presence.heartbeat(user_id)
+
+        print(f"User {user_id} connected. Total connections: {len(self.active_connections)}")
+        return resumed
 
     async def disconnect(self, user_id: UUID, websocket):
         """Удалить соединение пользователя"""
-        user_id_str = str(user_id)
-        if user_id_str in self.active_connections:
-            self.active_connections[user_id_str].discard(websocket)
+        user_id = as_uuid(user_id)
+        if user_id in self.active_connections:
+            connection = self.active_connections[user_id].pop(websocket, None)
+            if connection is not None:
+                connection.close()
+                self.closed_sent += connection.sent
+                self.closed_dropped += connection.dropped
+
+            if not self.active_connections[user_id]:
+                del self.active_connections[user_id]
+                del self.user_status[user_id]
+                channel = self._channels.pop(user_id)
+                self._channel_users.pop(channel, None)
+                await self.broker.unsubscribe(channel, self._deliver)
+                await self.presence.remove(user_id)
+                # Пользователь может оставаться онлайн через другой узел
+                if not await self.presence.is_online(user_id):
+                    self.presence_writer.mark_offline(user_id, datetime.utcnow())
+                print(f"User {user_id} fully disconnected")
 
-            if not self.active_connections[user_id_str]:
-                del self.active_connections[user_id_str]
-                del self.user_status[user_id_str]
-                print(f"User {user_id_str} fully disconnected")
+        print(f"User {user_id} disconnected. Total connections: {len(self.active_connections)}")
 
-        print(f"User {user_id_str} disconnected. Total connections: {len(self.active_connections)}")
+    async def heartbeat(self, user_id: UUID):
+        """Продлить присутствие пользователя (ping от клиента)"""
+        user_id = as_uuid(user_id)
+        if user_id in self.active_connections:
+            self.user_status[user_id] = datetime.now()
+            await self.presence.heartbeat(user_id)
 
     def get_connections(self, user_id: UUID):
         """Получить все соединения пользователя"""
-        user_id_str = str(user_id)
-        return self.active_connections.get(user_id_str, set())
-
-    async def send_personal_message(self, message: dict, user_id: UUID):
-        """Отправить личное сообщение пользователю"""
-        user_id_str = str(user_id)
-        connections = self.active_connections.get(user_id_str, set())
-
-        if connections:
-            message_json = json.dumps(message, default=str)
-            for connection in connections:
-                try:
-                    await connection.send_text(message_json)
-                except Exception as e:
-                    print(f"Error sending message to {user_id_str}: {e}")
-                    await self.disconnect(user_id, connection)
-            return True
-        return False
+        return set(self.active_connections.get(as_uuid(user_id), {}))
+
+    async def drop_connection(self, connection: ClientConnection, code: int):
+        """Закрыть сокет медленного клиента и убрать его из менеджера"""
+        await self.disconnect(connection.user_id, connection.websocket)
+        try:
+            await connection.websocket.close(code=code)
+        except Exception as e:
+            print(f"Error closing socket of {connection.user_id}: {e}")
+
+    def get_metrics(self) -> dict:
+        """Глубина исходящих очередей, потери и отключения медленных клиентов"""
+        connections = [c for conns in self.active_connections.values() for c in conns.values()]
+        depths = [len(c.queue) for c in connections]
+        return {
+            "users": len(self.active_connections),
+            "connections": len(connections),
+            "queue_size_limit": settings.WEBSOCKET_SEND_QUEUE_SIZE,
+            "overflow_policy": settings.WEBSOCKET_OVERFLOW_POLICY,
+            "queued_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "queue_depth_high_water": max((c.max_depth for c in connections), default=0),
+            "sent_total": self.closed_sent + sum(c.sent for c in connections),
+            "dropped_total": self.closed_dropped + sum(c.dropped for c in connections),
+            "slow_disconnects": self.slow_disconnects,
+            "replay": self.replay.stats(),
+        }
+
+    async def send_personal_message(self, message: Union[Event, dict], user_id: UUID):
+        """Отправить личное сообщение пользователю через брокер"""
+        if not isinstance(message, Event):
+            message = Event(**message)
+        # Кодировка кэшируется в событии и переиспользуется для всех получателей и сокетов
+        message_json = message.encode()
+        seqs = message.payload.get("seqs")
+        if seqs:
+            seq = seqs.get(str(as_uuid(user_id)))
+            if seq is not None:
+                self.replay.append(as_uuid(user_id), seq, message_json)
+        receivers = await self.broker.publish(self.channel_for(user_id), message_json)
+        return receivers > 0
+
+    async def send_to_users(self, event: Event, user_ids: List[UUID]):
+        """Отправить одно событие нескольким пользователям, сериализуя его один раз"""
+        for user_id in dict.fromkeys(user_ids):
+            await self.send_personal_message(event, user_id)
+
+    async def _deliver(self, channel: str, message_json: str):
+        """Доставить сообщение из брокера в локальные сокеты пользователя"""
+        user_id = self._channel_users.get(channel)
+        if user_id is None:
+            return
+        # Только постановка в очереди: отправкой занимаются писатели соединений,
+        # поэтому медленный клиент не задерживает отправителя
+        for connection in list(self.active_connections.get(user_id, {}).values()):
+            connection.enqueue(message_json)
 
-    def is_user_online(self, user_id: UUID) -> bool:
-        """Проверить онлайн статус пользователя"""
-        user_id_str = str(user_id)
-        return user_id_str in self.active_connections and len(self.active_connections[user_id_str]) > 0
+    async def is_user_online(self, user_id: UUID) -> bool:
+        """Проверить онлайн статус пользователя на любом узле"""
+        return await self.presence.is_online(user_id)
 
-    async def get_online_users(self, user_ids: List[UUID]) -> Dict[str, bool]:
-        """Получить статус онлайн для списка пользователей"""
-        return {str(uid): self.is_user_online(uid) for uid in user_ids}
+    async def get_online_users(self, user_ids: List[UUID]) -> Dict[UUID, bool]:
+        """Получить статус онлайн для списка пользователей одним запросом"""
+        return await self.presence.get_online(user_ids)
 
 
 # Глобальный экземпляр менеджера
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
@@ -0,0 +1,24 @@
+import asyncio
+import inspect
+
+import pytest
+
+from app.db.migrations import run_migrations
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """Тесты async def выполняются в собственном event loop - без pytest-asyncio"""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**arguments))
+    return True
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    """Временная SQLite база со схемой из миграций"""
+    url = f"sqlite+aiosqlite:///{tmp_path / 'test.db'}"
+    run_migrations(url)
+    return url
@@ -0,0 +1,34 @@
+from contextlib import asynccontextmanager
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app import models
+from app.database import configure_sqlite_engine, get_engine_options
+
+
+def enable_foreign_keys(dbapi_connection, connection_record):
+    # Как в Postgres: нарушение внешнего ключа - ошибка, а не молчаливая запись
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+@asynccontextmanager
+async def open_database(database_url: str):
+    """Движок с профилем sqlite приложения и фабрика сессий; закрывается в том же event loop"""
+    engine = create_async_engine(database_url, **get_engine_options("sqlite"))
+    configure_sqlite_engine(engine)
+    event.listen(engine.sync_engine, "connect", enable_foreign_keys)
+    try:
+        yield async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    finally:
+        await engine.dispose()
+
+
+async def create_user(db: AsyncSession, name: str) -> models.User:
+    user = models.User(id=uuid.uuid4(), username=name, email=f"{name}@example.com", hashed_password="x")
+    db.add(user)
+    await db.commit()
+    return user
@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+from uuid import uuid4
+
+from app.auth_cache import AuthCache
+from app.broker import InMemoryBroker
+
+
+async def test_invalidation_reaches_other_workers():
+    broker = InMemoryBroker()
+    # Два воркера со своими кэшами на общем брокере
+    local, remote = AuthCache(100, 60), AuthCache(100, 60)
+    await local.start(broker)
+    await remote.start(broker)
+
+    user = SimpleNamespace(id=uuid4())
+    for cache in (local, remote):
+        cache.set_token("token", str(user.id))
+        cache.set_user(user)
+
+    await local.publish_invalidation(user.id)
+    for cache in (local, remote):
+        assert cache.get_user(str(user.id)) is None
+        assert cache.get_token("token") is None
+
+    await local.stop()
+    await remote.stop()
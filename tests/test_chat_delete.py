@@ -0,0 +1,28 @@
+from sqlalchemy import func, select
+
+from app import models
+from app.crud import CRUDChat
+from app.message_service import MessageService
+from app.routes.chat import delete_chat_by_id
+from tests.helpers import create_user, open_database
+
+
+async def test_delete_chat_with_read_state_and_last_message(database_url):
+    async with open_database(database_url) as sessions:
+        async with sessions() as db:
+            alice = await create_user(db, "alice")
+            bob = await create_user(db, "bob")
+            service = MessageService(db)
+            first, _ = await service.create_message(alice.id, bob.id, content="hi")
+            await service.create_message(bob.id, alice.id, content="hello", reply_to_id=first.id)
+            await db.commit()
+            await CRUDChat(db).mark_read_up_to(first, bob.id)
+            await db.commit()
+
+            response = await delete_chat_by_id(first.chat_id, current_user=alice, db=db)
+            assert response == {"message": "Chat deleted successfully"}
+
+        async with sessions() as db:
+            for model in (models.Chat, models.Message, models.ChatReadState, models.ChatInbox):
+                count = await db.scalar(select(func.count()).select_from(model))
+                assert count == 0, model.__tablename__
@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+from sqlalchemy import select, update
+
+from app import models
+from app.database import make_read_sessionmaker
+from tests.helpers import create_user, open_database
+
+
+async def test_reads_do_not_wait_for_open_write_transaction(database_url):
+    async with open_database(database_url) as sessions:
+        reads = make_read_sessionmaker(sessions)
+        async with sessions() as db:
+            alice = await create_user(db, "alice")
+
+        async def second_writer():
+            async with sessions() as db:
+                await db.execute(update(models.User).values(last_seen=None))
+                await db.commit()
+
+        async with sessions() as writer:
+            # Транзакция записи открыта и ждет чего-то медленного
+            await writer.execute(update(models.User).where(models.User.id == alice.id).values(online_status=True))
+
+            started = time.perf_counter()
+            async with reads() as reader:
+                online_status = await reader.scalar(select(models.User.online_status))
+            assert time.perf_counter() - started < 0.5
+            # Незафиксированная запись читателю не видна
+            assert online_status is False
+
+            # Второй писатель ждет своей очереди, а не получает "database is locked"
+            pending = asyncio.create_task(second_writer())
+            await asyncio.sleep(0.2)
+            assert not pending.done()
+            await writer.commit()
+
+        await pending
+        async with reads() as reader:
+            assert await reader.scalar(select(models.User.online_status)) is True
@@ -0,0 +1,36 @@
+from sqlalchemy import select
+
+from app import models
+from app.message_service import MessageService
+from app.routes.chat import mark_read_and_notify
+from tests.helpers import create_user, open_database
+
+
+async def test_read_event_carries_only_the_watermark(database_url):
+    async with open_database(database_url) as sessions:
+        async with sessions() as db:
+            alice = await create_user(db, "alice")
+            bob = await create_user(db, "bob")
+            messages = []
+            for number in range(3):
+                message, _ = await MessageService(db).create_message(alice.id, bob.id, content=f"message {number}")
+                await db.commit()
+                messages.append(message)
+            last = messages[-1]
+            # rollback внутри mark_read_and_notify истекает объекты - запоминаем значения заранее
+            alice_id = alice.id
+            up_to_message_id, last_read_created_at = str(last.id), last.created_at.isoformat()
+
+            assert await mark_read_and_notify(db, last, bob.id) == 3
+            # Повторное прочтение не сдвигает отметку и ничего не шлет
+            assert await mark_read_and_notify(db, messages[0], bob.id) == 0
+
+            result = await db.execute(select(models.UserChange).where(
+                models.UserChange.user_id == alice_id, models.UserChange.kind == "message_read"))
+            changes = result.scalars().all()
+            assert len(changes) == 1
+            payload = changes[0].payload
+            assert "message_ids" not in payload
+            assert payload["up_to_message_id"] == up_to_message_id
+            assert payload["last_read_created_at"] == last_read_created_at
+            assert payload["read_count"] == 3
@@ -0,0 +1,163 @@
+import hashlib
+from email.utils import formatdate
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app import media
+from app.config import settings
+from app.media import media_response, parse_range
+
+CONTENT = bytes(range(256)) * 4  # 1024 байта
+
+
+def test_parse_range_single_and_open_ended():
+    assert parse_range("bytes=0-99", 1000) == [(0, 99)]
+    assert parse_range("bytes=900-", 1000) == [(900, 999)]
+    assert parse_range("bytes=900-5000", 1000) == [(900, 999)]
+
+
+def test_parse_range_suffix():
+    assert parse_range("bytes=-100", 1000) == [(900, 999)]
+    # Суффикс длиннее файла - весь файл
+    assert parse_range("bytes=-5000", 1000) == [(0, 999)]
+    assert parse_range("bytes=-0", 1000) == []
+
+
+def test_parse_range_merges_overlapping_and_adjacent():
+    assert parse_range("bytes=0-99,50-149,150-199", 1000) == [(0, 199)]
+    assert parse_range("bytes=500-599,0-9,-10", 1000) == [(0, 9), (500, 599), (990, 999)]
+
+
+def test_parse_range_past_end_is_unsatisfiable():
+    assert parse_range("bytes=1000-", 1000) == []
+    assert parse_range("bytes=2000-3000,5000-", 1000) == []
+    # Хотя бы один отрезок внутри файла - ответ частичный
+    assert parse_range("bytes=2000-3000,0-0", 1000) == [(0, 0)]
+
+
+def test_parse_range_zero_length_file():
+    assert parse_range("bytes=0-", 0) == []
+    assert parse_range("bytes=-10", 0) == []
+
+
+def test_parse_range_invalid_is_ignored():
+    for header in ("items=0-1", "bytes=", "bytes=5-1", "bytes=a-b", "bytes=-", "bytes=10"):
+        assert parse_range(header, 1000) is None, header
+
+
+def test_parse_range_too_many_ranges_is_ignored():
+    many = ",".join(f"{i * 10}-{i * 10}" for i in range(settings.MEDIA_MAX_RANGES + 1))
+    assert parse_range(f"bytes={many}", 1000) is None
+    allowed = ",".join(f"{i * 10}-{i * 10}" for i in range(settings.MEDIA_MAX_RANGES))
+    assert len(parse_range(f"bytes={allowed}", 1000)) == settings.MEDIA_MAX_RANGES
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(media, "UPLOAD_DIR", tmp_path)
+    (tmp_path / f"{hashlib.sha256(CONTENT).hexdigest()}.bin").write_bytes(CONTENT)
+    (tmp_path / "empty.bin").write_bytes(b"")
+
+    app = FastAPI()
+
+    @app.api_route("/uploads/{filename}", methods=["GET", "HEAD"])
+    async def uploaded_file(filename: str, request: Request):
+        return await media_response(request, filename)
+
+    return TestClient(app)
+
+
+BLOB_URL = f"/uploads/{hashlib.sha256(CONTENT).hexdigest()}.bin"
+ETAG = f'"{hashlib.sha256(CONTENT).hexdigest()}"'
+
+
+def test_full_response_has_validators(client):
+    response = client.get(BLOB_URL)
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["etag"] == ETAG
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+def test_single_range(client):
+    response = client.get(BLOB_URL, headers={"Range": "bytes=-16"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 1008-1023/1024"
+    assert response.content == CONTENT[-16:]
+
+
+def test_multiple_ranges(client):
+    response = client.get(BLOB_URL, headers={"Range": "bytes=0-3,100-103"})
+    assert response.status_code == 206
+    assert response.headers["content-type"].startswith("multipart/byteranges; boundary=")
+    assert int(response.headers["content-length"]) == len(response.content)
+    assert b"Content-Range: bytes 0-3/1024" in response.content
+    assert b"Content-Range: bytes 100-103/1024" in response.content
+
+
+def test_range_past_end_is_416(client):
+    response = client.get(BLOB_URL, headers={"Range": "bytes=5000-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1024"
+
+
+def test_zero_length_file(client):
+    response = client.get("/uploads/empty.bin")
+    assert response.status_code == 200
+    assert response.content == b""
+
+    response = client.get("/uploads/empty.bin", headers={"Range": "bytes=0-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */0"
+
+
+def test_too_many_ranges_returns_whole_file(client):
+    many = ",".join(f"{i * 10}-{i * 10}" for i in range(settings.MEDIA_MAX_RANGES + 1))
+    response = client.get(BLOB_URL, headers={"Range": f"bytes={many}"})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+def test_if_range_matching_etag_returns_part(client):
+    response = client.get(BLOB_URL, headers={"Range": "bytes=0-9", "If-Range": ETAG})
+    assert response.status_code == 206
+    assert response.content == CONTENT[:10]
+
+
+def test_if_range_stale_returns_whole_file(client):
+    response = client.get(BLOB_URL, headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+    stale_date = formatdate(0, usegmt=True)
+    response = client.get(BLOB_URL, headers={"Range": "bytes=0-9", "If-Range": stale_date})
+    assert response.status_code == 200
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since(client):
+    future = formatdate(4102444800, usegmt=True)  # 2100 год: по дате файл не изменялся
+    response = client.get(BLOB_URL, headers={"If-None-Match": '"other"', "If-Modified-Since": future})
+    assert response.status_code == 200
+
+    epoch = formatdate(0, usegmt=True)
+    response = client.get(BLOB_URL, headers={"If-None-Match": f"W/{ETAG}", "If-Modified-Since": epoch})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = client.get(BLOB_URL, headers={"If-Modified-Since": future})
+    assert response.status_code == 304
+
+
+def test_head_has_no_body(client):
+    response = client.head(BLOB_URL)
+    assert response.status_code == 200
+    assert response.headers["content-length"] == "1024"
+    assert response.content == b""
+
+    response = client.head(BLOB_URL, headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers["content-length"] == "10"
+    assert response.headers["content-range"] == "bytes 10-19/1024"
+    assert response.content == b""
@@ -0,0 +1,15 @@
+from passlib.context import CryptContext
+
+from app.passwords import pwd_context, verify_password
+
+
+async def test_hash_of_previous_scheme_verifies_and_is_rehashed():
+    # Хеш, созданный до смены PASSWORD_HASH_SCHEME
+    previous = "bcrypt" if pwd_context.default_scheme() != "bcrypt" else "scrypt"
+    stored = CryptContext(schemes=[previous]).hash("secret")
+
+    password_ok, new_hash = await verify_password("secret", stored)
+    assert password_ok
+    assert pwd_context.identify(new_hash) == pwd_context.default_scheme()
+
+    assert await verify_password("wrong", stored) == (False, None)
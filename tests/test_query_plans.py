@@ -0,0 +1,15 @@
+from app.db.check_query_plans import check_plans, find_scans
+
+
+async def test_hot_queries_do_not_scan_tables(database_url, capsys):
+    ok = await check_plans(database_url)
+    assert ok, capsys.readouterr().out
+
+
+def test_find_scans_ignores_index_searches():
+    plan = [
+        "SEARCH messages USING INDEX ix_messages_chat_created (chat_id=?)",
+        "SCAN CONSTANT ROW",
+        "SCAN users",
+    ]
+    assert find_scans(plan) == ["SCAN users"]
@@ -0,0 +1,17 @@
+from app.message_service import MessageService
+from app.routes.chat import reply_message
+from tests.helpers import create_user, open_database
+
+
+async def test_reply_to_own_message_goes_to_other_participant(database_url):
+    async with open_database(database_url) as sessions:
+        async with sessions() as db:
+            alice = await create_user(db, "alice")
+            bob = await create_user(db, "bob")
+            original, _ = await MessageService(db).create_message(alice.id, bob.id, content="hi")
+            await db.commit()
+
+            reply = await reply_message(original.id, content="are you there?", current_user=alice, db=db)
+            assert reply.sender_id == alice.id
+            assert reply.receiver_id == bob.id
+            assert reply.reply_to_id == original.id
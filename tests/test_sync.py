@@ -0,0 +1,39 @@
+from sqlalchemy import func, select
+
+from app import models
+from app.config import settings
+from app.message_service import MessageService
+from app.routes.chat import sync_changes
+from tests.helpers import create_user, open_database
+
+
+async def test_change_feed_is_pruned_and_old_since_resets(database_url, monkeypatch):
+    monkeypatch.setattr(settings, "CHANGE_FEED_MAX_ROWS", 5)
+    monkeypatch.setattr(settings, "CHANGE_FEED_PRUNE_EVERY", 2)
+
+    async with open_database(database_url) as sessions:
+        async with sessions() as db:
+            alice = await create_user(db, "alice")
+            bob = await create_user(db, "bob")
+            for number in range(12):
+                await MessageService(db).create_message(alice.id, bob.id, content=f"message {number}")
+                await db.commit()
+
+            rows = await db.scalar(select(func.count()).select_from(models.UserChange)
+                                   .where(models.UserChange.user_id == alice.id))
+            assert rows <= settings.CHANGE_FEED_MAX_ROWS + settings.CHANGE_FEED_PRUNE_EVERY
+
+            # Последние изменения еще в ленте
+            response = await sync_changes(since=9, limit=100, current_user=alice, db=db)
+            assert not response.reset
+            assert [change.seq for change in response.changes] == [10, 11, 12]
+
+            # Изменения после since удалены - клиент должен перезагрузиться
+            response = await sync_changes(since=0, limit=100, current_user=alice, db=db)
+            assert response.reset and response.seq == 12
+
+            response = await sync_changes(since=12, limit=100, current_user=alice, db=db)
+            assert not response.reset and response.changes == []
+
+            response = await sync_changes(since=13, limit=100, current_user=alice, db=db)
+            assert response.reset
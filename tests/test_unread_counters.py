@@ -0,0 +1,100 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app import models
+from app.database import set_sqlite_pragmas
+from app.message_service import MessageService
+from tests.helpers import create_user, enable_foreign_keys
+
+PARALLEL_SENDS = 2000
+CONNECTIONS = 8
+
+
+@asynccontextmanager
+async def open_racing_database(database_url: str):
+    """Несколько настоящих соединений без очереди писателей приложения и с транзакциями драйвера:
+    SELECT идет вне транзакции, BEGIN - перед первым INSERT/UPDATE, как до профиля sqlite"""
+    # Все отправки стартуют сразу и ждут соединения дольше pool_timeout по умолчанию
+    engine = create_async_engine(database_url, poolclass=AsyncAdaptedQueuePool,
+                                 pool_size=CONNECTIONS, max_overflow=0, pool_timeout=300)
+    event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+    event.listen(engine.sync_engine, "connect", enable_foreign_keys)
+    try:
+        yield async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    finally:
+        await engine.dispose()
+
+
+async def create_message_read_modify_write(db: AsyncSession, sender_id, receiver_id, content: str):
+    """Запись сообщения со счетчиком, увеличенным в Python (как до атомарного UPDATE)"""
+    chat = await MessageService(db).get_or_create_chat(sender_id, receiver_id)
+    message = models.Message(chat_id=chat.id, sender_id=sender_id, receiver_id=receiver_id, content=content)
+    db.add(message)
+    await db.flush()
+    if chat.user1_id == receiver_id:
+        chat.unread_count_user1 += 1
+    else:
+        chat.unread_count_user2 += 1
+    chat.last_message_id = message.id
+
+
+async def send_in_parallel(sessions, create_message, count: int):
+    """count отправок одновременно, каждая в своей сессии; возвращает ожидаемые счетчики"""
+    async with sessions() as db:
+        alice = await create_user(db, "alice")
+        bob = await create_user(db, "bob")
+
+    async def send(sender, receiver, number):
+        async with sessions() as db:
+            await create_message(db, sender.id, receiver.id, content=f"message {number}")
+            await db.commit()
+
+    # Каждая третья отправка - от bob: счетчики растут у обоих участников одновременно
+    senders = [(bob, alice) if number % 3 == 0 else (alice, bob) for number in range(count)]
+    await asyncio.gather(*(send(sender, receiver, number) for number, (sender, receiver) in enumerate(senders)))
+    return {
+        alice.id: sum(1 for _, receiver in senders if receiver is alice),
+        bob.id: sum(1 for _, receiver in senders if receiver is bob),
+    }
+
+
+async def chat_counters(db: AsyncSession):
+    chat = (await db.execute(select(models.Chat))).scalars().one()
+    return {chat.user1_id: chat.unread_count_user1, chat.user2_id: chat.unread_count_user2}
+
+
+async def create_message_atomic(db: AsyncSession, sender_id, receiver_id, content: str):
+    await MessageService(db).create_message(sender_id, receiver_id, content=content)
+
+
+async def test_parallel_sends_keep_exact_unread_counters(database_url):
+    async with open_racing_database(database_url) as sessions:
+        expected = await send_in_parallel(sessions, create_message_atomic, PARALLEL_SENDS)
+
+        async with sessions() as db:
+            assert await db.scalar(select(func.count()).select_from(models.Message)) == PARALLEL_SENDS
+            assert await chat_counters(db) == expected
+
+            inbox = (await db.execute(select(models.ChatInbox))).scalars().all()
+            assert {entry.user_id: entry.unread_count for entry in inbox} == expected
+
+            users = (await db.execute(select(models.User))).scalars().all()
+            # Каждое сообщение - по одной записи в ленте изменений обоих участников
+            assert {user.id: user.change_seq for user in users} == {
+                user_id: PARALLEL_SENDS for user_id in expected}
+
+
+async def test_read_modify_write_loses_increments(database_url):
+    # Контроль: на тех же соединениях счетчик, увеличенный в Python, теряет увеличения -
+    # значит, тест выше действительно проверяет гонку
+    async with open_racing_database(database_url) as sessions:
+        expected = await send_in_parallel(sessions, create_message_read_modify_write, 300)
+
+        async with sessions() as db:
+            assert await db.scalar(select(func.count()).select_from(models.Message)) == 300
+            counters = await chat_counters(db)
+            assert sum(counters.values()) < sum(expected.values())
@@ -0,0 +1,32 @@
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from app.uploads import UploadSizeLimitMiddleware
+
+
+def make_client(max_body_size: int):
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimitMiddleware, max_body_size=max_body_size)
+    received = []
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        received.append(await file.read())
+        return {"size": len(received[-1])}
+
+    return TestClient(app), received
+
+
+def test_oversized_upload_rejected_before_route():
+    client, received = make_client(max_body_size=1024)
+    response = client.post("/upload", files={"file": ("big.bin", b"x" * 4096)})
+    assert response.status_code == 413
+    assert response.json() == {"detail": "File is too large"}
+    assert received == []
+
+
+def test_upload_within_limit_passes():
+    client, received = make_client(max_body_size=1024)
+    response = client.post("/upload", files={"file": ("small.bin", b"x" * 100)})
+    assert response.status_code == 200
+    assert response.json() == {"size": 100}